@@ -0,0 +1,194 @@
+"""
+Synthetic inputs for the benchmarks: an empty Firefox profile database with
+optional history, and Netscape bookmark HTML of a given size and shape. Both
+are generated from a seed so every run measures the same data.
+"""
+
+import os
+import random
+import sqlite3
+import time
+from typing import Iterator, List, Tuple
+
+from utils.places import bulk_insert_places
+
+# Subset of the Firefox places schema the importer reads or writes
+PLACES_SCHEMA = """
+CREATE TABLE moz_origins (
+    id INTEGER PRIMARY KEY, prefix TEXT NOT NULL, host TEXT NOT NULL, frecency INTEGER NOT NULL,
+    recalc_frecency INTEGER NOT NULL DEFAULT 0, alt_frecency INTEGER,
+    recalc_alt_frecency INTEGER NOT NULL DEFAULT 0, UNIQUE (prefix, host)
+);
+CREATE TABLE moz_places (
+    id INTEGER PRIMARY KEY, url LONGVARCHAR, title LONGVARCHAR, rev_host LONGVARCHAR,
+    visit_count INTEGER DEFAULT 0, hidden INTEGER DEFAULT 0 NOT NULL, typed INTEGER DEFAULT 0 NOT NULL,
+    frecency INTEGER DEFAULT -1 NOT NULL, last_visit_date INTEGER, guid TEXT,
+    foreign_count INTEGER DEFAULT 0 NOT NULL, url_hash INTEGER DEFAULT 0 NOT NULL,
+    description TEXT, preview_image_url TEXT, site_name TEXT,
+    origin_id INTEGER REFERENCES moz_origins(id), recalc_frecency INTEGER NOT NULL DEFAULT 0,
+    alt_frecency INTEGER, recalc_alt_frecency INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE moz_historyvisits (
+    id INTEGER PRIMARY KEY, from_visit INTEGER, place_id INTEGER, visit_date INTEGER,
+    visit_type INTEGER, session INTEGER, source INTEGER DEFAULT 0 NOT NULL, triggeringPlaceId INTEGER
+);
+CREATE TABLE moz_bookmarks (
+    id INTEGER PRIMARY KEY, type INTEGER, fk INTEGER DEFAULT NULL, parent INTEGER, position INTEGER,
+    title LONGVARCHAR, keyword_id INTEGER, folder_type TEXT, dateAdded INTEGER, lastModified INTEGER,
+    guid TEXT, syncStatus INTEGER NOT NULL DEFAULT 0, syncChangeCounter INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE moz_bookmarks_deleted (guid TEXT PRIMARY KEY, dateRemoved INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE moz_keywords (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, keyword TEXT UNIQUE, place_id INTEGER, post_data TEXT
+);
+CREATE INDEX moz_places_url_hashindex ON moz_places (url_hash);
+CREATE INDEX moz_places_hostindex ON moz_places (rev_host);
+CREATE INDEX moz_places_visitcount ON moz_places (visit_count);
+CREATE INDEX moz_places_frecencyindex ON moz_places (frecency);
+CREATE INDEX moz_places_lastvisitdateindex ON moz_places (last_visit_date);
+CREATE UNIQUE INDEX moz_places_guid_uniqueindex ON moz_places (guid);
+CREATE INDEX moz_places_originidindex ON moz_places (origin_id);
+CREATE INDEX moz_historyvisits_placedateindex ON moz_historyvisits (place_id, visit_date);
+CREATE INDEX moz_historyvisits_dateindex ON moz_historyvisits (visit_date);
+CREATE INDEX moz_bookmarks_itemindex ON moz_bookmarks (fk, type);
+CREATE INDEX moz_bookmarks_parentindex ON moz_bookmarks (parent, position);
+CREATE INDEX moz_bookmarks_itemlastmodifiedindex ON moz_bookmarks (fk, lastModified);
+CREATE INDEX moz_bookmarks_dateaddedindex ON moz_bookmarks (dateAdded);
+CREATE UNIQUE INDEX moz_bookmarks_guid_uniqueindex ON moz_bookmarks (guid);
+"""
+
+# id, parent, position, title, guid
+ROOTS = [
+    (1, 0, 0, "", "root________"),
+    (2, 1, 0, "menu", "menu________"),
+    (3, 1, 1, "toolbar", "toolbar_____"),
+    (4, 1, 2, "tags", "tags________"),
+    (5, 1, 3, "unfiled", "unfiled_____"),
+    (6, 1, 4, "mobile", "mobile______"),
+]
+
+SCHEMES = ["https://", "http://"]
+
+
+def synthetic_url(rng: random.Random, hosts: int) -> str:
+    host = rng.randrange(hosts)
+    return f"{rng.choice(SCHEMES)}site{host}.example.com/page/{rng.randrange(1 << 20)}"
+
+
+def create_places_db(path: str, history: int = 0, seed: int = 0) -> str:
+    """
+    Create a places database with the bookmark roots and `history` visited
+    places spread over `history // 20` hosts. Existing files are overwritten.
+    """
+    for stale in [path, path + "-wal", path + "-shm"]:
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript("PRAGMA journal_mode = WAL;" + PLACES_SCHEMA)
+        now = int(time.time() * 1_000_000)
+        conn.executemany(
+            "INSERT INTO moz_bookmarks (id, type, parent, position, title, dateAdded, lastModified, guid) "
+            "VALUES (?, 2, ?, ?, ?, ?, ?, ?)",
+            [(id, parent, position, title, now, now, guid) for id, parent, position, title, guid in ROOTS],
+        )
+
+        if history:
+            rng = random.Random(seed)
+            urls = [synthetic_url(rng, max(history // 20, 1)) for _ in range(history)]
+            bulk_insert_places(conn.cursor(), urls, bulk_origins=True)
+            conn.execute(
+                "INSERT INTO moz_historyvisits (place_id, visit_date, visit_type) "
+                "SELECT id, :now - id * 1000000, 1 FROM moz_places",
+                {"now": now},
+            )
+            conn.execute(
+                "UPDATE moz_places SET visit_count = 1, frecency = 100, last_visit_date = :now - id * 1000000",
+                {"now": now},
+            )
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    return path
+
+
+def folder_shape(links: int, depth: int, fanout: int) -> List[Tuple[int, int]]:
+    """
+    (folder depth, links) for every folder in document order. Links are spread
+    evenly over the leaf folders.
+    """
+    leaves = fanout**depth
+    shape: List[Tuple[int, int]] = []
+    leaf = 0
+
+    def walk(level: int):
+        nonlocal leaf
+        if level == depth:
+            shape.append((level, links * (leaf + 1) // leaves - links * leaf // leaves))
+            leaf += 1
+            return
+        shape.append((level, 0))
+        for _ in range(fanout):
+            walk(level + 1)
+
+    for _ in range(fanout):
+        walk(1)
+    return shape
+
+
+def generate_html(links: int, depth: int = 2, fanout: int = 10, history: int = 0, seed: int = 0) -> Iterator[str]:
+    """
+    Yield the lines of a bookmark document with `fanout` folders per level,
+    `depth` levels of folders and `links` bookmarks in the deepest folders.
+    About a tenth of the links reuse a URL of the generated history, so imports
+    also resolve existing places.
+    """
+    rng = random.Random(seed)
+    history_rng = random.Random(seed)
+    history_urls = [synthetic_url(history_rng, max(history // 20, 1)) for _ in range(history)]
+    hosts = max(links // 20, 1)
+
+    yield "<!DOCTYPE NETSCAPE-Bookmark-file-1>"
+    yield '<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">'
+    yield "<TITLE>Bookmarks</TITLE>"
+    yield "<H1>Bookmarks</H1>"
+    yield "<DL><p>"
+
+    open_levels = 0
+    folder = 0
+    link = 0
+    for level, count in folder_shape(links, max(depth, 1), max(fanout, 1)):
+        while open_levels >= level:
+            yield "    " * open_levels + "</DL><p>"
+            open_levels -= 1
+        indent = "    " * level
+        yield f"{indent}<DT><H3>Folder {folder}</H3>"
+        yield f"{indent}<DL><p>"
+        open_levels = level
+        folder += 1
+
+        for _ in range(count):
+            if history_urls and rng.random() < 0.1:
+                url = rng.choice(history_urls)
+            else:
+                url = synthetic_url(rng, hosts)
+            yield f'{indent}    <DT><A HREF="{url}">Link {link} &amp; more</A>'
+            link += 1
+
+    while open_levels > 0:
+        yield "    " * open_levels + "</DL><p>"
+        open_levels -= 1
+    yield "</DL><p>"
+
+
+def write_html(path: str, links: int, depth: int = 2, fanout: int = 10, history: int = 0, seed: int = 0) -> int:
+    """
+    Write the document of `generate_html` to `path` and return its size in bytes.
+    """
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        for line in generate_html(links, depth, fanout, history, seed):
+            f.write(line + "\n")
+    return os.path.getsize(path)
@@ -0,0 +1,276 @@
+"""
+Benchmark the import pipeline on synthetic data.
+
+    python -m bench.run --links 1000 10000 100000 --history 10000 --output bench.json
+
+Every size runs in a fresh process against a freshly generated database, so
+peak RSS is per size. The JSON report lists the latency and throughput of each
+stage and can be compared across commits.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from bench.fixtures import create_places_db, write_html
+from bookmarks.bookmark import determine_root_guid, fetch_bookmark, insert_tree, remove_tree_if_exists
+from bookmarks.parser import parse_file_parallel, parse_html_bookmark, parse_html_bookmark_stream
+from bookmarks.sync import sync_tree
+from utils.connection import STATEMENT_CACHE, ConnectionTuning, TunedConnection
+from utils.fetch import CHUNK_SIZE
+from utils.guid import generate_guid
+from utils.hash import hash_function
+from utils.places import get_host_and_port, get_prefix
+from utils.triggers import CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER, CREATE_PLACES_AFTERINSERT_TRIGGER
+
+STAGES = [
+    "parse_lines",
+    "parse_stream",
+    "parse_compact",
+    "parse_parallel",
+    "insert",
+    "replace",
+    "sync",
+    "insert_bulk_origins",
+    "insert_compact",
+    "insert_tuned",
+    "replace_tuned",
+]
+
+
+def peak_rss_kb() -> int:
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def connect(db_path: str, bulk_origins: bool = False, tuned: bool = False) -> sqlite3.Connection:
+    if tuned:
+        conn = sqlite3.connect(db_path, factory=TunedConnection, cached_statements=STATEMENT_CACHE)
+        conn.tune(ConnectionTuning())
+        conn.relax_synchronous()
+    else:
+        conn = sqlite3.connect(db_path)
+    conn.create_function("HASH", -1, hash_function)
+    conn.create_function("GENERATE_GUID", 0, generate_guid)
+    conn.create_function("get_prefix", 1, get_prefix)
+    conn.create_function("get_host_and_port", 1, get_host_and_port)
+    conn.execute(CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER)
+    if not bulk_origins:
+        conn.execute(CREATE_PLACES_AFTERINSERT_TRIGGER)
+    return conn
+
+
+def read_chunks(path: str):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def tree_bytes(path: str, compact: bool) -> int:
+    """
+    Memory held by the parsed tree, as seen by tracemalloc.
+    """
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tree = parse_html_bookmark_stream(read_chunks(path), compact)
+        return tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def count_items(tree) -> int:
+    return sum(1 + count_items(item.items) if hasattr(item, "items") else 1 for item in tree)
+
+
+def run_case(links: int, depth: int, fanout: int, history: int, seed: int, stages: List[str], workdir: str) -> Dict:
+    html_path = os.path.join(workdir, f"bookmarks-{links}.html")
+    db_path = os.path.join(workdir, f"places-{links}.sqlite")
+    timings: Dict[str, Dict] = {}
+
+    def timed(name: str, items: int, fn):
+        start = time.perf_counter()
+        cpu = time.process_time()
+        result = fn()
+        seconds = time.perf_counter() - start
+        timings[name] = {
+            "seconds": round(seconds, 6),
+            "cpu_seconds": round(time.process_time() - cpu, 6),
+            "items": items,
+            "items_per_second": round(items / seconds, 1) if seconds else None,
+        }
+        return result
+
+    html_bytes = timed("generate_html", links, lambda: write_html(html_path, links, depth, fanout, history, seed))
+    timed("generate_db", history, lambda: create_places_db(db_path, history, seed))
+
+    if "parse_lines" in stages:
+
+        def parse_lines():
+            with open(html_path, "r", encoding="utf-8") as f:
+                return parse_html_bookmark(f.read())
+
+        timed("parse_lines", links, parse_lines)
+
+    tree = timed("parse_stream", links, lambda: parse_html_bookmark_stream(read_chunks(html_path)))
+    items = count_items(tree)
+    compact_tree = None
+    if {"parse_compact", "insert_compact"} & set(stages):
+        compact_tree = timed(
+            "parse_compact", links, lambda: parse_html_bookmark_stream(read_chunks(html_path), compact=True)
+        )
+
+    if "parse_parallel" in stages:
+        timed("parse_parallel", links, lambda: parse_file_parallel(html_path, compact=True))
+
+    def write(name: str, fn, bulk_origins: bool = False, path: str = db_path, tuned: bool = False):
+        conn = connect(path, bulk_origins, tuned)
+        try:
+            cursor = conn.cursor()
+            root_id = fetch_bookmark(cursor, determine_root_guid("toolbar")).id
+
+            def run():
+                result = fn(cursor, root_id)
+                conn.commit()
+                return result
+
+            return timed(name, items, run)
+        finally:
+            conn.close()
+
+    if "insert_bulk_origins" in stages:
+        bulk_path = db_path + ".bulk"
+        shutil.copyfile(db_path, bulk_path)
+        write("insert_bulk_origins", lambda db, root_id: insert_tree(db, tree, root_id, bulk_origins=True), True, bulk_path)
+
+    if "insert_compact" in stages:
+        compact_path = db_path + ".compact"
+        shutil.copyfile(db_path, compact_path)
+        write("insert_compact", lambda db, root_id: insert_tree(db, compact_tree, root_id), path=compact_path)
+
+    def replace(db, root_id):
+        remove_tree_if_exists(db, tree, root_id)
+        insert_tree(db, tree, root_id)
+
+    # The same writes with the fast connection settings, on their own copy
+    if {"insert_tuned", "replace_tuned"} & set(stages):
+        tuned_path = db_path + ".tuned"
+        shutil.copyfile(db_path, tuned_path)
+        write("insert_tuned", lambda db, root_id: insert_tree(db, tree, root_id), path=tuned_path, tuned=True)
+        if "replace_tuned" in stages:
+            write("replace_tuned", replace, path=tuned_path, tuned=True)
+
+    if {"insert", "replace", "sync"} & set(stages):
+        write("insert", lambda db, root_id: insert_tree(db, tree, root_id))
+    if "replace" in stages:
+        write("replace", replace)
+    if "sync" in stages:
+        write("sync", lambda db, root_id: sync_tree(db, tree, root_id))
+
+    # Measured last, tracemalloc slows down everything it traces
+    memory = {"nested": tree_bytes(html_path, False), "compact": tree_bytes(html_path, True)}
+    del tree, compact_tree
+
+    return {
+        "links": links,
+        "depth": depth,
+        "fanout": fanout,
+        "history": history,
+        "items": items,
+        "html_bytes": html_bytes,
+        "db_bytes": os.path.getsize(db_path),
+        "peak_rss_kb": peak_rss_kb(),
+        "tree_bytes": memory,
+        "stages": timings,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main(args: argparse.Namespace):
+    stages = args.stages or STAGES
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        print(f"Unknown stages: {', '.join(sorted(unknown))}. Expected any of: {', '.join(STAGES)}")
+        exit(1)
+
+    report = {
+        "revision": git_revision(),
+        "created": int(time.time()),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "cases": [],
+    }
+
+    workdir = tempfile.mkdtemp(prefix="bench-", dir=args.workdir)
+    try:
+        for links in args.links:
+            print(f"Benchmarking {links} links...", flush=True)
+            # A fresh process per size keeps peak RSS comparable
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                case = executor.submit(
+                    run_case, links, args.depth, args.fanout, args.history, args.seed, stages, workdir
+                ).result()
+            report["cases"].append(case)
+
+            for name, timing in case["stages"].items():
+                print(f"  {name:<20} {timing['seconds']:>10.3f}s {timing['items_per_second'] or 0:>14,.0f}/s")
+            print(f"  {'peak rss':<20} {case['peak_rss_kb'] / 1024:>10.1f} MiB")
+            for name, size in case["tree_bytes"].items():
+                print(f"  {name + ' tree':<20} {size / 1024 / 1024:>10.1f} MiB")
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the bookmark importer on synthetic data.")
+    arg_parser.add_argument(
+        "--links", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Bookmark counts to benchmark."
+    )
+    arg_parser.add_argument("--depth", type=int, default=2, help="Levels of folders (default: 2).")
+    arg_parser.add_argument("--fanout", type=int, default=10, help="Subfolders per folder (default: 10).")
+    arg_parser.add_argument("--history", type=int, default=10_000, help="Places already in the database.")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Seed of the generated data.")
+    arg_parser.add_argument("--stages", nargs="+", metavar="STAGE", help=f"Stages to run (default: {' '.join(STAGES)}).")
+    arg_parser.add_argument("--workdir", help="Directory for the generated files (default: system temp).")
+    arg_parser.add_argument("--keep", action="store_true", help="Keep the generated files.")
+    arg_parser.add_argument("-o", "--output", help="Write the JSON report here instead of stdout.")
+    main(arg_parser.parse_args())
@@ -4,13 +4,18 @@ License, v. 2.0. If a copy of the MPL was not distributed with this file,
 you can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
+from array import array
 from sqlite3 import Cursor
 import time
-from typing import List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from bookmarks.bookmark_types import Bookmark, BookmarkFolder, BookmarkInfo, BookmarkTree
-from utils.places import maybe_insert_place
-from utils.guid import generate_guid
+from bookmarks.bookmark_types import AnyTree, Bookmark, BookmarkFolder, BookmarkInfo, BookmarkTree, CompactTree
+from utils.places import bulk_insert_places
+from utils.guid import guid_allocator
+from utils.metrics import stage
+from utils.normalize import NormalizeStats, UrlIndex, UrlNormalization
+from utils.scope import CONTAINER, Scope, ScopedItem, removable_ids
+from utils.sql import MAX_VARIABLES, chunked, placeholders
 
 TYPE_BOOKMARK = 1
 TYPE_FOLDER = 2
@@ -54,6 +59,38 @@ MOBILE_GUID = "mobile______"
 
 TAGS_GUID = "tags________"
 
+# Statements run once per item or folder are kept as constants, so every call
+# passes the same SQL text and reuses the prepared statement of the connection
+INSERT_BOOKMARK = """
+INSERT INTO moz_bookmarks (id, fk, type, parent, position, title,
+                        dateAdded, lastModified, guid,
+                        syncChangeCounter, syncStatus)
+VALUES (
+    :id,
+    :fk,
+    :type,
+    :parent,
+    :position,
+    NULLIF(:title, ''),
+    :date_added,
+    :last_modified,
+    :guid,
+    :syncChangeCounter,
+    :syncStatus
+)
+"""
+
+INSERT_BOOKMARK_ROW = """
+INSERT INTO moz_bookmarks (id, fk, type, parent, position, title,
+                        dateAdded, lastModified, guid,
+                        syncStatus, syncChangeCounter)
+VALUES (?, ?, ?, ?, ?, NULLIF(?, ''), ?, ?, ?, ?, ?)
+"""
+
+NEXT_POSITION = "SELECT IFNULL(MAX(position) + 1, 0) FROM moz_bookmarks WHERE parent = ?"
+
+FIND_CHILD_FOLDER = "SELECT id FROM moz_bookmarks WHERE parent = ? AND type = ? AND title = ? ORDER BY position LIMIT 1"
+
 user_content_roots = [
     MENU_GUID,
     TOOLBAR_GUID,
@@ -109,133 +146,355 @@ def fetch_bookmark(db: Cursor, guid: str) -> Optional[BookmarkRow]:
     return BookmarkRow(*row)
 
 
-def remove_folder_contents(db: Cursor, guids: List[str]):
-    if not guids:
-        return
+def remove_bookmarks(db: Cursor, ids: Iterable[int], recursive: bool = True) -> int:
+    """
+    Delete the bookmarks `ids`, and with `recursive` all of their descendants,
+    using one recursive query seeded from a temp table. foreign_count of the
+    referenced places is decremented in bulk and items already uploaded by Sync
+    leave a tombstone. Returns the number of rows deleted.
+    """
+    db.execute("CREATE TEMP TABLE IF NOT EXISTS bookmarks_remove_roots (id INTEGER PRIMARY KEY)")
+    db.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS bookmarks_removed (
+            id INTEGER PRIMARY KEY, fk INTEGER, guid TEXT, syncStatus INTEGER
+        )
+        """
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS temp.bookmarks_removed_fkindex ON bookmarks_removed (fk)")
+    db.execute("DELETE FROM temp.bookmarks_remove_roots")
+    db.execute("DELETE FROM temp.bookmarks_removed")
+    db.executemany("INSERT OR IGNORE INTO temp.bookmarks_remove_roots (id) VALUES (?)", ((id,) for id in ids))
 
-    for guid in guids:
+    if recursive:
         db.execute(
             """
+            INSERT INTO temp.bookmarks_removed (id, fk, guid, syncStatus)
             WITH RECURSIVE
             descendants(did) AS (
+                SELECT id FROM temp.bookmarks_remove_roots
+                UNION
                 SELECT b.id FROM moz_bookmarks b
-                JOIN moz_bookmarks p ON b.parent = p.id
-                WHERE p.guid = :guid
-                UNION ALL
-                SELECT id FROM moz_bookmarks
-                JOIN descendants ON parent = did
+                JOIN descendants ON b.parent = did
             )
-            DELETE FROM moz_bookmarks WHERE id IN descendants
-            """,
-            {"guid": guid},
+            SELECT b.id, b.fk, b.guid, b.syncStatus
+            FROM descendants
+            JOIN moz_bookmarks b ON b.id = did
+            """
+        )
+    else:
+        db.execute(
+            """
+            INSERT INTO temp.bookmarks_removed (id, fk, guid, syncStatus)
+            SELECT b.id, b.fk, b.guid, b.syncStatus
+            FROM temp.bookmarks_remove_roots r
+            JOIN moz_bookmarks b ON b.id = r.id
+            """
         )
 
-
-def insert_bookmarks(db: Cursor, items: List[BookmarkInfo]):
-    db.executemany(
+    db.execute(
         """
-        INSERT INTO moz_bookmarks (fk, type, parent, position, title, 
-                                dateAdded, lastModified, guid, 
-                                syncChangeCounter, syncStatus)
-        VALUES (
-            (CASE WHEN :url ISNULL THEN NULL ELSE (SELECT id FROM moz_places WHERE url_hash = HASH(:url) AND url = :url) END),
-            :type,
-            (SELECT id FROM moz_bookmarks WHERE guid = :parent_guid),
-            IFNULL(:position, (SELECT COUNT(*) FROM moz_bookmarks WHERE parent = :root_id)),
-            NULLIF(:title, ''),
-            :date_added,
-            :last_modified,
-            :guid,
-            :syncChangeCounter,
-            :syncStatus
+        UPDATE moz_places
+        SET foreign_count = foreign_count - (
+            SELECT COUNT(*) FROM temp.bookmarks_removed r WHERE r.fk = moz_places.id
         )
+        WHERE id IN (SELECT fk FROM temp.bookmarks_removed)
+        """
+    )
+    db.execute(
+        """
+        INSERT OR IGNORE INTO moz_bookmarks_deleted (guid, dateRemoved)
+        SELECT guid, :now FROM temp.bookmarks_removed WHERE syncStatus = :sync_status
         """,
-        items,
+        {"now": int(time.time() * 1_000_000), "sync_status": SYNC_STATUS_NORMAL},
     )
+    removed = db.execute("DELETE FROM moz_bookmarks WHERE id IN (SELECT id FROM temp.bookmarks_removed)").rowcount
+
+    db.execute("DELETE FROM temp.bookmarks_remove_roots")
+    db.execute("DELETE FROM temp.bookmarks_removed")
+
+    return removed
+
+
+def find_children_by_title(db: Cursor, parent_id: int, titles: List[str]) -> List[int]:
+    ids: List[int] = []
+    for chunk in chunked(titles, MAX_VARIABLES - 1):
+        rows = db.execute(
+            "SELECT id FROM moz_bookmarks WHERE parent = ? AND title IN ({})".format(placeholders(len(chunk))),
+            [parent_id] + chunk,
+        ).fetchall()
+        ids.extend(row[0] for row in rows)
+    return ids
+
+
+def insert_bookmarks(db: Cursor, items: List[BookmarkInfo]):
+    db.executemany(INSERT_BOOKMARK, items)
+
+
+def insert_bookmark_rows(db: Cursor, rows: Iterable[tuple]):
+    """
+    Same as `insert_bookmarks` for tuples in the field order of BookmarkInfo.
+    """
+    db.executemany(INSERT_BOOKMARK_ROW, rows)
+
+
+def next_bookmark_id(db: Cursor) -> int:
+    return db.execute("SELECT IFNULL(MAX(id), 0) + 1 FROM moz_bookmarks").fetchone()[0]
 
 
-def remove_tree_if_exists(db: Cursor, tree: BookmarkTree, root_id: int):
+def next_position(db: Cursor, parent_id: int) -> int:
+    return db.execute(NEXT_POSITION, (parent_id,)).fetchone()[0]
+
+
+def top_level_names(tree: AnyTree) -> List[str]:
+    if isinstance(tree, CompactTree):
+        names = (tree.titles[index] for index in tree.top_level())
+    else:
+        names = (item.name for item in tree)
+    return list(dict.fromkeys(names))
+
+
+def load_scoped_items(db: Cursor, root_id: int, ids: List[int]) -> List[ScopedItem]:
+    """
+    The root children `ids` and everything below them, with their paths.
+    """
+    rows = []
+    for chunk in chunked(ids, MAX_VARIABLES):
+        rows.extend(
+            db.execute(
+                """
+                WITH RECURSIVE
+                subtree(sid) AS (
+                    SELECT id FROM moz_bookmarks WHERE id IN ({})
+                    UNION ALL
+                    SELECT b.id FROM moz_bookmarks b
+                    JOIN subtree ON b.parent = sid
+                )
+                SELECT b.id, b.parent, b.type, IFNULL(b.title, ''), h.url
+                FROM subtree
+                JOIN moz_bookmarks b ON b.id = sid
+                LEFT JOIN moz_places h ON h.id = b.fk
+                """.format(
+                    placeholders(len(chunk))
+                ),
+                chunk,
+            ).fetchall()
+        )
+
+    paths: Dict[int, Tuple[str, ...]] = {root_id: ()}
+    titles = {id: (parent, title) for id, parent, _, title, _ in rows}
+
+    def path_of(id: int) -> Tuple[str, ...]:
+        if id not in paths:
+            parent, title = titles[id]
+            paths[id] = path_of(parent) + (title,)
+        return paths[id]
+
+    return [(id, parent, path_of(id), type == TYPE_FOLDER, url) for id, parent, type, _, url in rows]
+
+
+def remove_tree_if_exists(db: Cursor, tree: AnyTree, root_id: int, scope: Optional[Scope] = None) -> int:
+    """
+    Remove the root children sharing a name with the top level of `tree`. With a
+    scope, only what an import with that scope creates is removed below them.
+    """
     if not tree:
+        return 0
+
+    ids = find_children_by_title(db, root_id, top_level_names(tree))
+    if not ids:
+        return 0
+    if not scope:
+        return remove_bookmarks(db, ids)
+
+    return remove_bookmarks(db, removable_ids(scope, load_scoped_items(db, root_id, ids)), recursive=False)
+
+
+def iter_urls(tree: AnyTree):
+    if isinstance(tree, CompactTree):
+        yield from tree.urls()
         return
 
-    names = [item.name for item in tree]
-    rows = db.execute(
-        """
-        SELECT guid FROM moz_bookmarks
-        WHERE parent = ? AND title IN ({})
-        """.format(
-            ', '.join(['?'] * len(names))
-        ),
-        [root_id] + names,
-    ).fetchall()
-    guids = [row[0] for row in rows]
-
-    if guids:
-        remove_folder_contents(db, guids)
-        db.execute(
-            "DELETE FROM moz_bookmarks WHERE guid IN ({})".format(
-                ', '.join(['?'] * len(guids))
-            ),
-            guids,
+    for item in tree:
+        if isinstance(item, Bookmark):
+            yield item.url
+        elif isinstance(item, BookmarkFolder):
+            yield from iter_urls(item.items)
+
+
+def map_tree_urls(tree: AnyTree, mapping: Dict[str, str]) -> AnyTree:
+    if isinstance(tree, CompactTree):
+        return tree.map_urls(mapping)
+    return [
+        BookmarkFolder(node.name, map_tree_urls(node.items, mapping))
+        if isinstance(node, BookmarkFolder)
+        else Bookmark(node.name, mapping.get(node.url, node.url))
+        for node in tree
+    ]
+
+
+def canonicalize_tree(db: Cursor, tree: AnyTree, normalization: UrlNormalization) -> Tuple[AnyTree, NormalizeStats]:
+    """
+    Rewrite the URLs of `tree` to one spelling per normalized URL, preferring
+    the spelling of an existing place. Returns the new tree and what it saved.
+    """
+    index = UrlIndex(normalization)
+    stats = index.build(db, iter_urls(tree))
+    changed = {url: canonical for url, canonical in index.mapping.items() if url != canonical}
+    return (map_tree_urls(tree, changed) if changed else tree), stats
+
+
+def flatten_tree(
+    tree: BookmarkTree,
+    parent_id: int,
+    position: int,
+    first_id: int,
+    place_ids: Dict[str, int],
+    now: int,
+    guids: Optional[Iterator[str]] = None,
+) -> List[BookmarkInfo]:
+    """
+    Lay `tree` out as moz_bookmarks rows in pre-order, so every parent precedes
+    its children. Ids are allocated from `first_id` and the top level starts at
+    `position` below `parent_id`. GUIDs are taken from `guids`.
+    """
+    guids = guids or guid_allocator()
+    items: List[BookmarkInfo] = []
+
+    def walk(nodes: BookmarkTree, parent: int, first_position: int):
+        for index, node in enumerate(nodes):
+            item: BookmarkInfo = {
+                "id": first_id + len(items),
+                "fk": None,
+                "type": TYPE_FOLDER,
+                "parent": parent,
+                "position": first_position + index,
+                "title": node.name,
+                "date_added": now,
+                "last_modified": now,
+                "guid": next(guids),
+                "syncStatus": SYNC_STATUS_NEW,
+                "syncChangeCounter": 1,
+            }
+            items.append(item)
+
+            if isinstance(node, Bookmark):
+                item["fk"] = place_ids.get(node.url)
+                item["type"] = TYPE_BOOKMARK
+            elif isinstance(node, BookmarkFolder):
+                walk(node.items, item["id"], 0)
+            else:
+                raise TypeError(f"Unknown item type: {type(node)}")
+
+    walk(tree, parent_id, position)
+    return items
+
+
+def compact_rows(
+    tree: CompactTree,
+    parent_id: int,
+    position: int,
+    first_id: int,
+    place_ids: Dict[str, int],
+    now: int,
+    guids: Optional[Iterator[str]] = None,
+    start: int = 0,
+) -> Iterator[tuple]:
+    """
+    `flatten_tree` for a compact tree, yielding tuples in the field order of
+    BookmarkInfo one at a time instead of building a dict per item. The first
+    `start` rows are skipped, with the ids and positions they would have taken.
+    """
+    guids = guids or guid_allocator()
+    # Next free position in each folder; the top level has no slot of its own
+    next_child = array("i", [0]) * len(tree)
+
+    for index, (parent, title, url) in enumerate(tree.items()):
+        if parent == -1:
+            item_parent = parent_id
+            item_position = position
+            position += 1
+        else:
+            item_parent = first_id + parent
+            item_position = next_child[parent]
+            next_child[parent] += 1
+
+        if index < start:
+            continue
+        yield (
+            first_id + index,
+            None if url is None else place_ids.get(url),
+            TYPE_FOLDER if url is None else TYPE_BOOKMARK,
+            item_parent,
+            item_position,
+            title,
+            now,
+            now,
+            next(guids),
+            SYNC_STATUS_NEW,
+            1,
         )
 
 
 def insert_tree(
     db: Cursor,
-    tree: BookmarkTree,
-    root_id: int,
-    parent_guid: str,
-    position: Optional[int] = None,
+    tree: AnyTree,
+    parent_id: int,
     date_added: Optional[int] = None,
-):
+    bulk_origins: bool = False,
+) -> int:
+    """
+    Append `tree` to the folder `parent_id` with a single executemany. Returns the
+    number of rows inserted.
+    """
     if not tree:
-        return
+        return 0
 
     now = date_added or int(time.time() * 1_000_000)
-
-    items: List[BookmarkInfo] = []
-
-    for item in tree:
-        if isinstance(item, Bookmark):
-            maybe_insert_place(db, item.url)
-            items.append(
-                {
-                    "url": item.url,
-                    "type": TYPE_BOOKMARK,
-                    "root_id": root_id,
-                    "parent_guid": parent_guid,
-                    "title": item.name,
-                    "position": position,
-                    "date_added": now,
-                    "last_modified": now,
-                    "guid": generate_guid(),
-                    "syncStatus": SYNC_STATUS_NEW,
-                    "syncChangeCounter": 1,
-                }
-            )
-        elif isinstance(item, BookmarkFolder):
-            folder_guid = generate_guid()
-            insert_bookmarks(
+    with stage("places"):
+        place_ids = bulk_insert_places(db, iter_urls(tree), bulk_origins)
+    with stage("bookmarks"):
+        guids = guid_allocator(db)
+        if isinstance(tree, CompactTree):
+            insert_bookmark_rows(
                 db,
-                [
-                    {
-                        "url": None,
-                        "type": TYPE_FOLDER,
-                        "root_id": root_id,
-                        "parent_guid": parent_guid,
-                        "title": item.name,
-                        "position": position,
-                        "date_added": now,
-                        "last_modified": now,
-                        "guid": folder_guid,
-                        "syncStatus": SYNC_STATUS_NEW,
-                        "syncChangeCounter": 1,
-                    }
-                ],
+                compact_rows(
+                    tree, parent_id, next_position(db, parent_id), next_bookmark_id(db), place_ids, now, guids
+                ),
             )
-            insert_tree(db, item.items, root_id, folder_guid)
-        else:
-            raise TypeError(f"Unknown item type: {type(item)}")
+            return len(tree)
 
-    if items:
+        items = flatten_tree(
+            tree, parent_id, next_position(db, parent_id), next_bookmark_id(db), place_ids, now, guids
+        )
         insert_bookmarks(db, items)
+
+    return len(items)
+
+
+def insert_scoped_tree(
+    db: Cursor, tree: AnyTree, parent_id: int, scope: Scope, bulk_origins: bool = False
+) -> int:
+    """
+    `insert_tree` for a tree parsed with `scope`. Container folders that are
+    still in place, because they hold items outside the scope, are filled
+    instead of being added a second time. Returns the number of rows inserted.
+    """
+    if isinstance(tree, CompactTree):
+        tree = tree.to_tree()
+
+    def graft(nodes: BookmarkTree, parent_id: int, path: Tuple[str, ...], state: int) -> int:
+        inserted = 0
+        fresh: BookmarkTree = []
+        for node in nodes:
+            if isinstance(node, BookmarkFolder):
+                node_path = path + (node.name,)
+                node_state = scope.folder_state(node_path, state)
+                row = db.execute(FIND_CHILD_FOLDER, (parent_id, TYPE_FOLDER, node.name)).fetchone()
+                if node_state == CONTAINER and row:
+                    inserted += graft(node.items, row[0], node_path, node_state)
+                    continue
+            fresh.append(node)
+        return inserted + insert_tree(db, fresh, parent_id, bulk_origins=bulk_origins)
+
+    return graft(tree, parent_id, (), scope.root_state())
@@ -1,28 +1,39 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field
-from typing import List, Optional, TypedDict, Union
+import hashlib
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple, TypedDict, Union
 
 
+# Slots instead of a per-instance __dict__. A slotted dataclass cannot have
+# field defaults before Python 3.10, so the default of a folder's items is set
+# in its own __init__, which the dataclass keeps.
 @dataclass
 class Bookmark:
+    __slots__ = ("name", "url")
     name: str
     url: str
 
 
 @dataclass
 class BookmarkFolder:
+    __slots__ = ("name", "items")
     name: str
-    items: List[Union[Bookmark, BookmarkFolder]] = field(default_factory=list)
+    items: List[Union[Bookmark, BookmarkFolder]]
+
+    def __init__(self, name: str, items: Optional[List[Union[Bookmark, BookmarkFolder]]] = None):
+        self.name = name
+        self.items = [] if items is None else items
 
 
 class BookmarkInfo(TypedDict):
-    url: Optional[str]
+    id: int
+    fk: Optional[int]
     type: int
-    root_id: int
-    parent_guid: str
+    parent: int
+    position: int
     title: str
-    position: Optional[int]
     date_added: int
     last_modified: int
     guid: str
@@ -30,4 +41,151 @@ class BookmarkInfo(TypedDict):
     syncChangeCounter: int
 
 
-BookmarkTree = List[Union[Bookmark, BookmarkFolder]]
\ No newline at end of file
+BookmarkTree = List[Union[Bookmark, BookmarkFolder]]
+
+
+class CompactTree(object):
+    """
+    Column oriented bookmark tree. Items are stored in pre-order, so every folder
+    precedes its contents and siblings keep their document order. `parents`
+    holds the index of the enclosing folder, or -1 at the top level. Titles are
+    interned while the tree is built so repeated titles share one string, and
+    URLs are packed into one UTF-8 buffer instead of one str object per item.
+    """
+
+    __slots__ = ("parents", "titles", "folders", "url_data", "url_ends", "_titles")
+
+    def __init__(self):
+        self.parents = array("i")
+        self.titles: List[str] = []
+        # 1 for folders, which have an empty URL
+        self.folders = bytearray()
+        self.url_data = bytearray()
+        self.url_ends = array("q")
+        self._titles: Optional[Dict[str, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, CompactTree)
+            and self.parents == other.parents
+            and self.titles == other.titles
+            and self.folders == other.folders
+            and self.url_data == other.url_data
+            and self.url_ends == other.url_ends
+        )
+
+    def digest(self) -> str:
+        """
+        sha256 of the layout, titles and URLs, identifying the rows an import of
+        this tree writes.
+        """
+        digest = hashlib.sha256()
+        digest.update(self.parents.tobytes())
+        digest.update(self.folders)
+        digest.update("\0".join(self.titles).encode("utf-8", "surrogatepass"))
+        digest.update(self.url_ends.tobytes())
+        digest.update(self.url_data)
+        return digest.hexdigest()
+
+    def _add(self, parent: int, title: str, url: Optional[str]) -> int:
+        if self._titles is not None:
+            title = self._titles.setdefault(title, title)
+        self.parents.append(parent)
+        self.titles.append(title)
+        self.folders.append(url is None)
+        if url:
+            self.url_data += url.encode("utf-8")
+        self.url_ends.append(len(self.url_data))
+        return len(self.parents) - 1
+
+    def add_folder(self, parent: int, title: str) -> int:
+        return self._add(parent, title, None)
+
+    def add_bookmark(self, parent: int, title: str, url: str) -> int:
+        return self._add(parent, title, url)
+
+    def finish(self) -> CompactTree:
+        """
+        Drop the intern table once the tree is complete.
+        """
+        self._titles = None
+        return self
+
+    def url(self, index: int) -> Optional[str]:
+        if self.folders[index]:
+            return None
+        start = self.url_ends[index - 1] if index else 0
+        return self.url_data[start : self.url_ends[index]].decode("utf-8")
+
+    def items(self) -> Iterator[Tuple[int, str, Optional[str]]]:
+        """
+        (parent, title, url) of every item in order, with a None URL for folders.
+        """
+        data = self.url_data
+        start = 0
+        for parent, title, folder, end in zip(self.parents, self.titles, self.folders, self.url_ends):
+            yield parent, title, None if folder else data[start:end].decode("utf-8")
+            start = end
+
+    def urls(self) -> Iterator[str]:
+        return (url for _, _, url in self.items() if url is not None)
+
+    def map_urls(self, mapping: Dict[str, str]) -> CompactTree:
+        """
+        Copy of the tree with every URL found in `mapping` replaced.
+        """
+        mapped = CompactTree()
+        mapped.parents = array("i", self.parents)
+        mapped.titles = list(self.titles)
+        mapped.folders = bytearray(self.folders)
+        for _, _, url in self.items():
+            if url:
+                mapped.url_data += mapping.get(url, url).encode("utf-8")
+            mapped.url_ends.append(len(mapped.url_data))
+        return mapped.finish()
+
+    def top_level(self) -> Iterator[int]:
+        return (index for index, parent in enumerate(self.parents) if parent == -1)
+
+    def extend(self, other: CompactTree):
+        offset = len(self.parents)
+        data_offset = len(self.url_data)
+        self.parents.extend(parent + offset if parent != -1 else -1 for parent in other.parents)
+        self.titles.extend(other.titles)
+        self.folders += other.folders
+        self.url_data += other.url_data
+        self.url_ends.extend(end + data_offset for end in other.url_ends)
+
+    def to_tree(self) -> BookmarkTree:
+        tree: BookmarkTree = []
+        folders: List[Optional[BookmarkFolder]] = []
+        for parent, title, url in self.items():
+            siblings = tree if parent == -1 else folders[parent].items
+            if url is None:
+                folder = BookmarkFolder(name=title, items=[])
+                siblings.append(folder)
+                folders.append(folder)
+            else:
+                siblings.append(Bookmark(name=title, url=url))
+                folders.append(None)
+        return tree
+
+    @classmethod
+    def from_tree(cls, tree: BookmarkTree) -> CompactTree:
+        compact = cls()
+
+        def walk(nodes: BookmarkTree, parent: int):
+            for node in nodes:
+                if isinstance(node, BookmarkFolder):
+                    walk(node.items, compact.add_folder(parent, node.name))
+                else:
+                    compact.add_bookmark(parent, node.name, node.url)
+
+        walk(tree, -1)
+        return compact.finish()
+
+
+AnyTree = Union[BookmarkTree, CompactTree]
\ No newline at end of file
@@ -0,0 +1,256 @@
+"""
+Import a large tree in chunks of rows, each committed on its own, so the
+rollback journal stays bounded and an interrupted import can continue.
+
+After every chunk a checkpoint is written next to the database with the digest
+of the tree, the id range it was laid out in, the rows done, the last completed
+folder and the GUID of every folder inserted so far. `--resume` checks the
+checkpoint against the database and carries on after the last committed row.
+"""
+
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from itertools import islice
+from sqlite3 import Connection
+from typing import Callable, Dict, List, Optional
+
+from bookmarks.bookmark import (
+    compact_rows,
+    find_children_by_title,
+    insert_bookmark_rows,
+    next_bookmark_id,
+    next_position,
+    remove_bookmarks,
+    top_level_names,
+)
+from bookmarks.bookmark_types import AnyTree, CompactTree
+from utils.guid import guid_allocator
+from utils.metrics import stage
+from utils.places import bulk_insert_places
+from utils.scope import PATH_SEPARATOR
+
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+# Columns of the rows yielded by compact_rows
+ROW_ID = 0
+ROW_GUID = 8
+
+
+class ResumeError(Exception):
+    pass
+
+
+@dataclass
+class Checkpoint:
+    digest: str
+    target: str
+    first_id: int
+    position: int
+    date_added: int
+    total: int
+    rows_done: int = 0
+    folder: str = ""
+    # path, id and GUID of every folder inserted so far
+    folders: List[list] = field(default_factory=list)
+
+    def save(self, path: str):
+        # Written beside the database and moved into place, never half written
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f)
+        os.replace(tmp_path, path)
+
+
+def checkpoint_path(db_path: str) -> str:
+    return db_path + CHECKPOINT_SUFFIX
+
+
+def load_checkpoint(path: str) -> Optional[Checkpoint]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return Checkpoint(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def tree_digest(tree: AnyTree) -> str:
+    if not isinstance(tree, CompactTree):
+        tree = CompactTree.from_tree(tree)
+    return tree.digest()
+
+
+def pending_checkpoint(db_path: str, digest: str, target: str) -> Optional[Checkpoint]:
+    """
+    Checkpoint of an interrupted import of the tree with `digest` into
+    `target`, if any.
+    """
+    checkpoint = load_checkpoint(checkpoint_path(db_path))
+    if checkpoint is None or checkpoint.digest != digest or checkpoint.target != target:
+        return None
+    return checkpoint
+
+
+def folder_paths(tree: CompactTree) -> Dict[int, str]:
+    paths: Dict[int, str] = {}
+    for index, (parent, title, url) in enumerate(tree.items()):
+        if url is None:
+            paths[index] = title if parent == -1 else paths[parent] + PATH_SEPARATOR + title
+    return paths
+
+
+def closing_folders(tree: CompactTree, paths: Dict[int, str]) -> Dict[int, int]:
+    """
+    The outermost folder whose last item is at each index, by that index. A
+    folder is complete once the row at that index is committed.
+    """
+    ends = list(range(len(tree)))
+    for index in range(len(tree) - 1, -1, -1):
+        parent = tree.parents[index]
+        if parent != -1 and ends[index] > ends[parent]:
+            ends[parent] = ends[index]
+    closing: Dict[int, int] = {}
+    for index in sorted(paths, reverse=True):
+        closing[ends[index]] = index
+    return closing
+
+
+def reconcile(conn: Connection, checkpoint: Checkpoint, paths: Dict[int, str]) -> Optional[str]:
+    """
+    Bring `checkpoint` in line with the rows committed after it was written.
+    Returns why the import cannot resume, or None.
+    """
+    done, last_id = conn.execute(
+        "SELECT COUNT(*), MAX(id) FROM moz_bookmarks WHERE id >= ?", (checkpoint.first_id,)
+    ).fetchone()
+    if done < checkpoint.rows_done or done > checkpoint.total:
+        return f"{done} rows found where the checkpoint expects {checkpoint.rows_done}"
+    if done and last_id != checkpoint.first_id + done - 1:
+        return "bookmarks were added after the interrupted import"
+
+    expected = [[id, guid] for _, id, guid in checkpoint.folders]
+    found = conn.execute(
+        """
+        SELECT COUNT(*) FROM moz_bookmarks b
+        JOIN json_each(:folders) j ON b.id = json_extract(j.value, '$[0]') AND b.guid = json_extract(j.value, '$[1]')
+        """,
+        {"folders": json.dumps(expected)},
+    ).fetchone()[0]
+    if found != len(expected):
+        return "folders of the interrupted import were changed"
+
+    # Rows committed after the last checkpoint was written
+    for id, guid in conn.execute(
+        "SELECT id, guid FROM moz_bookmarks WHERE id >= ? AND id < ? ORDER BY id",
+        (checkpoint.first_id + checkpoint.rows_done, checkpoint.first_id + done),
+    ):
+        index = id - checkpoint.first_id
+        if index in paths:
+            checkpoint.folders.append([paths[index], id, guid])
+    checkpoint.rows_done = done
+    return None
+
+
+def remove_top_level(conn: Connection, tree: AnyTree, root_id: int) -> int:
+    """
+    `remove_tree_if_exists` with a commit after each removed folder.
+    """
+    removed = 0
+    for id in find_children_by_title(conn.cursor(), root_id, top_level_names(tree)):
+        removed += remove_bookmarks(conn.cursor(), [id])
+        conn.commit()
+    return removed
+
+
+def chunked_import(
+    conn: Connection,
+    tree: AnyTree,
+    root_id: int,
+    digest: str,
+    target: str,
+    db_path: str,
+    chunk_rows: int,
+    checkpoint: Optional[Checkpoint] = None,
+    remove: bool = True,
+    bulk_origins: bool = False,
+    log: Callable[[str], None] = print,
+) -> int:
+    """
+    Replace the top level folders of `tree` below `root_id` and insert it in
+    transactions of at most `chunk_rows` rows into `target`, or continue the
+    interrupted import `checkpoint` from `pending_checkpoint`. `digest` is the
+    `tree_digest` of the parsed document. Returns the number of rows inserted
+    by this call.
+    """
+    if not isinstance(tree, CompactTree):
+        tree = CompactTree.from_tree(tree)
+    path = checkpoint_path(db_path)
+    paths = folder_paths(tree)
+    # Nothing of the import is pending in an open transaction
+    conn.commit()
+
+    if checkpoint:
+        error = reconcile(conn, checkpoint, paths)
+        if error:
+            raise ResumeError(f"Cannot resume the import: {error}. Run without --resume to start over.")
+        log(f"Resuming after {checkpoint.rows_done} of {checkpoint.total} rows ({checkpoint.folder or 'top level'}).")
+    else:
+        if remove:
+            with stage("remove"):
+                removed = remove_top_level(conn, tree, root_id)
+            log(f"Removed {removed} existing bookmarks.")
+        checkpoint = Checkpoint(
+            digest,
+            target,
+            next_bookmark_id(conn.cursor()),
+            next_position(conn.cursor(), root_id),
+            int(time.time() * 1_000_000),
+            len(tree),
+        )
+        checkpoint.save(path)
+
+    closing = closing_folders(tree, paths)
+    db = conn.cursor()
+    start = checkpoint.rows_done
+    # compact_rows reads the place ids of each chunk as it reaches its rows
+    place_ids: Dict[str, int] = {}
+    rows = compact_rows(
+        tree,
+        root_id,
+        checkpoint.position,
+        checkpoint.first_id,
+        place_ids,
+        checkpoint.date_added,
+        guid_allocator(db),
+        start,
+    )
+    items = islice(tree.items(), start, None)
+
+    while checkpoint.rows_done < checkpoint.total:
+        first = checkpoint.rows_done
+        last = min(first + chunk_rows, checkpoint.total)
+        db.execute("SAVEPOINT import_chunk")
+        with stage("places"):
+            urls = [url for _, _, url in islice(items, last - first) if url is not None]
+            place_ids.clear()
+            place_ids.update(bulk_insert_places(db, urls, bulk_origins))
+        with stage("bookmarks"):
+            chunk = list(islice(rows, last - first))
+            insert_bookmark_rows(db, chunk)
+        # Releasing the outermost savepoint commits the chunk
+        db.execute("RELEASE import_chunk")
+
+        for row in chunk:
+            index = row[ROW_ID] - checkpoint.first_id
+            if index in paths:
+                checkpoint.folders.append([paths[index], row[ROW_ID], row[ROW_GUID]])
+        completed = next((closing[index] for index in range(last - 1, first - 1, -1) if index in closing), None)
+        if completed is not None:
+            checkpoint.folder = paths[completed]
+        checkpoint.rows_done = last
+        checkpoint.save(path)
+        log(f"Committed {last} of {checkpoint.total} rows.")
+
+    os.remove(path)
+    return checkpoint.total - start
@@ -0,0 +1,285 @@
+"""
+Import into a WAL database that Firefox has open, without stalling it.
+
+Everything that does not need the write lock is prepared first: the tree is
+laid out, and hashes, GUIDs and positions are computed. The rows are then
+written in short BEGIN IMMEDIATE transactions. A busy lock is retried with
+jittered exponential backoff. A batch still running when its time is up is
+interrupted, rolled back and retried with half the rows, and the batch size
+follows the time each batch holds the lock. Readers are never blocked in WAL
+mode, so Firefox only waits for a batch when it writes itself.
+"""
+
+import json
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+from sqlite3 import Connection, Cursor
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from bookmarks.bookmark import (
+    SYNC_STATUS_NEW,
+    TYPE_BOOKMARK,
+    TYPE_FOLDER,
+    find_children_by_title,
+    insert_bookmark_rows,
+    next_bookmark_id,
+    next_position,
+    remove_bookmarks,
+    top_level_names,
+)
+from bookmarks.bookmark_types import AnyTree, CompactTree
+from utils.guid import guid_allocator
+from utils.metrics import stage
+from utils.places import PlaceRow, insert_place_rows, place_rows
+
+FIRST_BATCH = 256
+MAX_BATCH = 65536
+
+# Per attempt to take the lock; the backoff between attempts is done here
+BUSY_TIMEOUT_MS = 50
+FIRST_BACKOFF = 0.05
+MAX_BACKOFF = 2.0
+
+# SQLite instructions between two checks of the batch deadline
+DEADLINE_STEPS = 1000
+
+T = TypeVar("T")
+
+
+@dataclass
+class CooperativeStats:
+    batches: int = 0
+    retries: int = 0
+    interrupted: int = 0
+    lock_wait: float = 0.0
+    max_hold: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.batches} batches, {self.retries} retries, {self.interrupted} batches cut at the hold limit, "
+            f"{self.lock_wait:.2f}s waiting for the write lock, longest hold {self.max_hold * 1000:.0f}ms"
+        )
+
+
+class WriteLock(object):
+    """
+    Runs writes in BEGIN IMMEDIATE transactions held for about `hold` seconds,
+    waiting at most `wait` seconds in total for the lock. Unless `interrupt` is
+    off, a batch running past its deadline is stopped through the progress
+    handler, which `profile_sql` uses otherwise.
+    """
+
+    def __init__(self, conn: Connection, hold: float, wait: float, interrupt: bool = True):
+        self.conn = conn
+        self.hold = hold
+        self.wait = wait
+        self.interrupt = interrupt
+        self.size = FIRST_BATCH
+        self.stats = CooperativeStats()
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+
+    def acquire(self):
+        started = time.monotonic()
+        backoff = FIRST_BACKOFF
+        try:
+            while True:
+                try:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    return
+                except sqlite3.OperationalError as e:
+                    if "locked" not in str(e) and "busy" not in str(e):
+                        raise
+                    if time.monotonic() - started >= self.wait:
+                        raise
+                self.stats.retries += 1
+                # Full jitter keeps several writers from retrying in step
+                time.sleep(random.uniform(0, backoff))
+                backoff = min(backoff * 2, MAX_BACKOFF)
+        finally:
+            self.stats.lock_wait += time.monotonic() - started
+
+    def run(self, write: Callable[[], T]) -> Optional[T]:
+        """
+        Run `write` in one transaction and return its result, which must not be
+        None. Returns None if it was interrupted at the deadline and rolled
+        back, after halving the batch size.
+        """
+        self.acquire()
+        held = time.monotonic()
+        deadline = held + self.hold
+        cut = self.interrupt and self.size > 1
+        if cut:
+            self.conn.set_progress_handler(lambda: time.monotonic() > deadline, DEADLINE_STEPS)
+        try:
+            result = write()
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            if "interrupted" not in str(e):
+                raise
+            self.stats.interrupted += 1
+            self.size = max(self.size // 2, 1)
+            return None
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            if cut:
+                self.conn.set_progress_handler(None, 0)
+
+        self.conn.commit()
+        elapsed = time.monotonic() - held
+        self.stats.batches += 1
+        self.stats.max_hold = max(self.stats.max_hold, elapsed)
+        if elapsed > self.hold:
+            self.size = max(self.size // 2, 1)
+        elif elapsed < self.hold / 4:
+            self.size = min(self.size * 2, MAX_BATCH)
+        return result
+
+
+def removal_order(conn: Connection, tree: AnyTree, root_id: int) -> Tuple[List[int], List[int]]:
+    """
+    Top level items of `root_id` named like the top level of `tree`, and all
+    items below them with the deepest first.
+    """
+    roots = find_children_by_title(conn.cursor(), root_id, top_level_names(tree))
+    descendants = [
+        id
+        for id, in conn.execute(
+            """
+            WITH RECURSIVE descendants(id, depth) AS (
+                SELECT value, 0 FROM json_each(:roots)
+                UNION ALL
+                SELECT b.id, d.depth + 1 FROM moz_bookmarks b JOIN descendants d ON b.parent = d.id
+            )
+            SELECT id FROM descendants WHERE depth > 0 ORDER BY depth DESC
+            """,
+            {"roots": json.dumps(roots)},
+        )
+    ]
+    return roots, descendants
+
+
+class PreparedTree(object):
+    """
+    Everything about the rows of a tree that does not depend on the ids and
+    root positions free when a batch is written.
+    """
+
+    def __init__(self, conn: Connection, tree: CompactTree, date_added: int):
+        self.tree = tree
+        self.items = list(tree.items())
+        self.now = date_added
+        guids = guid_allocator(conn.cursor())
+        urls = [url for _, _, url in self.items if url is not None]
+        self.places: Dict[str, PlaceRow] = {row[0]: row for row in place_rows(urls, guids)}
+        self.guids = [next(guids) for _ in self.items]
+
+        # Position of every item inside its folder; top level items get theirs per batch
+        self.positions = [0] * len(self.items)
+        next_child: Dict[int, int] = {}
+        for index, (parent, _, _) in enumerate(self.items):
+            if parent != -1:
+                self.positions[index] = next_child.get(parent, 0)
+                next_child[parent] = self.positions[index] + 1
+
+        # Database ids and place ids of the rows written so far
+        self.ids: List[Optional[int]] = [None] * len(self.items)
+        self.place_ids: Dict[str, int] = {}
+
+    def write(self, db: Cursor, root_id: int, first: int, last: int, bulk_origins: bool) -> Tuple[int, Dict[str, int]]:
+        """
+        Insert rows `first` to `last`. Returns the id of the first row and the
+        places added, to be kept with `committed` once the batch committed.
+        """
+        urls = dict.fromkeys(url for _, _, url in self.items[first:last] if url and url not in self.place_ids)
+        places = insert_place_rows(db, [self.places[url] for url in urls], bulk_origins)
+
+        # Read inside the lock, so nothing else can take these ids or positions
+        first_id = next_bookmark_id(db)
+        top_level = any(parent == -1 for parent, _, _ in self.items[first:last])
+        position = next_position(db, root_id) if top_level else 0
+        rows = []
+        for index in range(first, last):
+            parent, title, url = self.items[index]
+            if parent == -1:
+                parent_id, item_position = root_id, position
+                position += 1
+            else:
+                parent_id = first_id + parent - first if parent >= first else self.ids[parent]
+                item_position = self.positions[index]
+            rows.append(
+                (
+                    first_id + index - first,
+                    None if url is None else places.get(url) or self.place_ids.get(url),
+                    TYPE_FOLDER if url is None else TYPE_BOOKMARK,
+                    parent_id,
+                    item_position,
+                    title,
+                    self.now,
+                    self.now,
+                    self.guids[index],
+                    SYNC_STATUS_NEW,
+                    1,
+                )
+            )
+        insert_bookmark_rows(db, rows)
+        return first_id, places
+
+    def committed(self, first: int, last: int, first_id: int, places: Dict[str, int]):
+        for index in range(first, last):
+            self.ids[index] = first_id + index - first
+        self.place_ids.update(places)
+
+
+def cooperative_import(
+    conn: Connection,
+    tree: AnyTree,
+    root_id: int,
+    hold: float,
+    wait: float,
+    remove: bool = True,
+    bulk_origins: bool = False,
+    interrupt: bool = True,
+    date_added: Optional[int] = None,
+    log: Callable[[str], None] = print,
+) -> CooperativeStats:
+    """
+    Replace the top level folders of `tree` below `root_id` in batches that
+    hold the write lock for about `hold` seconds each. Gives up with "database
+    is locked" after waiting `wait` seconds for a single batch.
+    """
+    if not isinstance(tree, CompactTree):
+        tree = CompactTree.from_tree(tree)
+    # Nothing of the import is pending in an open transaction
+    conn.commit()
+    lock = WriteLock(conn, hold, wait, interrupt)
+
+    with stage("prepare"):
+        prepared = PreparedTree(conn, tree, date_added or int(time.time() * 1_000_000))
+
+    if remove:
+        with stage("remove"):
+            roots, descendants = removal_order(conn, tree, root_id)
+            done = 0
+            while done < len(descendants):
+                chunk = descendants[done : done + lock.size]
+                if lock.run(lambda: remove_bookmarks(conn.cursor(), chunk, recursive=False)) is not None:
+                    done += len(chunk)
+            # Recursive, for anything added below them since they were read
+            while roots and lock.run(lambda: remove_bookmarks(conn.cursor(), roots)) is None:
+                pass
+        log(f"Removed {len(roots) + len(descendants)} existing bookmarks.")
+
+    with stage("insert"):
+        done = 0
+        while done < len(prepared.items):
+            last = min(done + lock.size, len(prepared.items))
+            result = lock.run(lambda: prepared.write(conn.cursor(), root_id, done, last, bulk_origins))
+            if result is not None:
+                prepared.committed(done, last, *result)
+                done = last
+
+    return lock.stats
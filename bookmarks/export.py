@@ -0,0 +1,104 @@
+"""
+Export a bookmark folder as a Netscape bookmark file, the format Firefox reads
+and writes from Import and Backup.
+
+The subtree is read with one recursive query that returns items in document
+order, and every row is written as soon as it is read, so memory does not grow
+with the size of the folder.
+"""
+
+import html
+from sqlite3 import Cursor
+from typing import TextIO
+
+from bookmarks.bookmark import TYPE_BOOKMARK, TYPE_FOLDER
+
+HEADER = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<!-- This is an automatically generated file.
+     It will be read and overwritten.
+     DO NOT EDIT! -->
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>{title}</H1>
+
+<DL><p>
+"""
+
+# Ordering the queue by depth first makes SQLite walk the tree depth first, and
+# the pending rows of the deepest level always share a parent, so position
+# alone orders the siblings. URLs are joined inside the recursion: a join in the
+# outer query lets SQLite return the rows in a different order.
+EXPORT_QUERY = f"""
+WITH RECURSIVE subtree(id, depth, type, title, url, position, date_added, last_modified) AS (
+    SELECT b.id, 1 AS depth, b.type, b.title, p.url, b.position, b.dateAdded, b.lastModified
+    FROM moz_bookmarks b
+    LEFT JOIN moz_places p ON p.id = b.fk
+    WHERE b.parent = :root
+    UNION ALL
+    SELECT b.id, s.depth + 1, b.type, b.title, p.url, b.position, b.dateAdded, b.lastModified
+    FROM subtree s
+    JOIN moz_bookmarks b ON b.parent = s.id
+    LEFT JOIN moz_places p ON p.id = b.fk
+    WHERE s.type = {TYPE_FOLDER}
+    ORDER BY depth DESC, position
+)
+SELECT depth, type, title, url, date_added, last_modified FROM subtree
+"""
+
+INDENT = "    "
+
+
+def escape_text(text: str) -> str:
+    """
+    Titles are written the way the parsers read them back, with "&", "<", ">"
+    and quotes as character references and line breaks as spaces.
+    """
+    return html.escape(text, quote=True).replace("\r", " ").replace("\n", " ")
+
+
+def escape_url(url: str) -> str:
+    return url.replace('"', "%22")
+
+
+def date_attributes(date_added, last_modified) -> str:
+    # Microseconds in places, seconds in the file
+    return f' ADD_DATE="{(date_added or 0) // 1_000_000}" LAST_MODIFIED="{(last_modified or 0) // 1_000_000}"'
+
+
+def export_tree(db: Cursor, root_id: int, out: TextIO, title: str = "Bookmarks") -> int:
+    """
+    Write the folder `root_id` to `out` as a bookmark file whose top level holds
+    the children of the folder. Returns the number of items written.
+    """
+    out.write(HEADER.format(title=escape_text(title)))
+    depth = 0
+    count = 0
+
+    for item_depth, item_type, item_title, url, date_added, last_modified in db.execute(
+        EXPORT_QUERY, {"root": root_id}
+    ):
+        while depth >= item_depth:
+            out.write(f"{INDENT * depth}</DL><p>\n")
+            depth -= 1
+
+        indent = INDENT * item_depth
+        name = escape_text(item_title or "")
+        if item_type == TYPE_FOLDER:
+            out.write(f"{indent}<DT><H3{date_attributes(date_added, last_modified)}>{name}</H3>\n")
+            out.write(f"{indent}<DL><p>\n")
+            depth = item_depth
+        elif item_type == TYPE_BOOKMARK:
+            out.write(
+                f'{indent}<DT><A HREF="{escape_url(url or "")}"{date_attributes(date_added, last_modified)}>'
+                f"{name}</A>\n"
+            )
+        else:
+            out.write(f"{indent}<HR>\n")
+        count += 1
+
+    while depth > 0:
+        out.write(f"{INDENT * depth}</DL><p>\n")
+        depth -= 1
+    out.write("</DL>\n")
+
+    return count
@@ -0,0 +1,486 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from sqlite3 import Connection
+from traceback import print_exception
+from typing import Dict, List, Optional, Tuple
+
+import urllib.error
+
+from bookmarks.bookmark import (
+    canonicalize_tree,
+    determine_root_guid,
+    fetch_bookmark,
+    insert_scoped_tree,
+    insert_tree,
+    remove_tree_if_exists,
+)
+from bookmarks.bookmark_types import AnyTree, CompactTree
+from bookmarks.chunked import ResumeError, chunked_import, pending_checkpoint, tree_digest
+from bookmarks.cooperative import cooperative_import
+from bookmarks.export import export_tree
+from bookmarks.parser import StreamingBookmarkParser, make_parser, parse_file
+from bookmarks.staging import staged_import
+from bookmarks.sync import sync_tree
+from utils.backup import UndoJournal, copy_backup, latest_journal, online_backup, rollback
+from utils.config import ProfileConfig
+from utils.connection import STATEMENT_CACHE, ConnectionTuning, TunedConnection
+from utils.fetch import FetchResult, fetch_source
+from utils.guid import generate_guid
+from utils.hash import hash_function
+from utils.maintenance import MaintenanceStats, clean_places, optimize
+from utils.metrics import Metrics, activate, stage
+from utils.scope import Scope
+from utils.places import get_host_and_port, get_prefix
+from utils.triggers import CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER, CREATE_PLACES_AFTERINSERT_TRIGGER
+
+MAX_FETCH_WORKERS = 8
+
+
+class ImportResult(object):
+    def __init__(self, name: str, ok: bool, message: str, metrics: Optional[Dict] = None):
+        self.name = name
+        self.ok = ok
+        self.message = message
+        self.metrics = metrics or {}
+
+
+class FetchedSource(object):
+    """
+    A downloaded source and the parser that consumed it while downloading.
+
+    Documents larger than `parallel_threshold` bytes (0 disables) are parsed
+    with `parse_file_parallel` once downloaded instead, and local files or
+    unchanged cached copies through a memory map. Only the part selected by
+    `scope` is kept.
+    """
+
+    def __init__(self, url: str, parallel_threshold: int = 0, scope: Optional[Scope] = None):
+        self.url = url
+        self.result: Optional[FetchResult] = None
+        self.error: Optional[str] = None
+        self.parallel_threshold = parallel_threshold
+        self.scope = scope
+        self.parser: Optional[StreamingBookmarkParser] = make_parser(compact=True, scope=scope)
+        self._received = 0
+        self._tree: Optional[CompactTree] = None
+
+    def feed(self, chunk: bytes):
+        if self.parser is None:
+            return
+        self._received += len(chunk)
+        if self.parallel_threshold and self._received > self.parallel_threshold:
+            self.parser = None
+        else:
+            self.parser.feed_bytes(chunk)
+
+    def tree(self) -> CompactTree:
+        if self._tree is None:
+            if self.parser is not None and self._received:
+                self._tree = self.parser.close()
+            else:
+                self._tree = parse_file(self.result.body_path, True, self.scope, self.parallel_threshold)
+        return self._tree
+
+
+def combine_trees(trees: List[CompactTree]) -> CompactTree:
+    """
+    Concatenate the trees of several sources, leaving the source trees untouched.
+    """
+    if len(trees) == 1:
+        return trees[0]
+
+    combined = CompactTree()
+    for tree in trees:
+        combined.extend(tree)
+    return combined.finish()
+
+
+def fetch_one(url: str, cache_dir: str, parallel_threshold: int = 0, scope: Optional[Scope] = None) -> FetchedSource:
+    source = FetchedSource(url, parallel_threshold, scope)
+    try:
+        source.result = fetch_source(url, cache_dir, on_chunk=source.feed)
+    except urllib.error.HTTPError as e:
+        source.error = f"HTTP Error fetching bookmarks: {e.code} - {e.reason}"
+    except urllib.error.URLError as e:
+        source.error = f"URL Error fetching bookmarks: {e.reason}"
+    except OSError as e:
+        source.error = f"Error reading bookmarks: {e}"
+    return source
+
+
+def fetch_all(
+    urls, cache_dir: str, parallel_threshold: int = 0, scope: Optional[Scope] = None
+) -> Dict[str, FetchedSource]:
+    """
+    Fetch and parse every distinct URL once, concurrently.
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(urls))) as executor:
+        fetched = executor.map(lambda url: fetch_one(url, cache_dir, parallel_threshold, scope), urls)
+        return {source.url: source for source in fetched}
+
+
+def import_target(profile: ProfileConfig) -> str:
+    # The same document imported into a different root, scope or normalization is still a change
+    target = f"{profile.db_path}#{determine_root_guid(profile.root_folder)}"
+    if profile.scope:
+        target += f"#{profile.scope.key()}"
+    if profile.normalize:
+        target += f"#urls-{profile.normalize.key()}"
+    return target
+
+
+def bind(conn: Connection, metrics: Optional[Metrics] = None, profile_sql: bool = False):
+    """
+    Register the SQL functions, counted by `metrics` when given. Called again
+    on a reused connection to count into the metrics of the next import.
+    """
+    functions = [
+        ("HASH", -1, hash_function),
+        ("GENERATE_GUID", 0, generate_guid),
+        ("get_prefix", 1, get_prefix),
+        ("get_host_and_port", 1, get_host_and_port),
+    ]
+    for name, arguments, fn in functions:
+        conn.create_function(name, arguments, metrics.counted(name, fn) if metrics else fn)
+    if metrics:
+        metrics.attach(conn, profile_sql)
+
+
+def connect(
+    db_path: str,
+    metrics: Optional[Metrics] = None,
+    profile_sql: bool = False,
+    tuning: Optional[ConnectionTuning] = None,
+) -> Connection:
+    if tuning is None:
+        conn = sqlite3.connect(f"file:{db_path}?mode=rw", uri=True)
+    else:
+        conn = sqlite3.connect(
+            f"file:{db_path}?mode=rw", uri=True, factory=TunedConnection, cached_statements=STATEMENT_CACHE
+        )
+        conn.tune(tuning)
+    bind(conn, metrics, profile_sql)
+    return conn
+
+
+def uses_cooperation(profile: ProfileConfig) -> bool:
+    return profile.cooperative and profile.import_mode == "replace" and not profile.scope
+
+
+def uses_staging(profile: ProfileConfig) -> bool:
+    # Scoped imports reuse existing folders, which the staged merge cannot do
+    return profile.staged and profile.import_mode == "replace" and not profile.scope and not uses_cooperation(profile)
+
+
+def uses_chunks(profile: ProfileConfig) -> bool:
+    return (
+        profile.chunk_rows > 0
+        and profile.import_mode == "replace"
+        and not uses_staging(profile)
+        and not uses_cooperation(profile)
+        and not profile.scope
+    )
+
+
+def open_profile(profile: ProfileConfig, metrics: Optional[Metrics] = None) -> Connection:
+    """
+    Connect to the profile database with the functions and temp triggers its
+    import needs.
+    """
+    conn = connect(profile.db_path, metrics, profile.profile_sql, profile.connection_tuning())
+
+    # The staged merge applies the trigger effects itself
+    if not uses_staging(profile):
+        conn.execute(CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER)
+        if not profile.bulk_origins:
+            conn.execute(CREATE_PLACES_AFTERINSERT_TRIGGER)
+    return conn
+
+
+def check_profile(profile: ProfileConfig) -> Optional[str]:
+    if not os.path.exists(profile.path):
+        return f"Profile path does not exist: {profile.path}. Please check your configuration."
+    if not os.path.exists(profile.db_path):
+        return f"Database file not found at {profile.db_path}. Please check your configuration."
+    return None
+
+
+def import_profile(
+    profile: ProfileConfig, bookmarks: AnyTree, prefix: bool = False, conn: Optional[Connection] = None
+) -> ImportResult:
+    """
+    Back up the profile and write `bookmarks` into it according to its options.
+    Runs in a worker process when several profiles are imported. A connection
+    from `open_profile` can be passed in to reuse it; it is left open.
+    """
+    metrics = Metrics()
+    with activate(metrics):
+        result = write_profile(profile, bookmarks, metrics, prefix, conn)
+    result.metrics = metrics.to_dict()
+    return result
+
+
+def write_profile(
+    profile: ProfileConfig, bookmarks: AnyTree, metrics: Metrics, prefix: bool, conn: Optional[Connection] = None
+) -> ImportResult:
+    def log(message: str):
+        print(f"[{profile.name}] {message}" if prefix else message, flush=True)
+
+    def failed(message: str) -> ImportResult:
+        log(message)
+        return ImportResult(profile.name, False, message)
+
+    error = check_profile(profile)
+    if error:
+        return failed(error)
+
+    db_path = profile.db_path
+    root_guid = determine_root_guid(profile.root_folder)
+    cooperative = uses_cooperation(profile)
+    if profile.cooperative and not cooperative:
+        log("[WARNING] cooperative only applies to import_mode = replace without a scope. Importing at once.")
+    staged = uses_staging(profile)
+    if profile.staged and not staged:
+        log(
+            "[WARNING] staged only applies to import_mode = replace without cooperative or a scope. "
+            "Importing without staging."
+        )
+    chunked = uses_chunks(profile)
+    if profile.chunk_rows and not chunked:
+        log(
+            "[WARNING] chunk_rows only applies to import_mode = replace without cooperative, staged or a scope. "
+            "Importing without chunks."
+        )
+    if cooperative and profile.backup == "copy":
+        log("[WARNING] Copying a database Firefox is writing to can miss its last changes. Use backup = online.")
+    # Taken before normalization, which depends on the places already written
+    digest = tree_digest(bookmarks) if chunked else ""
+    checkpoint = pending_checkpoint(db_path, digest, import_target(profile)) if chunked and profile.resume else None
+
+    # Backup the existing database file
+    with stage("backup"):
+        if checkpoint:
+            log("Resuming an interrupted import. The backup taken when it started is kept.")
+        elif profile.backup == "copy":
+            backup_path = copy_backup(db_path, profile.backup_count)
+            log(f"Backup of the database created at {backup_path}")
+        elif profile.backup == "online":
+            backup_path = online_backup(
+                db_path, profile.backup_count, profile.backup_pages, profile.backup_sleep, log
+            )
+            log(f"Backup of the database created at {backup_path}")
+
+    # Statements, function calls and rows are only counted for a report
+    counted = metrics if profile.measured else None
+    owned = conn is None
+    try:
+        if owned:
+            log("Binding functions and creating temp triggers...")
+            conn = open_profile(profile, counted)
+        else:
+            bind(conn, counted, profile.profile_sql)
+
+        if cooperative and conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+            return failed("A cooperative import needs the database in WAL mode, so Firefox can read while it writes.")
+
+        if isinstance(conn, TunedConnection):
+            if os.path.exists(profile.lock_path):
+                log("[WARNING] Firefox is running, keeping the synchronous setting of the database.")
+            else:
+                conn.relax_synchronous()
+
+        journal = None
+        if profile.backup == "journal":
+            journal = UndoJournal(conn)
+            journal.install()
+
+        cursor = conn.cursor()
+        root = fetch_bookmark(cursor, root_guid)
+        if not root:
+            return failed(f"Root bookmark with GUID {root_guid} not found. Possibily the profile is not set up correctly.")
+
+        if counted:
+            counted.count_rows(conn)
+        if profile.normalize:
+            with stage("normalize"):
+                bookmarks, normalized = canonicalize_tree(cursor, bookmarks, profile.normalize)
+            metrics.count("normalize_rows_saved", normalized.rows_saved)
+            log(f"Normalized URLs: {normalized}.")
+
+        if profile.import_mode == "sync":
+            log("Synchronizing bookmarks...")
+            with stage("sync"):
+                stats = sync_tree(cursor, bookmarks, root.id, profile.bulk_origins, profile.scope)
+            log(f"Synchronized bookmarks: {stats}")
+        elif cooperative:
+            log("Writing bookmarks in short transactions...")
+            cooperation = cooperative_import(
+                conn,
+                bookmarks,
+                root.id,
+                profile.lock_hold,
+                profile.lock_wait,
+                profile.remove_if_duplicate,
+                profile.bulk_origins,
+                # The per statement timings of profile_sql use the progress handler
+                not profile.profile_sql,
+                log=log,
+            )
+            metrics.count("lock_retries", cooperation.retries)
+            metrics.count("lock_wait_ms", int(cooperation.lock_wait * 1000))
+            metrics.count("lock_max_hold_ms", int(cooperation.max_hold * 1000))
+            metrics.count("lock_interrupted_batches", cooperation.interrupted)
+            log(f"Cooperative write: {cooperation}.")
+        elif chunked:
+            log(f"Inserting bookmarks in chunks of {profile.chunk_rows} rows...")
+            chunked_import(
+                conn,
+                bookmarks,
+                root.id,
+                digest,
+                import_target(profile),
+                db_path,
+                profile.chunk_rows,
+                checkpoint,
+                profile.remove_if_duplicate,
+                profile.bulk_origins,
+                log,
+            )
+        elif staged:
+            log("Staging and merging bookmarks...")
+            staged_import(conn, bookmarks, root.id, profile.remove_if_duplicate)
+        else:
+            if profile.remove_if_duplicate:
+                log("Removing existing bookmarks in the root folder...")
+                with stage("remove"):
+                    remove_tree_if_exists(cursor, bookmarks, root.id, profile.scope)
+
+            log("Inserting bookmarks...")
+            with stage("insert"):
+                if profile.scope:
+                    insert_scoped_tree(cursor, bookmarks, root.id, profile.scope, profile.bulk_origins)
+                else:
+                    insert_tree(cursor, bookmarks, root.id, bulk_origins=profile.bulk_origins)
+
+        with stage("commit"):
+            conn.commit()
+
+        # In its own transaction, so a failed cleanup keeps the committed import
+        maintenance = None
+        if profile.maintenance:
+            log("Removing orphaned places and origins...")
+            try:
+                with stage("maintenance"):
+                    maintenance = clean_places(cursor, MaintenanceStats())
+                    conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                maintenance = None
+                log(f"[WARNING] Maintenance failed, the import is kept: {e}")
+        if counted:
+            counted.collect_rows(conn)
+
+        if maintenance:
+            with stage("optimize"):
+                optimize(conn, maintenance, profile.analyze, profile.maintenance_budget)
+            metrics.count("maintenance_freed_bytes", maintenance.freed_bytes)
+            metrics.count("maintenance_vacuumed_bytes", maintenance.vacuumed_bytes)
+            log(f"Maintenance: {maintenance}.")
+
+        if journal:
+            with stage("journal"):
+                journal_path = journal.save(db_path, profile.backup_count)
+            if journal_path:
+                log(f"Undo journal written to {journal_path}. Run with --rollback to undo this import.")
+
+        log(f"Bookmarks successfully inserted into the Firefox profile at {profile.path}.")
+        return ImportResult(profile.name, True, "imported")
+
+    except sqlite3.OperationalError as e:
+        if conn and conn.in_transaction:
+            conn.rollback()
+        if "database is locked" in str(e) and cooperative:
+            return failed(f"Could not get the write lock within {profile.lock_wait:g}s. Firefox may hold it exclusively.")
+        if "database is locked" in str(e):
+            return failed("Database is locked. Please close Firefox and try again.")
+        print_exception(e)
+        return failed(f"Database connection error: {e}")
+    except sqlite3.Error as e:
+        if conn:
+            conn.rollback()
+        return failed(f"SQLite error: {e}")
+    except ResumeError as e:
+        return failed(str(e))
+    finally:
+        if isinstance(conn, TunedConnection):
+            conn.restore_synchronous()
+        if conn and owned:
+            conn.close()
+
+
+def export_profile(profile: ProfileConfig, path: str, root_folder: Optional[str] = None) -> ImportResult:
+    """
+    Write a root folder of the profile, by default its import root, to `path` as
+    a bookmark file. The database is opened read only.
+    """
+    error = check_profile(profile)
+    if error:
+        return ImportResult(profile.name, False, error)
+
+    root_folder = root_folder or profile.root_folder
+    conn = sqlite3.connect(f"file:{profile.db_path}?mode=ro", uri=True)
+    tmp_path = path + ".tmp"
+    try:
+        cursor = conn.cursor()
+        root = fetch_bookmark(cursor, determine_root_guid(root_folder))
+        if not root:
+            return ImportResult(profile.name, False, f"Root folder {root_folder} not found in {profile.db_path}.")
+
+        with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+            count = export_tree(cursor, root.id, f, root.title or root_folder)
+        os.replace(tmp_path, path)
+    except sqlite3.OperationalError as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return ImportResult(profile.name, False, f"Export failed: {e}")
+    finally:
+        conn.close()
+
+    return ImportResult(profile.name, True, f"Exported {count} items from {root_folder} to {path}.")
+
+
+def rollback_profile(profile: ProfileConfig, journal_path: Optional[str] = None) -> ImportResult:
+    error = check_profile(profile)
+    if error:
+        return ImportResult(profile.name, False, error)
+
+    journal_path = journal_path or latest_journal(profile.db_path)
+    if not journal_path or not os.path.exists(journal_path):
+        return ImportResult(profile.name, False, f"No undo journal found for {profile.db_path}.")
+
+    conn = sqlite3.connect(f"file:{profile.db_path}?mode=rw", uri=True)
+    try:
+        touched = rollback(conn, journal_path)
+    except sqlite3.OperationalError as e:
+        return ImportResult(profile.name, False, f"Rollback failed: {e}")
+    finally:
+        conn.close()
+
+    os.replace(journal_path, journal_path + ".applied")
+    return ImportResult(profile.name, True, f"Rolled back {touched} rows from {journal_path}.")
+
+
+def run_import(job: Tuple[ProfileConfig, AnyTree, bool]) -> ImportResult:
+    profile, bookmarks, prefix = job
+    try:
+        return import_profile(profile, bookmarks, prefix)
+    except Exception as e:
+        print_exception(e)
+        return ImportResult(profile.name, False, f"Unexpected error: {e}")
@@ -1,9 +1,23 @@
 from __future__ import annotations
 
+import html
+import mmap
+import os
 import re
-from typing import Tuple
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from itertools import repeat
+from typing import Iterable, List, Optional, Tuple, Union
 
-from bookmarks.bookmark_types import Bookmark, BookmarkFolder, BookmarkTree
+from bookmarks.bookmark_types import AnyTree, Bookmark, BookmarkFolder, BookmarkTree, CompactTree
+from utils.scope import SELECTED, Scope
+
+
+def decode_title(text: str) -> str:
+    """
+    Titles hold character references the way the file wrote them, "&amp;" for "&".
+    """
+    return html.unescape(text) if "&" in text else text
 
 
 def print_tree(nodes: BookmarkTree, indent: int = 0):
@@ -30,7 +44,7 @@ def parse_dl_node(lines, pointer) -> Tuple[BookmarkTree, int]:
             if "<a " in line.lower():
                 # Bookmark
                 name_match = re.search(r'>([^<]*)</a>', line, re.IGNORECASE)
-                name = name_match.group(1).strip() if name_match else "Unnamed Bookmark"
+                name = decode_title(name_match.group(1).strip()) if name_match else "Unnamed Bookmark"
                 
                 # URL
                 url_match = re.search(r'href="([^"]*)"', line, re.IGNORECASE)
@@ -39,13 +53,15 @@ def parse_dl_node(lines, pointer) -> Tuple[BookmarkTree, int]:
                 tree.append(Bookmark(name=name, url=url))
 
                 pointer += 1
-            elif "<h3>" in line.lower():
-                # Folder
-                name_match = re.search(r'<h3>([^<]*)</h3>', line, re.IGNORECASE)
-                name = name_match.group(1).strip() if name_match else "Unnamed Folder"
+            elif "<h3" in line.lower():
+                # Folder, Firefox exports its dates as attributes
+                name_match = re.search(r'<h3[^>]*>([^<]*)</h3>', line, re.IGNORECASE)
+                name = decode_title(name_match.group(1).strip()) if name_match else "Unnamed Folder"
                 
                 folder, pointer = parse_dl_node(lines, pointer + 1)
                 tree.append(BookmarkFolder(name=name, items=folder))
+            else:
+                pointer += 1
         else:
             pointer += 1
         
@@ -59,3 +75,453 @@ def parse_html_bookmark(html_content):
             # Root DL
             bookmarks, _ = parse_dl_node(lines, pointer+1)
             return bookmarks
+
+
+HREF_PATTERN = re.compile(r'href="([^"]*)"', re.IGNORECASE)
+
+# Byte level equivalents for `feed_mapped`: a whole <DT><A>title</A> item,
+# comments, or tags with quoted attribute values that may contain ">", named the
+# way HTMLParser reads them. Matching an item at once takes a third of the calls.
+MAPPED_ATTRIBUTES = rb"(?:[^>\"']|\"[^\"]*\"|'[^']*')*"
+MAPPED_TOKEN_PATTERN = re.compile(
+    rb"<[dD][tT](?=[\t\n\r\f />\x00])" + MAPPED_ATTRIBUTES + rb">[^<]*"
+    rb"<[aA](?=[\t\n\r\f />\x00])(?P<anchor>" + MAPPED_ATTRIBUTES + rb")>(?P<title>[^<]*)"
+    rb"</[aA](?=[\t\n\r\f />\x00])" + MAPPED_ATTRIBUTES + rb">"
+    rb"|<!--.*?-->"
+    rb"|<(?P<end>/?)(?P<name>[a-zA-Z][^\t\n\r\f />\x00]*)(?P<attributes>" + MAPPED_ATTRIBUTES + rb")>",
+    re.DOTALL,
+)
+MAPPED_HREF_PATTERN = re.compile(rb'href="([^"]*)"', re.IGNORECASE)
+# Tags the parser reacts to; the text of titles never contains them
+MAPPED_TAGS = {b"dl", b"dt", b"a", b"h3"}
+
+
+class StreamingBookmarkParser(HTMLParser):
+    """
+    Incremental parser producing the same tree as `parse_html_bookmark`.
+
+    Bytes can be fed as they arrive and tags may be split across lines or chunks.
+    Character references are kept verbatim to match the line based parser.
+    With `compact` the result is a `CompactTree` built directly, without
+    intermediate Bookmark and BookmarkFolder objects.
+    """
+
+    def __init__(self, compact: bool = False):
+        super().__init__(convert_charrefs=False)
+        self._compact = compact
+        # Open folders: item lists, or folder indexes of a compact tree
+        self._stack: List[Union[BookmarkTree, int]] = []
+        self._tree: Optional[AnyTree] = None
+        # Tag whose text is being collected, either "a" or "h3"
+        self._open: Optional[str] = None
+        self._text: List[str] = []
+        self._url = ""
+        # Last folder heading, waiting for its <DL>
+        self._folder: Optional[Union[BookmarkTree, int]] = None
+        # URL of the anchor being read from bytes
+        self._mapped_url: Optional[str] = None
+        # Bytes of `feed_bytes` after the last complete token
+        self._pending = b""
+        self._done = False
+
+    def feed_bytes(self, chunk: bytes):
+        """
+        Scan the bytes as they arrive the way `feed_mapped` scans a whole
+        document, which is several times faster than decoding them for HTMLParser.
+        Whatever follows the last complete token, or a "<" that more bytes could
+        turn into one, is kept for the next chunk.
+        """
+        if self._done:
+            return
+
+        data = self._pending + chunk if self._pending else chunk
+        position = 0
+        for match in MAPPED_TOKEN_PATTERN.finditer(data):
+            if self._done or self._unfinished(data, position, match.start()):
+                break
+            self._handle_text(data, position, match.start())
+            position = match.end()
+            self._handle_token(match)
+        self._pending = data[position:]
+
+    def feed_mapped(self, data):
+        """
+        Parse a whole document from bytes or an mmap without decoding it. Tags
+        are found on the raw bytes and only the titles and URLs are decoded, then
+        handled exactly as `feed` would.
+        """
+        position = 0
+        for match in MAPPED_TOKEN_PATTERN.finditer(data):
+            if self._done:
+                break
+            self._handle_text(data, position, match.start())
+            position = match.end()
+            self._handle_token(match)
+
+        if not self._done:
+            self._handle_text(data, position, len(data))
+
+    @staticmethod
+    def _unfinished(data, start: int, end: int) -> bool:
+        """
+        Whether a "<" between two tokens can still start a tag or comment once
+        more bytes arrive, namely an open quote or an unclosed comment.
+        """
+        index = data.find(b"<", start, end)
+        while index != -1:
+            following = data[index + 1 : index + 4]
+            if following[:1].isalpha() or following[:1] == b"/" and following[1:2].isalpha():
+                return True
+            if following == b"!--":
+                return True
+            index = data.find(b"<", index + 1, end)
+        return False
+
+    def _handle_text(self, data, start: int, end: int):
+        if self._open is not None and end > start:
+            self.handle_data(data[start:end].decode("utf-8"))
+
+    @staticmethod
+    def _mapped_href(attributes: bytes) -> str:
+        href = MAPPED_HREF_PATTERN.search(attributes)
+        return href.group(1).decode("utf-8").strip() if href else ""
+
+    def _handle_token(self, match):
+        title = match.group("title")
+        if title is not None:
+            # What handle_starttag, handle_data and handle_endtag do for a whole
+            # <DT><A>title</A> item, whose text before <A> is not collected
+            if self._stack and not self._done:
+                if self._open == "a":
+                    self._add_bookmark("Unnamed Bookmark", self._url)
+                self._open = None
+                self._text = []
+                self._folder = None
+                self._url = self._mapped_href(match.group("anchor"))
+                self._add_bookmark(decode_title(title.decode("utf-8").strip()), self._url)
+            return
+
+        name = match.group("name")
+        if name is None:
+            return
+        name = name.lower()
+        if name not in MAPPED_TAGS:
+            return
+
+        tag = name.decode("ascii")
+        if match.group("end"):
+            self.handle_endtag(tag)
+        elif tag == "a":
+            self._mapped_url = self._mapped_href(match.group("attributes"))
+            self.handle_starttag(tag, [])
+            self._mapped_url = None
+        else:
+            self.handle_starttag(tag, [])
+
+    def close(self) -> AnyTree:
+        if self._pending:
+            self.feed_mapped(self._pending)
+            self._pending = b""
+        super().close()
+        if self._compact:
+            return (self._tree or CompactTree()).finish()
+        return self._tree or []
+
+    def _text_content(self) -> str:
+        text = decode_title("".join(self._text).strip())
+        self._open = None
+        self._text = []
+        return text
+
+    def _append_bookmark(self, parent: Union[BookmarkTree, int], name: str, url: str):
+        if self._compact:
+            self._tree.add_bookmark(parent, name, url)
+        else:
+            parent.append(Bookmark(name=name, url=url))
+
+    def _append_folder(self, parent: Union[BookmarkTree, int], name: str) -> Union[BookmarkTree, int]:
+        """
+        Add a folder to `parent` and return what its items are added to.
+        """
+        if self._compact:
+            return self._tree.add_folder(parent, name)
+        folder = BookmarkFolder(name=name, items=[])
+        parent.append(folder)
+        return folder.items
+
+    def _open_root(self):
+        return -1 if self._compact else self._tree
+
+    def _add_bookmark(self, name: str, url: str):
+        self._append_bookmark(self._stack[-1], name, url)
+
+    def _add_folder(self, name: str):
+        self._folder = self._append_folder(self._stack[-1], name)
+
+    def handle_starttag(self, tag, attrs):
+        if self._done:
+            return
+
+        if tag == "dl":
+            if self._tree is None:
+                self._tree = CompactTree() if self._compact else []
+                self._stack.append(self._open_root())
+            elif self._folder is not None:
+                self._stack.append(self._folder)
+                self._folder = None
+        elif not self._stack:
+            return
+        elif tag == "dt":
+            if self._open == "a":
+                # Anchor was never closed
+                self._add_bookmark("Unnamed Bookmark", self._url)
+            self._open = None
+            self._text = []
+            self._folder = None
+        elif tag == "a":
+            if self._mapped_url is not None:
+                self._url = self._mapped_url
+            else:
+                match = HREF_PATTERN.search(self.get_starttag_text() or "")
+                self._url = match.group(1).strip() if match else ""
+            self._open = tag
+        elif tag == "h3":
+            self._open = tag
+
+    def handle_endtag(self, tag):
+        if self._done or not self._stack:
+            return
+
+        if tag == "dl":
+            self._stack.pop()
+            self._folder = None
+            if not self._stack:
+                self._done = True
+        elif tag == "a" and self._open == tag:
+            self._add_bookmark(self._text_content(), self._url)
+        elif tag == "h3" and self._open == tag:
+            self._add_folder(self._text_content())
+
+    def handle_data(self, data):
+        if self._open is not None:
+            self._text.append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name):
+        self.handle_data(f"&#{name};")
+
+
+class ScopeFrame(object):
+    """
+    A folder seen by `ScopedBookmarkParser`. Container folders are only added to
+    the tree once something below them is selected.
+    """
+
+    __slots__ = ("parent", "name", "path", "state", "target")
+
+    def __init__(self, parent: Optional[ScopeFrame], name: str, path: Tuple[str, ...], state: int, target=None):
+        self.parent = parent
+        self.name = name
+        self.path = path
+        self.state = state
+        # Items list or compact folder index, once added to the tree
+        self.target = target
+
+
+class ScopedBookmarkParser(StreamingBookmarkParser):
+    """
+    Streaming parser that applies a `Scope` while parsing, so skipped folders
+    and bookmarks are never added to the tree.
+    """
+
+    def __init__(self, scope: Scope, compact: bool = False):
+        super().__init__(compact)
+        self._scope = scope
+
+    def _open_root(self) -> ScopeFrame:
+        return ScopeFrame(None, "", (), self._scope.root_state(), super()._open_root())
+
+    def _materialize(self, frame: ScopeFrame):
+        if frame.target is None:
+            frame.target = self._append_folder(self._materialize(frame.parent), frame.name)
+        return frame.target
+
+    def _add_bookmark(self, name: str, url: str):
+        frame = self._stack[-1]
+        if self._scope.keeps_bookmark(len(frame.path) + 1, url, frame.state):
+            self._append_bookmark(self._materialize(frame), name, url)
+
+    def _add_folder(self, name: str):
+        parent = self._stack[-1]
+        path = parent.path + (name,)
+        frame = ScopeFrame(parent, name, path, self._scope.folder_state(path, parent.state))
+        if frame.state == SELECTED:
+            self._materialize(frame)
+        self._folder = frame
+
+
+def make_parser(compact: bool = False, scope: Optional[Scope] = None) -> StreamingBookmarkParser:
+    return ScopedBookmarkParser(scope, compact) if scope else StreamingBookmarkParser(compact)
+
+
+def parse_html_bookmark_stream(
+    chunks: Iterable[bytes], compact: bool = False, scope: Optional[Scope] = None
+) -> AnyTree:
+    parser = make_parser(compact, scope)
+    for chunk in chunks:
+        parser.feed_bytes(chunk)
+    return parser.close()
+
+
+def parse_mapped_file(path: str, compact: bool = False, scope: Optional[Scope] = None) -> AnyTree:
+    """
+    Parse a local bookmark file through a read only memory map with
+    `feed_mapped`, so the document is never held decoded in memory.
+    """
+    parser = make_parser(compact, scope)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                parser.feed_mapped(data)
+    return parser.close()
+
+
+def parse_file(
+    path: str, compact: bool = False, scope: Optional[Scope] = None, parallel_threshold: int = 0
+) -> AnyTree:
+    """
+    Parse a local bookmark file, on several processes when it is larger than
+    `parallel_threshold` bytes (0 never does).
+    """
+    if parallel_threshold and os.path.getsize(path) > parallel_threshold:
+        return parse_file_parallel(path, compact=compact, scope=scope)
+    return parse_mapped_file(path, compact, scope)
+
+
+# Tags the pre-scan tracks, matched the way HTMLParser reads tag names
+SCAN_TAG_PATTERN = re.compile(rb"<(/?)(dl|dt)(?=[\s/>])", re.IGNORECASE)
+SCAN_FOLDER_PATTERN = re.compile(rb"<dt[^>]*>\s*<h3(?=[\s/>])", re.IGNORECASE)
+
+# Ranges handed to each worker, to even out folders of very different sizes
+TASKS_PER_WORKER = 4
+
+
+def top_level_ranges(data) -> Optional[List[Tuple[int, int]]]:
+    """
+    Byte ranges of the contents of the root <DL>, split before every top level
+    <DT><H3> folder. Returns None when the document cannot be split safely.
+
+    `data` can be bytes or an mmap. UTF-8 never uses ASCII bytes inside a
+    multi-byte sequence, so the ranges always start and end on a character.
+    """
+    depth = 0
+    start = None
+    end = len(data)
+    boundaries: List[int] = []
+
+    for match in SCAN_TAG_PATTERN.finditer(data):
+        closing = bool(match.group(1))
+        if match.group(2).lower() == b"dl":
+            if closing:
+                if start is None:
+                    continue
+                depth -= 1
+                if depth == 0:
+                    end = match.start()
+                    break
+            else:
+                depth += 1
+                if start is None:
+                    start = data.find(b">", match.end()) + 1
+                    if start == 0:
+                        return None
+        elif not closing and depth == 1 and SCAN_FOLDER_PATTERN.match(data, match.start()):
+            boundaries.append(match.start())
+
+    if start is None:
+        return None
+    # Tags inside a comment are invisible to the parser but not to the scan
+    if data.find(b"<!--", start, end) != -1:
+        return None
+
+    offsets = [start] + boundaries + [end]
+    return [(offsets[i], offsets[i + 1]) for i in range(len(offsets) - 1) if offsets[i] < offsets[i + 1]]
+
+
+def group_ranges(ranges: List[Tuple[int, int]], tasks: int) -> List[Tuple[int, int]]:
+    """
+    Merge neighbouring ranges into about `tasks` ranges of similar size.
+    """
+    if not ranges:
+        return []
+
+    target = (ranges[-1][1] - ranges[0][0]) / max(tasks, 1)
+    grouped: List[Tuple[int, int]] = []
+    group_start = ranges[0][0]
+    for _, range_end in ranges:
+        if range_end - group_start >= target:
+            grouped.append((group_start, range_end))
+            group_start = range_end
+    if group_start < ranges[-1][1]:
+        grouped.append((group_start, ranges[-1][1]))
+    return grouped
+
+
+def parse_range(path: str, start: int, end: int, compact: bool = False, scope: Optional[Scope] = None) -> AnyTree:
+    """
+    Parse the top level items in `path` between `start` and `end` as if they were
+    the whole root folder.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # A trailing <DT> ends an unclosed anchor the same way the next item would
+            document = b"<DL><p>" + data[start:end] + b"<DT></DL>"
+
+    parser = make_parser(compact, scope)
+    parser.feed_mapped(document)
+    return parser.close()
+
+
+def parse_file_parallel(
+    path: str, workers: Optional[int] = None, compact: bool = False, scope: Optional[Scope] = None
+) -> AnyTree:
+    """
+    Parse a bookmark file on several processes. The root folder is split at its
+    top level folders, the pieces are parsed by a ProcessPoolExecutor and joined
+    in document order, giving the same tree as `parse_html_bookmark_stream`.
+    """
+    workers = workers or os.cpu_count() or 1
+    # The pre-scan reads the whole file, only worth it when the pieces can run side by side
+    if workers < 2:
+        return parse_mapped_file(path, compact, scope)
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return CompactTree().finish() if compact else []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            ranges = top_level_ranges(data)
+
+    if ranges is None or len(ranges) < 2:
+        return parse_mapped_file(path, compact, scope)
+
+    ranges = group_ranges(ranges, workers * TASKS_PER_WORKER)
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+        parts = list(
+            executor.map(
+                parse_range,
+                repeat(path),
+                [start for start, _ in ranges],
+                [end for _, end in ranges],
+                repeat(compact),
+                repeat(scope),
+            )
+        )
+
+    if compact:
+        tree = CompactTree()
+        for part in parts:
+            tree.extend(part)
+        return tree.finish()
+    return [item for part in parts for item in part]
@@ -0,0 +1,222 @@
+"""
+Staged import: every row is prepared in an attached scratch database while the
+profile is only read, then merged into moz_places, moz_origins and moz_bookmarks
+with a handful of INSERT ... SELECT statements in one short write transaction.
+
+The merge applies the effects of the temp triggers in utils.triggers itself, so
+neither trigger may be installed on the connection.
+"""
+
+import time
+from collections import Counter
+from sqlite3 import Connection
+from typing import Optional
+
+from bookmarks.bookmark import (
+    compact_rows,
+    flatten_tree,
+    iter_urls,
+    next_bookmark_id,
+    next_position,
+    remove_tree_if_exists,
+)
+from bookmarks.bookmark_types import AnyTree, CompactTree
+from utils.guid import guid_allocator
+from utils.metrics import stage
+from utils.places import insert_origins, place_rows
+from utils.triggers import IS_PLACE_QUERY
+
+# Run one by one, as executescript would commit the transaction of the caller
+STAGE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS stage.places (
+        url TEXT PRIMARY KEY, url_hash INTEGER, rev_host TEXT,
+        hidden INTEGER, frecency INTEGER, guid TEXT,
+        prefix TEXT, host TEXT,
+        bookmark_count INTEGER, place_id INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS stage.places_place_idindex ON places (place_id)",
+    """
+    CREATE TABLE IF NOT EXISTS stage.bookmarks (
+        id INTEGER PRIMARY KEY, fk INTEGER, type INTEGER, parent INTEGER, position INTEGER,
+        title TEXT, date_added INTEGER, last_modified INTEGER, guid TEXT,
+        syncStatus INTEGER, syncChangeCounter INTEGER
+    )
+    """,
+    "DELETE FROM stage.places",
+    "DELETE FROM stage.bookmarks",
+]
+
+
+def stage_tree(conn: Connection, tree: AnyTree, date_added: Optional[int] = None) -> int:
+    """
+    Fill the attached `stage` database with the place and bookmark rows of
+    `tree`. Staged bookmark ids start at 1, top level rows have parent 0
+    and reference places by their staged rowid. Only a transaction started
+    here is committed. Returns the number of bookmarks.
+    """
+    now = date_added or int(time.time() * 1_000_000)
+    owned = not conn.in_transaction
+    for statement in STAGE_SCHEMA:
+        conn.execute(statement)
+
+    # Checked against the profile, the staged rows are merged into it
+    guids = guid_allocator(conn.cursor())
+    counts = Counter(iter_urls(tree))
+    rows = place_rows(counts, guids)
+    conn.executemany(
+        "INSERT INTO stage.places VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+        [row + (counts[row[0]],) for row in rows],
+    )
+    staged_ids = {row[0]: rowid for rowid, row in enumerate(rows, start=1)}
+
+    if isinstance(tree, CompactTree):
+        conn.executemany(
+            "INSERT INTO stage.bookmarks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            compact_rows(tree, 0, 0, 1, staged_ids, now, guids),
+        )
+        count = len(tree)
+    else:
+        items = flatten_tree(tree, 0, 0, 1, staged_ids, now, guids)
+        conn.executemany(
+            """
+            INSERT INTO stage.bookmarks
+            VALUES (:id, :fk, :type, :parent, :position, :title, :date_added, :last_modified,
+                    :guid, :syncStatus, :syncChangeCounter)
+            """,
+            items,
+        )
+        count = len(items)
+
+    # Resolve places that already exist while only holding a read lock
+    conn.execute(
+        """
+        UPDATE stage.places SET place_id = (
+            SELECT MIN(p.id) FROM main.moz_places p
+            WHERE p.url_hash = stage.places.url_hash AND p.url = stage.places.url
+        )
+        """
+    )
+    # Ends the read of the profile before the merge asks for the write lock
+    if owned:
+        conn.commit()
+
+    return count
+
+
+def merge_stage(conn: Connection, tree: AnyTree, root_id: int, remove_if_duplicate: bool) -> int:
+    """
+    Merge the staged rows below `root_id` inside one BEGIN IMMEDIATE transaction,
+    or inside the transaction of the caller, which is left open. Returns the
+    number of bookmarks inserted.
+    """
+    cursor = conn.cursor()
+    owned = not conn.in_transaction
+    try:
+        if owned:
+            cursor.execute("BEGIN IMMEDIATE")
+
+        if remove_if_duplicate:
+            remove_tree_if_exists(cursor, tree, root_id)
+
+        # Places added since staging are picked up by the NOT EXISTS check
+        last_place_id = cursor.execute("SELECT IFNULL(MAX(id), 0) FROM moz_places").fetchone()[0]
+        cursor.execute(
+            """
+            INSERT OR IGNORE INTO moz_places (url, url_hash, rev_host, hidden, frecency, guid)
+            SELECT s.url, s.url_hash, s.rev_host, s.hidden, s.frecency, s.guid
+            FROM stage.places s
+            WHERE s.place_id IS NULL
+            AND NOT EXISTS (SELECT 1 FROM moz_places p WHERE p.url_hash = s.url_hash AND p.url = s.url)
+            ORDER BY s.rowid
+            """
+        )
+        insert_origins(cursor, last_place_id, "stage.places")
+        cursor.execute(
+            """
+            UPDATE stage.places SET place_id = (
+                SELECT MIN(p.id) FROM main.moz_places p
+                WHERE p.url_hash = stage.places.url_hash AND p.url = stage.places.url
+            )
+            WHERE place_id IS NULL
+            """
+        )
+
+        first_id = next_bookmark_id(cursor) - 1
+        root_position = next_position(cursor, root_id)
+        inserted = cursor.execute(
+            """
+            INSERT INTO moz_bookmarks (id, fk, type, parent, position, title,
+                                    dateAdded, lastModified, guid,
+                                    syncChangeCounter, syncStatus)
+            SELECT b.id + :offset,
+                   s.place_id,
+                   b.type,
+                   CASE WHEN b.parent = 0 THEN :root_id ELSE b.parent + :offset END,
+                   CASE WHEN b.parent = 0 THEN b.position + :root_position ELSE b.position END,
+                   NULLIF(b.title, ''),
+                   b.date_added,
+                   b.last_modified,
+                   b.guid,
+                   b.syncChangeCounter,
+                   b.syncStatus
+            FROM stage.bookmarks b
+            LEFT JOIN stage.places s ON s.rowid = b.fk
+            ORDER BY b.id
+            """,
+            {"offset": first_id, "root_id": root_id, "root_position": root_position},
+        ).rowcount
+
+        # Same effect as CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER for every new bookmark
+        cursor.execute(
+            f"""
+            UPDATE moz_places
+            SET frecency = (CASE WHEN {IS_PLACE_QUERY} THEN 0 ELSE 1 END)
+            WHERE frecency = -1 AND id IN (SELECT place_id FROM stage.places)
+            """
+        )
+        cursor.execute(
+            f"""
+            UPDATE moz_places
+            SET foreign_count = foreign_count + (
+                    SELECT SUM(s.bookmark_count) FROM stage.places s WHERE s.place_id = moz_places.id
+                ),
+                hidden = {IS_PLACE_QUERY},
+                recalc_frecency = NOT {IS_PLACE_QUERY},
+                recalc_alt_frecency = NOT {IS_PLACE_QUERY}
+            WHERE id IN (SELECT place_id FROM stage.places)
+            """
+        )
+
+        if owned:
+            conn.commit()
+    except BaseException:
+        if owned:
+            conn.rollback()
+        raise
+
+    return inserted
+
+
+def staged_import(
+    conn: Connection, tree: AnyTree, root_id: int, remove_if_duplicate: bool, date_added: Optional[int] = None
+) -> int:
+    if not tree:
+        return 0
+
+    owned = not conn.in_transaction
+    # An empty name is a private on-disk database that is removed on detach. It
+    # stays attached while a transaction of the caller uses it.
+    if not any(name == "stage" for _, name, _ in conn.execute("PRAGMA database_list")):
+        conn.execute("ATTACH DATABASE '' AS stage")
+    try:
+        with stage("stage"):
+            stage_tree(conn, tree, date_added)
+        with stage("merge"):
+            return merge_stage(conn, tree, root_id, remove_if_duplicate)
+    finally:
+        if owned and conn.in_transaction:
+            conn.rollback()
+        if not conn.in_transaction:
+            conn.execute("DETACH DATABASE stage")
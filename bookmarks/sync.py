@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from sqlite3 import Cursor
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from bookmarks.bookmark import (
+    SYNC_STATUS_NEW,
+    TYPE_BOOKMARK,
+    TYPE_FOLDER,
+    insert_bookmarks,
+    next_bookmark_id,
+    next_position,
+    remove_bookmarks,
+)
+from bookmarks.bookmark_types import AnyTree, Bookmark, BookmarkFolder, BookmarkInfo, BookmarkTree, CompactTree
+from utils.guid import guid_allocator
+from utils.metrics import stage
+from utils.places import bulk_insert_places
+from utils.scope import CONTAINER, Scope, removable_ids
+from utils.sql import MAX_VARIABLES, chunked, placeholders
+
+Path = Tuple[str, ...]
+
+
+@dataclass
+class SyncStats:
+    inserted: int = 0
+    deleted: int = 0
+    moved: int = 0
+    # Kept their folder but not their position, as siblings were added or removed
+    shifted: int = 0
+    retitled: int = 0
+    unchanged: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.inserted} inserted, {self.deleted} deleted, {self.moved} moved, {self.shifted} shifted, "
+            f"{self.retitled} retitled, {self.unchanged} unchanged"
+        )
+
+
+class ExistingItem(object):
+    def __init__(self, id, type, fk, parent, position, title, guid, sync_status, url):
+        self.id = id
+        self.type = type
+        self.fk = fk
+        self.parent = parent
+        self.position = position
+        self.title = title or ""
+        self.guid = guid
+        self.sync_status = sync_status
+        self.url = url
+        self.path: Path = ()
+        self.matched = False
+
+
+class DesiredItem(object):
+    def __init__(self, type, title, url, parent: Optional[DesiredItem], path: Path, position: int):
+        self.type = type
+        self.title = title
+        self.url = url
+        self.parent = parent
+        self.path = path
+        self.position = position
+        self.existing: Optional[ExistingItem] = None
+        self.id: Optional[int] = None
+
+
+def load_subtree(db: Cursor, tree: BookmarkTree, root_id: int) -> List[ExistingItem]:
+    """
+    Load every bookmark below the root children that share a name with the
+    top level of `tree`, with one recursive query per batch of names.
+    """
+    names = list(dict.fromkeys(item.name for item in tree))
+    items: List[ExistingItem] = []
+    for chunk in chunked(names, MAX_VARIABLES - 1):
+        rows = db.execute(
+            """
+            WITH RECURSIVE
+            subtree(sid) AS (
+                SELECT id FROM moz_bookmarks
+                WHERE parent = ? AND title IN ({})
+                UNION ALL
+                SELECT b.id FROM moz_bookmarks b
+                JOIN subtree ON b.parent = sid
+            )
+            SELECT b.id, b.type, b.fk, b.parent, b.position, b.title, b.guid, b.syncStatus, h.url
+            FROM subtree
+            JOIN moz_bookmarks b ON b.id = sid
+            LEFT JOIN moz_places h ON h.id = b.fk
+            ORDER BY b.parent, b.position
+            """.format(
+                placeholders(len(chunk))
+            ),
+            [root_id] + chunk,
+        ).fetchall()
+        items.extend(ExistingItem(*row) for row in rows)
+
+    by_id = {item.id: item for item in items}
+
+    def resolve_path(item: ExistingItem) -> Path:
+        if item.path or item.parent == root_id:
+            return item.path
+        parent = by_id[item.parent]
+        parent_path = resolve_path(parent)
+        item.path = parent_path + (parent.title,)
+        return item.path
+
+    for item in items:
+        resolve_path(item)
+
+    return items
+
+
+def flatten_desired(tree: BookmarkTree) -> List[DesiredItem]:
+    desired: List[DesiredItem] = []
+
+    def walk(nodes: BookmarkTree, parent: Optional[DesiredItem], path: Path):
+        for position, node in enumerate(nodes):
+            if isinstance(node, Bookmark):
+                desired.append(DesiredItem(TYPE_BOOKMARK, node.name, node.url, parent, path, position))
+            elif isinstance(node, BookmarkFolder):
+                folder = DesiredItem(TYPE_FOLDER, node.name, None, parent, path, position)
+                desired.append(folder)
+                walk(node.items, folder, path + (node.name,))
+            else:
+                raise TypeError(f"Unknown item type: {type(node)}")
+
+    walk(tree, None, ())
+    return desired
+
+
+def match_items(desired: List[DesiredItem], existing: List[ExistingItem]):
+    """
+    Pair desired items with existing rows. Folders are matched by path. Bookmarks
+    are matched by (path, title, url) first, then by (path, url) as a retitle and
+    finally by (title, url) anywhere in the subtree as a move.
+    """
+    folders: Dict[Tuple[Path, str], Deque[ExistingItem]] = defaultdict(deque)
+    exact: Dict[Tuple[Path, str, str], Deque[ExistingItem]] = defaultdict(deque)
+    by_path_url: Dict[Tuple[Path, str], Deque[ExistingItem]] = defaultdict(deque)
+    by_title_url: Dict[Tuple[str, str], Deque[ExistingItem]] = defaultdict(deque)
+
+    for item in existing:
+        if item.type == TYPE_FOLDER:
+            folders[(item.path, item.title)].append(item)
+        elif item.type == TYPE_BOOKMARK and item.url is not None:
+            exact[(item.path, item.title, item.url)].append(item)
+            by_path_url[(item.path, item.url)].append(item)
+            by_title_url[(item.title, item.url)].append(item)
+
+    def take(candidates: Deque[ExistingItem]) -> Optional[ExistingItem]:
+        while candidates:
+            candidate = candidates.popleft()
+            if not candidate.matched:
+                candidate.matched = True
+                return candidate
+        return None
+
+    bookmarks = []
+    for item in desired:
+        if item.type == TYPE_FOLDER:
+            item.existing = take(folders[(item.path, item.title)])
+        else:
+            item.existing = take(exact[(item.path, item.title, item.url)])
+            if item.existing is None:
+                bookmarks.append(item)
+
+    for item in bookmarks:
+        item.existing = take(by_path_url[(item.path, item.url)])
+
+    for item in bookmarks:
+        if item.existing is None:
+            item.existing = take(by_title_url[(item.title, item.url)])
+
+
+def sync_tree(
+    db: Cursor, tree: AnyTree, root_id: int, bulk_origins: bool = False, scope: Optional[Scope] = None
+) -> SyncStats:
+    """
+    Bring the existing copy of `tree` below the root in line with `tree`, writing
+    only the rows that differ. Matched items keep their GUIDs. With a scope,
+    existing items outside of it are left alone.
+    """
+    if not tree:
+        return SyncStats()
+    if isinstance(tree, CompactTree):
+        tree = tree.to_tree()
+
+    now = int(time.time() * 1_000_000)
+    existing = load_subtree(db, tree, root_id)
+    desired = flatten_desired(tree)
+    match_items(desired, existing)
+    stats = SyncStats()
+
+    # Next free position in folders shared with items this import does not own
+    free_positions: Dict[int, int] = {}
+
+    def shared_position(parent_id: int) -> int:
+        if parent_id not in free_positions:
+            free_positions[parent_id] = next_position(db, parent_id)
+        free_positions[parent_id] += 1
+        return free_positions[parent_id] - 1
+
+    def shared(item: DesiredItem) -> bool:
+        # The root, and with a scope the existing folders around the selection
+        if item.parent is None:
+            return True
+        return bool(scope) and item.parent.existing is not None and scope.state_of(item.path) == CONTAINER
+
+    next_id = next_bookmark_id(db)
+    guids = guid_allocator(db)
+
+    with stage("places"):
+        place_ids = bulk_insert_places(
+            db, [item.url for item in desired if item.existing is None and item.url is not None], bulk_origins
+        )
+
+    inserts: List[BookmarkInfo] = []
+    updates = []
+    shifts = []
+    # Folders whose children moved or were reordered, sent to Sync once each like Firefox does
+    reordered: Set[int] = set()
+    for item in desired:
+        parent_id = item.parent.id if item.parent else root_id
+        current = item.existing
+
+        if current is None:
+            item.id = next_id
+            next_id += 1
+            position = shared_position(parent_id) if shared(item) else item.position
+            inserts.append(
+                {
+                    "id": item.id,
+                    "fk": place_ids.get(item.url) if item.url is not None else None,
+                    "type": item.type,
+                    "parent": parent_id,
+                    "position": position,
+                    "title": item.title,
+                    "date_added": now,
+                    "last_modified": now,
+                    "guid": next(guids),
+                    "syncStatus": SYNC_STATUS_NEW,
+                    "syncChangeCounter": 1,
+                }
+            )
+            stats.inserted += 1
+            continue
+
+        item.id = current.id
+        if shared(item):
+            parent_changed = current.parent != parent_id
+            # Items keep their place among the user's own bookmarks
+            position = shared_position(parent_id) if parent_changed else current.position
+        else:
+            parent_changed = current.parent != parent_id
+            position = item.position
+
+        retitled = current.title != item.title
+        shifted = not parent_changed and current.position != position
+        if parent_changed:
+            reordered.update((current.parent, parent_id))
+        elif shifted:
+            reordered.add(parent_id)
+
+        if parent_changed or retitled:
+            # Only the item's own changes are uploaded with it
+            updates.append(
+                {
+                    "id": current.id,
+                    "parent": parent_id,
+                    "position": position,
+                    "title": item.title,
+                    "last_modified": now,
+                }
+            )
+        elif shifted:
+            shifts.append({"id": current.id, "position": position})
+
+        if parent_changed or retitled or shifted:
+            stats.moved += parent_changed
+            stats.shifted += shifted
+            stats.retitled += retitled
+        else:
+            stats.unchanged += 1
+
+    removed = [item for item in existing if not item.matched]
+    if scope and removed:
+        removable = set(
+            removable_ids(
+                scope,
+                (
+                    (item.id, item.parent, item.path + (item.title,), item.type == TYPE_FOLDER, item.url)
+                    for item in existing
+                    if not item.matched
+                ),
+            )
+        )
+        removed = [item for item in removed if item.id in removable]
+
+    if removed:
+        # Matched children of removed folders are moved out below
+        with stage("remove"):
+            stats.deleted = remove_bookmarks(db, [item.id for item in removed], recursive=False)
+
+    if inserts:
+        with stage("bookmarks"):
+            insert_bookmarks(db, inserts)
+
+    if updates:
+        with stage("update"):
+            db.executemany(
+                """
+                UPDATE moz_bookmarks
+                SET parent = :parent,
+                    position = :position,
+                    title = NULLIF(:title, ''),
+                    lastModified = :last_modified,
+                    syncChangeCounter = syncChangeCounter + 1
+                WHERE id = :id
+                """,
+                updates,
+            )
+    if shifts:
+        with stage("update"):
+            db.executemany("UPDATE moz_bookmarks SET position = :position WHERE id = :id", shifts)
+
+    # Removed folders are gone, inserted ones are already new to Sync
+    reordered.difference_update(item.id for item in removed)
+    reordered.difference_update(item["id"] for item in inserts)
+    if reordered:
+        with stage("update"):
+            db.executemany(
+                "UPDATE moz_bookmarks SET lastModified = ?, syncChangeCounter = syncChangeCounter + 1 WHERE id = ?",
+                [(now, parent_id) for parent_id in sorted(reordered)],
+            )
+
+    return stats
@@ -0,0 +1,163 @@
+"""
+Watch mode: poll the sources with conditional requests and import into each
+profile only when its bookmarks changed.
+
+The parsed tree of the last import is kept per profile, so a document that
+changed on the server without changing its bookmarks never touches the
+database. Each profile keeps the connection of its first import, with the
+functions and temp triggers installed, open between polls and hands it to every
+import, which also takes its backup while the connection is open (an online
+backup reads through a second connection of its own). Before an import the
+profile directory is checked for parent.lock; the connection is closed when
+that file exists, when an import fails and when watching stops. While the
+profile is locked the import is retried with an increasing delay, unless the
+profile imports cooperatively next to Firefox.
+"""
+
+import os
+import time
+from collections import Counter
+from sqlite3 import Connection
+from typing import Dict, List, Optional, Tuple
+
+from bookmarks.bookmark_types import CompactTree
+from bookmarks.importer import (
+    FetchedSource,
+    combine_trees,
+    fetch_all,
+    import_profile,
+    import_target,
+    open_profile,
+    uses_cooperation,
+)
+from utils.config import ProfileConfig, RunConfig
+from utils.fetch import is_imported, mark_imported
+from utils.metrics import Metrics, run_report, write_report
+
+# First delay while waiting for Firefox to exit, doubled up to the poll interval
+LOCK_BACKOFF = 5.0
+
+
+def tree_changes(old: Optional[CompactTree], new: CompactTree) -> Tuple[int, int]:
+    """
+    Number of items added and removed between two trees, comparing each item by
+    its folder path, title and URL.
+    """
+
+    def entries(tree: CompactTree) -> Counter:
+        paths: List[Tuple[str, ...]] = []
+        counts: Counter = Counter()
+        for parent, title, url in tree.items():
+            path = (paths[parent] if parent != -1 else ()) + (title,)
+            paths.append(path)
+            counts[(path, url)] += 1
+        return counts
+
+    new_entries = entries(new)
+    old_entries = entries(old) if old is not None else Counter()
+    return sum((new_entries - old_entries).values()), sum((old_entries - new_entries).values())
+
+
+def is_locked(profile: ProfileConfig) -> bool:
+    return os.path.exists(profile.lock_path) and not uses_cooperation(profile)
+
+
+class ProfileWatch(object):
+    def __init__(self, profile: ProfileConfig, force: bool = False):
+        self.profile = profile
+        # Import on the next poll even if nothing changed, until an import succeeds
+        self.force = force
+        # Last imported tree, and the last parsed one with its source digests
+        self.tree: Optional[CompactTree] = None
+        self.parsed: Optional[Tuple[Tuple[str, ...], CompactTree]] = None
+        self.conn: Optional[Connection] = None
+        self.lock_delay = 0.0
+
+    def parse(self, sources: List[FetchedSource]) -> CompactTree:
+        digests = tuple(source.result.digest for source in sources)
+        if self.parsed is None or self.parsed[0] != digests:
+            self.parsed = (digests, combine_trees([source.tree() for source in sources]))
+        return self.parsed[1]
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+def watch(config: RunConfig, profiles: List[ProfileConfig], interval: float, force: bool = False):
+    """
+    Poll forever, every `interval` seconds or sooner while a changed profile
+    waits for Firefox to exit.
+    """
+    sources = config.sources
+    watches: Dict[str, ProfileWatch] = {profile.name: ProfileWatch(profile, force) for profile in profiles}
+    prefix = len(profiles) > 1
+
+    def log(name: str, message: str):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] [{name}] {message}", flush=True)
+
+    try:
+        while True:
+            fetched = fetch_all(
+                [sources[name] for profile in profiles for name in profile.sources],
+                config.cache_dir,
+                config.parallel_parse_threshold,
+                config.scope,
+            )
+
+            delay = interval
+            for state in watches.values():
+                profile = state.profile
+                profile_sources = [fetched[sources[name]] for name in profile.sources]
+                errors = [source.error for source in profile_sources if source.error]
+                if errors:
+                    log(profile.name, errors[0])
+                    continue
+
+                target = import_target(profile)
+                if not state.force and all(
+                    is_imported(config.cache_dir, source.result, target) for source in profile_sources
+                ):
+                    continue
+
+                tree = state.parse(profile_sources)
+                if not state.force and tree == state.tree:
+                    log(profile.name, "Source changed but its bookmarks did not. Nothing to do.")
+                    for source in profile_sources:
+                        mark_imported(config.cache_dir, source.result, target)
+                    continue
+
+                if is_locked(profile):
+                    state.close()
+                    state.lock_delay = min(max(state.lock_delay * 2, LOCK_BACKOFF), interval)
+                    delay = min(delay, state.lock_delay)
+                    log(profile.name, f"Firefox is running, retrying in {state.lock_delay:.0f}s.")
+                    continue
+                state.lock_delay = 0.0
+
+                added, removed = tree_changes(state.tree, tree)
+                log(profile.name, f"Bookmarks changed ({added} added, {removed} removed). Importing...")
+                if state.conn is None:
+                    state.conn = open_profile(profile)
+
+                started = time.time()
+                result = import_profile(profile, tree, prefix, state.conn)
+                if config.report:
+                    write_report(
+                        config.report,
+                        run_report(started, Metrics(), {profile.name: (result.ok, result.message, result.metrics)}),
+                        config.report_format,
+                    )
+                if result.ok:
+                    state.tree = tree
+                    state.force = False
+                    for source in profile_sources:
+                        mark_imported(config.cache_dir, source.result, target)
+                else:
+                    state.close()
+
+            time.sleep(delay)
+    finally:
+        for state in watches.values():
+            state.close()
@@ -1,121 +1,207 @@
 import argparse
-import configparser
 import os
-from shutil import copy2
-import sqlite3
-from traceback import print_exception
-from urllib import request
-
-import urllib
-import urllib.error
-
-
-from bookmarks.bookmark import determine_root_guid, fetch_bookmark, insert_tree, remove_tree_if_exists
-from bookmarks.parser import parse_html_bookmark
-from utils.hash import hash_function
-from utils.guid import generate_guid
-from utils.places import get_host_and_port, get_prefix
-from utils.triggers import CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER, CREATE_PLACES_AFTERINSERT_TRIGGER
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bookmarks.importer import (
+    combine_trees,
+    export_profile,
+    fetch_all,
+    import_target,
+    rollback_profile,
+    run_import,
+    uses_cooperation,
+)
+from bookmarks.watch import watch
+from utils.config import RunConfig, load_config
+from utils.fetch import is_imported, mark_imported, unmark_imported
+from utils.metrics import Metrics, activate, run_report, stage, write_report
 
 
 def main(args: argparse.Namespace):
-    config = configparser.ConfigParser()
-    config.read(args.config)
+    try:
+        config = load_config(args.config)
+    except (KeyError, ValueError) as e:
+        print(f"Invalid configuration: {e}")
+        exit(1)
 
-    profile_path = config.get("path", "firefox_profile")
-    bookmarks_url = config.get("path", "bookmarks_url")
-    remove_if_duplicate = config.getboolean("options", "remove_if_duplicate")
-    root_guid = determine_root_guid(config.get("options", "root_folder"))
+    started = time.time()
+    metrics = Metrics()
+    results = {}
+    try:
+        with activate(metrics):
+            run(args, config, results)
+    finally:
+        if config.report and not args.watch:
+            write_report(config.report, run_report(started, metrics, results), config.report_format)
 
-    if not os.path.exists(profile_path):
-        print(f"Profile path does not exist: {profile_path}. Please check your configuration.")
+    if not all(ok for ok, _, _ in results.values()):
         exit(1)
 
-    db_path = os.path.join(profile_path, "places.sqlite")
-    if not os.path.exists(db_path):
-        print(f"Database file not found at {db_path}. Please check your configuration.")
-        exit(1)
 
-    if os.path.exists(os.path.join(profile_path, "parent.lock")) and not args.yes:
-        print("[WARNING] A parent.lock file exists in the profile directory. Proceeding will cause potential data loss.")
-        pick = input("Do you want to continue? (yes/no) [no]: ").strip().lower()
-        if pick not in ["yes", "y"]:
-            print("Exiting without making changes.")
-            return
+def run(args: argparse.Namespace, config: RunConfig, results: dict):
+    sources, profiles, cache_dir = config.sources, config.profiles, config.cache_dir
 
-    # Backup the existing database file
-    backup_path = db_path + ".auto.bak"
-    copy2(db_path, backup_path)
-    print(f"Backup of the database created at {backup_path}")
+    if args.profile:
+        profiles = [profile for profile in profiles if profile.name in args.profile]
+    if not profiles:
+        print("No profiles configured. Please check your configuration.")
+        exit(1)
 
-    conn = None
-    try:
-        conn = sqlite3.connect(f"file:{db_path}?mode=rw", uri=True)
-        print("Binding Functions...")
-        conn.create_function("HASH", -1, hash_function)
-        conn.create_function("GENERATE_GUID", 0, generate_guid)
-        conn.create_function("get_prefix", 1, get_prefix)
-        conn.create_function("get_host_and_port", 1, get_host_and_port)
-
-        print("Creating temp trigger...")
-        conn.execute(CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER)
-        conn.execute(CREATE_PLACES_AFTERINSERT_TRIGGER)
-
-        cursor = conn.cursor()
-        root = fetch_bookmark(cursor, root_guid)
-        if not root:
-            print(f"Root bookmark with GUID {root_guid} not found. Possibily the profile is not set up correctly.")
-            return
+    prefix = len(profiles) > 1
+    for profile in profiles:
+        profile.resume = args.resume
 
+    if args.watch:
+        interval = args.watch if args.watch > 0 else config.poll_interval
+        print(f"Watching {len(config.sources)} source(s) for {len(profiles)} profile(s) every {interval:.0f}s.")
         try:
-            print("Fetching bookmarks...")
-            html_content = request.urlopen(bookmarks_url).read().decode("utf-8")
-        except urllib.error.HTTPError as e:
-            print(f"HTTP Error fetching bookmarks: {e.code} - {e.reason}")
-            return
-        except urllib.error.URLError as e:
-            print(f"URL Error fetching bookmarks: {e.reason}")
-            return
-
-        print("Parsing bookmarks...")
-        bookmarks = parse_html_bookmark(html_content)
+            watch(config, profiles, interval, args.force)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        return
+
+    if args.export:
+        if prefix:
+            print("Export needs a single profile (see --profile).")
+            exit(1)
+
+        with stage("export"):
+            result = export_profile(profiles[0], args.export, args.root)
+        print(result.message)
+        results[profiles[0].name] = (result.ok, result.message, {})
+        return
+
+    if args.rollback:
+        journal_path = None if args.rollback == "latest" else args.rollback
+        if journal_path and prefix:
+            print("A journal path can only be given with a single profile (see --profile).")
+            exit(1)
+
+        for profile in profiles:
+            with stage("rollback"):
+                result = rollback_profile(profile, journal_path)
+            # Whatever the journal undid has to be imported again
+            if result.ok:
+                unmark_imported(cache_dir, profile.db_path)
+            print(f"[{profile.name}] {result.message}" if prefix else result.message)
+            results[profile.name] = (result.ok, result.message, {})
+        return
+
+    # Each distinct URL is downloaded once and parsed while it downloads
+    print("Fetching bookmarks...")
+    with stage("fetch"):
+        fetched = fetch_all(
+            [sources[name] for profile in profiles for name in profile.sources],
+            cache_dir,
+            config.parallel_parse_threshold,
+            config.scope,
+        )
+
+    jobs = []
+    for profile in profiles:
+        profile_sources = [fetched[sources[name]] for name in profile.sources]
+        errors = [source.error for source in profile_sources if source.error]
+        if errors:
+            results[profile.name] = (False, errors[0], {})
+            continue
+
+        target = import_target(profile)
+        if not args.force and all(is_imported(cache_dir, source.result, target) for source in profile_sources):
+            results[profile.name] = (True, "already up to date", {})
+            continue
+
+        # A cooperative import is meant to run next to Firefox
+        if os.path.exists(profile.lock_path) and not args.yes and not uses_cooperation(profile):
+            print(
+                f"[WARNING] A parent.lock file exists in the directory of profile {profile.name}. "
+                "Proceeding will cause potential data loss."
+            )
+            pick = input("Do you want to continue? (yes/no) [no]: ").strip().lower()
+            if pick not in ["yes", "y"]:
+                results[profile.name] = (False, "skipped, parent.lock present", {})
+                continue
+
+        print(f"Parsing bookmarks for {profile.name}..." if prefix else "Parsing bookmarks...")
+        with stage("parse"):
+            bookmarks = combine_trees([source.tree() for source in profile_sources])
         if not bookmarks:
-            print("No bookmarks found in the provided HTML content.")
-            return
+            results[profile.name] = (False, "no bookmarks found in the provided HTML content", {})
+            continue
 
-        if remove_if_duplicate:
-            print("Removing existing bookmarks in the root folder...")
-            remove_tree_if_exists(cursor, bookmarks, root.id)
+        jobs.append((profile, bookmarks, prefix))
 
-        print("Inserting bookmarks...")
-        insert_tree(cursor, bookmarks, root.id, root.guid)
+    # Profiles are separate databases, so their writers can run side by side
+    with stage("import"):
+        if len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+                outcomes = list(executor.map(run_import, jobs))
+        else:
+            outcomes = [run_import(job) for job in jobs]
 
-        conn.commit()
+    for (profile, _, _), outcome in zip(jobs, outcomes):
+        results[profile.name] = (outcome.ok, outcome.message, outcome.metrics)
+        if outcome.ok:
+            target = import_target(profile)
+            for name in profile.sources:
+                mark_imported(cache_dir, fetched[sources[name]].result, target)
 
-        print(f"Bookmarks successfully inserted into the Firefox profile at {profile_path}.")
-
-    except sqlite3.OperationalError as e:
-        if "database is locked" in str(e):
-            print("Database is locked. Please close Firefox and try again.")
-            return
-        else:
-            print_exception(e)
-            print(f"Database connection error: {e}")
-            return
-    except sqlite3.Error as e:
-        print(f"SQLite error: {e}")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+    if prefix:
+        print("Summary:")
+        for profile in profiles:
+            ok, message, _ = results[profile.name]
+            print(f"  {profile.name}: {'ok' if ok else 'FAILED'} - {message}")
+    elif not jobs:
+        ok, message, _ = results[profiles[0].name]
+        print(f"Bookmarks are {message}. Nothing to do." if ok else message)
 
 
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser(description="Import bookmarks from an HTML file into a Firefox profile.")
     arg_parser.add_argument(
         "-y", "--yes", action="store_true", help="Automatically confirm the presence of parent.lock file without prompting."
-    ) 
+    )
+    arg_parser.add_argument(
+        "-f", "--force", action="store_true", help="Import even if the source has not changed since the last import."
+    )
+    arg_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an import interrupted after some of its chunks were committed (see chunk_rows).",
+    )
+    arg_parser.add_argument(
+        "--rollback",
+        nargs="?",
+        const="latest",
+        metavar="JOURNAL",
+        help="Undo an import using its undo journal (default: the latest journal of the profile).",
+    )
+    arg_parser.add_argument(
+        "--export",
+        metavar="FILE",
+        help="Write the bookmarks of the profile to FILE as an HTML bookmark file instead of importing.",
+    )
+    arg_parser.add_argument(
+        "--root",
+        choices=["menu", "toolbar", "unfiled", "mobile"],
+        help="Folder to export (default: root_folder of the profile).",
+    )
+    arg_parser.add_argument(
+        "--watch",
+        nargs="?",
+        const=-1,
+        type=float,
+        metavar="SECONDS",
+        help="Keep running and re-import whenever a source changes, polling every SECONDS "
+        "(default: poll_interval from the configuration). Waits for Firefox to exit instead of prompting.",
+    )
+    arg_parser.add_argument(
+        "-p",
+        "--profile",
+        action="append",
+        metavar="NAME",
+        help="Only process the named profile. Can be given more than once (default: all profiles).",
+    )
     arg_parser.add_argument(
         "-c", "--config", type=str, default="config", help="Path to the configuration file (default: 'config')."
     )
@@ -0,0 +1,73 @@
+"""
+Places databases and bookmark trees shared by the tests.
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from typing import List, Tuple
+
+from bench.fixtures import ROOTS, create_places_db
+from bookmarks.bookmark import determine_root_guid, fetch_bookmark
+from bookmarks.bookmark_types import Bookmark, BookmarkFolder
+from bookmarks.importer import bind
+
+TREE = [
+    BookmarkFolder(
+        name="Video",
+        items=[
+            Bookmark(name="One", url="https://one.example.com/"),
+            BookmarkFolder(name="Anime", items=[Bookmark(name="Two", url="https://two.example.com/")]),
+            Bookmark(name="Three", url="https://one.example.com/"),
+        ],
+    ),
+    BookmarkFolder(name="Reading", items=[Bookmark(name="Four", url="https://four.example.com/")]),
+    Bookmark(name="Five", url="https://five.example.com/"),
+]
+
+
+def bookmark_rows(conn: sqlite3.Connection) -> List[Tuple]:
+    """
+    Parent title, position, title and URL of every bookmark below the roots, in
+    id order. Parents are named by title, as replaced rows get new ids.
+    """
+    return conn.execute(
+        """
+        SELECT parent.title, b.position, b.title, p.url FROM moz_bookmarks b
+        JOIN moz_bookmarks parent ON parent.id = b.parent
+        LEFT JOIN moz_places p ON p.id = b.fk
+        WHERE b.id > ? ORDER BY b.id
+        """,
+        (len(ROOTS),),
+    ).fetchall()
+
+
+class PlacesTestCase(unittest.TestCase):
+    """
+    A fresh places database with the SQL functions of an import bound, in a
+    temporary directory so its -wal and -shm files are removed with it.
+    """
+
+    history = 0
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.connections: List[sqlite3.Connection] = []
+        self.conn = self.open_db("places.sqlite", self.history)
+        self.path = os.path.join(self.directory.name, "places.sqlite")
+        self.root_id = fetch_bookmark(self.conn.cursor(), determine_root_guid("toolbar")).id
+
+    def tearDown(self):
+        for conn in self.connections:
+            conn.close()
+        self.directory.cleanup()
+
+    def open_db(self, name: str, history: int = 0) -> sqlite3.Connection:
+        """
+        Create another places database in the temporary directory and connect to it.
+        """
+        conn = sqlite3.connect(create_places_db(os.path.join(self.directory.name, name), history))
+        bind(conn)
+        self.connections.append(conn)
+        return conn
@@ -0,0 +1,100 @@
+import argparse
+import os
+
+import main
+from bench.fixtures import write_html
+from bookmarks.bookmark_types import Bookmark, BookmarkFolder
+from bookmarks.importer import import_profile, rollback_profile
+from test.helpers import TREE, PlacesTestCase
+from utils.backup import JOURNALED_TABLES, latest_journal, online_backup
+from utils.config import ProfileConfig, RunConfig
+
+# Replaces every folder of TREE, so the import updates and deletes rows as well as inserting them
+NEXT_TREE = [
+    BookmarkFolder(
+        name="Video",
+        items=[
+            Bookmark(name="One", url="https://one.example.com/"),
+            Bookmark(name="Six", url="https://six.example.com/"),
+        ],
+    ),
+    BookmarkFolder(
+        name="Reading",
+        items=[Bookmark(name=f"Link {index}", url=f"https://site{index}.example.com/") for index in range(10)],
+    ),
+    Bookmark(name="Five", url="https://five.example.com/"),
+]
+
+
+class TestUndoJournal(PlacesTestCase):
+    history = 50
+
+    def setUp(self):
+        super().setUp()
+        self.profile_dir = self.directory.name
+        result = import_profile(ProfileConfig("test", self.profile_dir, ["a"], backup="none"), TREE)
+        self.assertTrue(result.ok, result.message)
+
+    def rows(self):
+        return {
+            table: self.conn.execute(f"SELECT rowid, * FROM {table} ORDER BY rowid").fetchall()
+            for table in JOURNALED_TABLES
+        }
+
+    def assert_rolled_back(self, **options):
+        before = self.rows()
+        profile = ProfileConfig("test", self.profile_dir, ["a"], backup="journal", **options)
+        result = import_profile(profile, NEXT_TREE)
+        self.assertTrue(result.ok, result.message)
+        self.assertNotEqual(self.rows(), before)
+
+        journal_path = latest_journal(profile.db_path)
+        result = rollback_profile(profile)
+        self.assertTrue(result.ok, result.message)
+        self.assertEqual(self.rows(), before)
+        # A journal is only applied once
+        self.assertTrue(os.path.exists(journal_path + ".applied"))
+        self.assertFalse(rollback_profile(profile).ok)
+
+    def test_rollback_restores_rows(self):
+        self.assert_rolled_back()
+
+    def test_rollback_restores_rows_of_chunked_import(self):
+        self.assert_rolled_back(chunk_rows=3)
+
+    def test_rollback_restores_rows_of_staged_import(self):
+        self.assert_rolled_back(staged=True)
+
+    def test_import_after_rollback(self):
+        source = os.path.join(self.directory.name, "bookmarks.html")
+        write_html(source, 50)
+        profile = ProfileConfig("test", self.profile_dir, ["a"], backup="journal")
+        config = RunConfig({"a": source}, [profile], os.path.join(self.directory.name, "cache"))
+
+        def run(rollback=None):
+            args = argparse.Namespace(
+                profile=None, resume=False, watch=None, export=None, rollback=rollback, force=False, yes=True
+            )
+            results = {}
+            main.run(args, config, results)
+            self.assertTrue(results["test"][0], results["test"][1])
+            return results["test"][1]
+
+        self.assertEqual(run(), "imported")
+        imported = self.rows()
+        run(rollback="latest")
+        self.assertNotEqual(self.rows(), imported)
+        # The rolled back source is not up to date any more
+        self.assertEqual(run(), "imported")
+        self.assertEqual(
+            self.conn.execute("SELECT COUNT(*) FROM moz_bookmarks").fetchone()[0],
+            len(imported["moz_bookmarks"]),
+        )
+
+    def test_online_backup_logs_whole_lines(self):
+        messages = []
+        backup_path = online_backup(self.path, pages=1, log=messages.append)
+        self.assertTrue(os.path.exists(backup_path))
+        self.assertTrue(messages)
+        for message in messages:
+            self.assertRegex(message, r"^Backing up database\.\.\. \d+%$")
@@ -0,0 +1,181 @@
+import random
+import unittest
+
+from bookmarks.bookmark import (
+    SYNC_STATUS_NEW,
+    SYNC_STATUS_NORMAL,
+    compact_rows,
+    flatten_tree,
+    insert_tree,
+    remove_bookmarks,
+)
+from bookmarks.bookmark_types import Bookmark, BookmarkFolder, CompactTree
+from bookmarks.staging import staged_import
+from test.helpers import TREE, PlacesTestCase, bookmark_rows
+from utils.sql import MAX_VARIABLES
+from utils.triggers import CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER
+
+
+def remove_one_by_one(conn, ids, recursive=True):
+    """
+    Reference removal, one row at a time: every deleted bookmark takes one off
+    the foreign_count of its place and leaves a tombstone if Sync uploaded it.
+    """
+    pending = list(ids)
+    while pending:
+        id = pending.pop()
+        row = conn.execute("SELECT fk, guid, syncStatus FROM moz_bookmarks WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            continue
+        fk, guid, sync_status = row
+        if recursive:
+            pending.extend(child for child, in conn.execute("SELECT id FROM moz_bookmarks WHERE parent = ?", (id,)))
+        conn.execute("UPDATE moz_places SET foreign_count = foreign_count - 1 WHERE id = ?", (fk,))
+        if sync_status == SYNC_STATUS_NORMAL:
+            conn.execute("INSERT OR IGNORE INTO moz_bookmarks_deleted (guid) VALUES (?)", (guid,))
+        conn.execute("DELETE FROM moz_bookmarks WHERE id = ?", (id,))
+
+
+def removal_state(conn):
+    return (
+        conn.execute("SELECT id, parent, position, guid FROM moz_bookmarks ORDER BY id").fetchall(),
+        conn.execute("SELECT id, foreign_count FROM moz_places ORDER BY id").fetchall(),
+        conn.execute("SELECT guid FROM moz_bookmarks_deleted ORDER BY guid").fetchall(),
+    )
+
+
+class TestRemoveBookmarks(PlacesTestCase):
+    def setUp(self):
+        super().setUp()
+        # More bookmarks than bound variables, sharing a few places, some of them in nested folders
+        rng = random.Random(0)
+        links = [
+            Bookmark(name=f"Link {index}", url=f"https://site{rng.randrange(40)}.example.com/") for index in range(1500)
+        ]
+        tree = [
+            BookmarkFolder(
+                name="Folder",
+                items=links[:1000] + [BookmarkFolder(name="Nested", items=links[1000:1200])],
+            ),
+            BookmarkFolder(name="Other", items=links[1200:]),
+        ]
+        self.conn.execute(CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER)
+        insert_tree(self.conn.cursor(), tree, self.root_id)
+        statuses = [SYNC_STATUS_NEW, SYNC_STATUS_NORMAL]
+        self.conn.executemany(
+            "UPDATE moz_bookmarks SET syncStatus = ? WHERE id = ?",
+            [(rng.choice(statuses), id) for id, in self.conn.execute("SELECT id FROM moz_bookmarks WHERE id > 6")],
+        )
+        self.conn.commit()
+
+        self.reference = self.open_db("reference.sqlite")
+        self.conn.backup(self.reference)
+
+    def ids(self, where: str):
+        return [id for id, in self.conn.execute(f"SELECT id FROM moz_bookmarks WHERE {where} ORDER BY id")]
+
+    def test_recursive_matches_row_by_row(self):
+        folder, other = self.ids("title IN ('Folder', 'Other')")
+        # Both folders, plus bookmarks already covered by them
+        ids = [folder, other] + self.ids(f"parent = {folder}")[:MAX_VARIABLES + 100]
+        self.assertGreater(len(ids), MAX_VARIABLES)
+
+        removed = remove_bookmarks(self.conn.cursor(), ids)
+        remove_one_by_one(self.reference, ids)
+
+        self.assertEqual(removed, 1503)
+        # Only the items Sync uploaded leave a tombstone
+        tombstones = self.conn.execute("SELECT COUNT(*) FROM moz_bookmarks_deleted").fetchone()[0]
+        self.assertTrue(0 < tombstones < removed)
+        self.assertEqual(removal_state(self.conn), removal_state(self.reference))
+        self.assertEqual(self.conn.execute("SELECT SUM(foreign_count) FROM moz_places").fetchone()[0], 0)
+
+    def test_not_recursive_matches_row_by_row(self):
+        folder = self.ids("title = 'Folder'")[0]
+        # The links of Folder and the Nested folder, without its links
+        ids = self.ids(f"parent = {folder}")
+        self.assertGreater(len(ids), MAX_VARIABLES)
+
+        removed = remove_bookmarks(self.conn.cursor(), ids, recursive=False)
+        remove_one_by_one(self.reference, ids, recursive=False)
+
+        self.assertEqual(removed, len(ids))
+        self.assertEqual(removal_state(self.conn), removal_state(self.reference))
+        self.assertEqual(len(self.ids("title LIKE 'Link 1___'")), 500)
+
+
+def flattened(tree, position):
+    place_ids = {"https://one.example.com/": 1, "https://two.example.com/": 2}
+    guids = (f"guid{index:08d}" for index in range(100))
+    if isinstance(tree, CompactTree):
+        return [row[:5] for row in compact_rows(tree, 3, position, 10, place_ids, 0, guids)]
+    return [
+        (item["id"], item["fk"], item["type"], item["parent"], item["position"])
+        for item in flatten_tree(tree, 3, position, 10, place_ids, 0, guids)
+    ]
+
+
+class TestFlattenTree(unittest.TestCase):
+    def test_top_level_starts_at_position(self):
+        rows = flattened(TREE, 4)
+        # id, fk, type, parent, position
+        self.assertEqual(
+            rows,
+            [
+                (10, None, 2, 3, 4),
+                (11, 1, 1, 10, 0),
+                (12, None, 2, 10, 1),
+                (13, 2, 1, 12, 0),
+                (14, 1, 1, 10, 2),
+                (15, None, 2, 3, 5),
+                (16, None, 1, 15, 0),
+                (17, None, 1, 3, 6),
+            ],
+        )
+        self.assertEqual(flattened(CompactTree.from_tree(TREE), 4), rows)
+
+
+class TestAppendToRoot(PlacesTestCase):
+    def setUp(self):
+        super().setUp()
+        # Root children that are not part of the imports, with a gap left by a removed one
+        insert_tree(self.conn.cursor(), [Bookmark("Kept", "https://kept.example.com/")] * 3, self.root_id)
+        self.conn.execute("DELETE FROM moz_bookmarks WHERE title = 'Kept' AND position = 1")
+        self.conn.commit()
+
+    def root_positions(self):
+        return self.conn.execute(
+            "SELECT title, position FROM moz_bookmarks WHERE parent = ? ORDER BY position", (self.root_id,)
+        ).fetchall()
+
+    def assert_appended(self):
+        self.assertEqual(
+            self.root_positions(),
+            [("Kept", 0), ("Kept", 2), ("Video", 3), ("Reading", 4), ("Five", 5)],
+        )
+        # Only the top level is offset
+        self.assertEqual(
+            bookmark_rows(self.conn)[2:],
+            [
+                ("toolbar", 3, "Video", None),
+                ("Video", 0, "One", "https://one.example.com/"),
+                ("Video", 1, "Anime", None),
+                ("Anime", 0, "Two", "https://two.example.com/"),
+                ("Video", 2, "Three", "https://one.example.com/"),
+                ("toolbar", 4, "Reading", None),
+                ("Reading", 0, "Four", "https://four.example.com/"),
+                ("toolbar", 5, "Five", "https://five.example.com/"),
+            ],
+        )
+
+    def test_tree(self):
+        insert_tree(self.conn.cursor(), TREE, self.root_id)
+        self.assert_appended()
+
+    def test_compact_tree(self):
+        insert_tree(self.conn.cursor(), CompactTree.from_tree(TREE), self.root_id)
+        self.assert_appended()
+
+    def test_staged(self):
+        staged_import(self.conn, CompactTree.from_tree(TREE), self.root_id, False)
+        self.assert_appended()
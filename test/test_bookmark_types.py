@@ -0,0 +1,18 @@
+import unittest
+
+from bookmarks.bookmark_types import Bookmark, BookmarkFolder, CompactTree
+from test.helpers import TREE
+
+
+class TestBookmarkFolder(unittest.TestCase):
+    def test_items_default_to_new_list(self):
+        first = BookmarkFolder("First")
+        second = BookmarkFolder(name="Second")
+        first.items.append(Bookmark("One", "https://one.example.com/"))
+
+        self.assertEqual(second.items, [])
+        self.assertEqual(first, BookmarkFolder("First", [Bookmark("One", "https://one.example.com/")]))
+        self.assertFalse(hasattr(first, "__dict__"))
+
+    def test_compact_round_trip(self):
+        self.assertEqual(CompactTree.from_tree(TREE).to_tree(), TREE)
@@ -0,0 +1,49 @@
+import os
+
+from bookmarks.chunked import chunked_import, checkpoint_path, pending_checkpoint, tree_digest
+from test.helpers import TREE, PlacesTestCase, bookmark_rows
+
+TARGET = "places.sqlite#toolbar_____"
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestChunkedImport(PlacesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.digest = tree_digest(TREE)
+
+    def rows(self):
+        return bookmark_rows(self.conn)
+
+    def interrupt_after(self, chunks: int):
+        committed = []
+
+        def log(message: str):
+            if message.startswith("Committed"):
+                committed.append(message)
+            if len(committed) == chunks:
+                raise Interrupted()
+
+        return log
+
+    def test_resume_matches_uninterrupted_import(self):
+        chunked_import(self.conn, TREE, self.root_id, self.digest, TARGET, self.path, 3, log=lambda _: None)
+        expected = self.rows()
+        self.assertEqual(len(expected), 8)
+        self.assertFalse(os.path.exists(checkpoint_path(self.path)))
+
+        with self.assertRaises(Interrupted):
+            chunked_import(self.conn, TREE, self.root_id, self.digest, TARGET, self.path, 3, log=self.interrupt_after(2))
+        checkpoint = pending_checkpoint(self.path, self.digest, TARGET)
+        self.assertEqual((checkpoint.rows_done, checkpoint.folder), (6, "Video"))
+        self.assertIsNone(pending_checkpoint(self.path, self.digest, "other#menu________"))
+
+        inserted = chunked_import(
+            self.conn, TREE, self.root_id, self.digest, TARGET, self.path, 3, checkpoint, log=lambda _: None
+        )
+        self.assertEqual(inserted, 2)
+        self.assertEqual(self.rows(), expected)
+        self.assertFalse(os.path.exists(checkpoint_path(self.path)))
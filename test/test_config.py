@@ -0,0 +1,113 @@
+import os
+import tempfile
+import textwrap
+import unittest
+
+from utils.config import load_config
+
+CONFIG = """
+[path]
+firefox_profile = /profiles/default
+bookmarks_url = https://example.com/bookmarks.html
+cache_dir = cache
+
+[options]
+backup = journal
+chunk_rows = 500
+maintenance = yes
+report = reports/run.json
+report_format = prometheus
+
+[source:work]
+url = work.html
+
+[source:shared]
+url = file:///srv/shared.html
+
+[profile:laptop]
+path = /profiles/laptop
+sources = work, shared
+backup = online
+maintenance = false
+
+[profile:desktop]
+path = /profiles/desktop
+"""
+
+
+class TestLoadConfig(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def load(self, text: str):
+        path = os.path.join(self.directory.name, "config")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(textwrap.dedent(text))
+        return load_config(path)
+
+    def test_sources_and_profiles(self):
+        config = self.load(CONFIG)
+
+        self.assertEqual(
+            config.sources,
+            {
+                "default": "https://example.com/bookmarks.html",
+                # Plain paths are relative to the configuration file
+                "work": os.path.join(self.directory.name, "work.html"),
+                "shared": "file:///srv/shared.html",
+            },
+        )
+        profiles = {profile.name: profile for profile in config.profiles}
+        self.assertEqual(list(profiles), ["default", "laptop", "desktop"])
+        self.assertEqual(profiles["default"].sources, ["default"])
+        self.assertEqual(profiles["laptop"].sources, ["work", "shared"])
+        # Without sources a profile imports all of them
+        self.assertEqual(profiles["desktop"].sources, ["default", "work", "shared"])
+        self.assertEqual(profiles["laptop"].path, "/profiles/laptop")
+
+        self.assertEqual(config.cache_dir, os.path.join(self.directory.name, "cache"))
+        self.assertEqual(config.report, os.path.join(self.directory.name, "reports", "run.json"))
+        self.assertEqual(config.report_format, "prometheus")
+        self.assertTrue(all(profile.report for profile in config.profiles))
+
+    def test_options_fallback(self):
+        profiles = {profile.name: profile for profile in self.load(CONFIG).profiles}
+
+        # Set in the profile section
+        self.assertEqual((profiles["laptop"].backup, profiles["laptop"].maintenance), ("online", False))
+        # Taken from [options]
+        for name in ("default", "desktop"):
+            self.assertEqual((profiles[name].backup, profiles[name].maintenance), ("journal", True))
+        self.assertEqual({profile.chunk_rows for profile in profiles.values()}, {500})
+        # Not set anywhere
+        self.assertEqual({profile.root_folder for profile in profiles.values()}, {"toolbar"})
+
+    def test_defaults(self):
+        config = self.load(
+            """
+            [source:a]
+            url = https://example.com/a.html
+
+            [profile:p]
+            path = /profiles/p
+            """
+        )
+        self.assertEqual(config.cache_dir, os.path.join(self.directory.name, ".cache"))
+        self.assertEqual((config.report, config.report_format), ("", "json"))
+        profile = config.profiles[0]
+        self.assertEqual((profile.backup, profile.import_mode, profile.report), ("copy", "replace", False))
+
+    def test_unknown_source(self):
+        with self.assertRaisesRegex(ValueError, "Profile laptop refers to unknown source: home"):
+            self.load(CONFIG.replace("sources = work, shared", "sources = work, home"))
+
+    def test_invalid_values(self):
+        for old, new in [
+            ("backup = online", "backup = tape"),
+            ("maintenance = false", "maintenance = maybe"),
+            ("report_format = prometheus", "report_format = xml"),
+        ]:
+            with self.subTest(new):
+                with self.assertRaises(ValueError):
+                    self.load(CONFIG.replace(old, new))
@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from utils.connection import ConnectionTuning, TunedConnection, read_pragma
+
+
+class TestTunedConnection(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        self.conn = sqlite3.connect(self.path, factory=TunedConnection)
+        self.conn.execute("CREATE TABLE t (x)")
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.path)
+
+    def test_synchronous_relaxed_for_one_transaction(self):
+        before = read_pragma(self.conn, "synchronous")
+        self.conn.tune(ConnectionTuning(cache_size=1024, mmap_size=0, synchronous="off"))
+        self.assertEqual(read_pragma(self.conn, "cache_size"), -1024)
+        self.assertEqual(read_pragma(self.conn, "temp_store"), 2)
+
+        self.conn.relax_synchronous()
+        self.conn.execute("INSERT INTO t VALUES (1)")
+        self.assertEqual(read_pragma(self.conn, "synchronous"), 0)
+        self.conn.commit()
+        self.conn.restore_synchronous()
+        self.assertEqual(read_pragma(self.conn, "synchronous"), before)
+
+    def test_untuned_connection_is_left_alone(self):
+        before = read_pragma(self.conn, "synchronous")
+        self.conn.relax_synchronous()
+        self.assertEqual(read_pragma(self.conn, "synchronous"), before)
@@ -0,0 +1,45 @@
+import sqlite3
+import threading
+import time
+
+from bookmarks.bookmark import insert_tree
+from bookmarks.cooperative import cooperative_import
+from test.helpers import TREE, PlacesTestCase, bookmark_rows
+
+
+class TestCooperativeImport(PlacesTestCase):
+    def rows(self):
+        return bookmark_rows(self.conn)
+
+    def test_waits_for_another_writer(self):
+        insert_tree(self.conn.cursor(), TREE, self.root_id)
+        self.conn.commit()
+        expected = self.rows()
+
+        # Another connection holds the write lock for a moment, as Firefox would
+        other = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        other.execute("BEGIN IMMEDIATE")
+        release = threading.Timer(0.3, lambda: other.execute("COMMIT"))
+        release.start()
+        try:
+            stats = cooperative_import(self.conn, TREE, self.root_id, 0.1, 10, log=lambda _: None)
+        finally:
+            release.join()
+            other.close()
+
+        self.assertGreater(stats.retries, 0)
+        self.assertGreater(stats.lock_wait, 0.2)
+        self.assertEqual(len(expected), 8)
+        self.assertEqual(self.rows(), expected)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM moz_places").fetchone()[0], 4)
+
+    def test_gives_up_after_wait(self):
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            started = time.monotonic()
+            with self.assertRaisesRegex(sqlite3.OperationalError, "locked"):
+                cooperative_import(self.conn, TREE, self.root_id, 0.1, 0.3, remove=False, log=lambda _: None)
+            self.assertLess(time.monotonic() - started, 3)
+        finally:
+            other.close()
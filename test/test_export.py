@@ -0,0 +1,43 @@
+import io
+
+from bookmarks.bookmark import insert_tree
+from bookmarks.bookmark_types import Bookmark, BookmarkFolder
+from bookmarks.export import export_tree
+from bookmarks.parser import parse_html_bookmark, parse_html_bookmark_stream
+from test.helpers import PlacesTestCase
+
+TREE = [
+    BookmarkFolder(
+        name="Video",
+        items=[
+            Bookmark(name="Watch &amp; Listen", url="https://example.com/watch?v=1&amp;t=2"),
+            BookmarkFolder(name="Anime", items=[Bookmark(name="Anime ⭐", url="https://anime.example.org/")]),
+            BookmarkFolder(name="Empty", items=[]),
+        ],
+    ),
+    Bookmark(name="Top level", url="https://top.example.net/"),
+]
+
+
+class TestExport(PlacesTestCase):
+    def test_round_trip(self):
+        cursor = self.conn.cursor()
+        insert_tree(cursor, TREE, self.root_id, bulk_origins=True)
+
+        out = io.StringIO()
+        self.assertEqual(export_tree(cursor, self.root_id, out), 6)
+        html = out.getvalue()
+        self.assertEqual(parse_html_bookmark(html), TREE)
+        self.assertEqual(parse_html_bookmark_stream([html.encode("utf-8")]), TREE)
+
+    def test_markup_in_titles(self):
+        cursor = self.conn.cursor()
+        tree = [BookmarkFolder(name='"A" > <B>', items=[Bookmark(name="a < b & c", url="https://example.com/")])]
+        insert_tree(cursor, tree, self.root_id, bulk_origins=True)
+
+        out = io.StringIO()
+        export_tree(cursor, self.root_id, out)
+        html = out.getvalue()
+        self.assertIn("a &lt; b &amp; c", html)
+        self.assertEqual(parse_html_bookmark(html), tree)
+        self.assertEqual(parse_html_bookmark_stream([html.encode("utf-8")]), tree)
@@ -0,0 +1,127 @@
+import argparse
+import gzip
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import main
+from bench.fixtures import generate_html
+from test.helpers import PlacesTestCase
+from utils.config import ProfileConfig, RunConfig
+from utils.fetch import fetch_source, is_imported, load_entry, mark_imported, unmark_imported
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class SourceHandler(BaseHTTPRequestHandler):
+    """
+    Serves `server.body` gzipped with an ETag, and answers 304 to a request
+    carrying that ETag.
+    """
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        etag = '"' + hashlib.sha256(self.server.body).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = gzip.compress(self.server.body)
+        self.send_response(200)
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestFetchSource(PlacesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SourceHandler)
+        self.server.requests = []
+        self.server.body = "\n".join(generate_html(200)).encode("utf-8")
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/bookmarks.html"
+        self.cache_dir = os.path.join(self.directory.name, "cache")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_gzip_body_is_decoded(self):
+        chunks = []
+        result = fetch_source(self.url, self.cache_dir, chunks.append)
+
+        self.assertFalse(result.not_modified)
+        self.assertEqual(self.server.requests[0]["Accept-Encoding"], "gzip")
+        self.assertEqual(result.read(), self.server.body)
+        self.assertEqual(b"".join(chunks), self.server.body)
+        self.assertEqual(result.digest, hashlib.sha256(self.server.body).hexdigest())
+
+    def test_conditional_request(self):
+        first = fetch_source(self.url, self.cache_dir)
+        chunks = []
+        second = fetch_source(self.url, self.cache_dir, chunks.append)
+
+        # The validators of the cached copy are sent, and the 304 reuses its body
+        self.assertEqual(self.server.requests[1]["If-None-Match"], load_entry(self.cache_dir, self.url)["etag"])
+        self.assertEqual(self.server.requests[1]["If-Modified-Since"], LAST_MODIFIED)
+        self.assertTrue(second.not_modified)
+        self.assertEqual((second.body_path, second.digest), (first.body_path, first.digest))
+        self.assertEqual(chunks, [])
+
+        self.server.body += b"\n"
+        third = fetch_source(self.url, self.cache_dir)
+        self.assertFalse(third.not_modified)
+        self.assertNotEqual(third.digest, first.digest)
+
+    def test_imported_per_target(self):
+        result = fetch_source(self.url, self.cache_dir)
+        self.assertFalse(is_imported(self.cache_dir, result, "a"))
+        mark_imported(self.cache_dir, result, "a")
+        self.assertTrue(is_imported(self.cache_dir, result, "a"))
+        self.assertFalse(is_imported(self.cache_dir, result, "b"))
+
+        # Still imported after a 304, not once the document changed
+        self.assertTrue(is_imported(self.cache_dir, fetch_source(self.url, self.cache_dir), "a"))
+        self.server.body += b"\n"
+        self.assertFalse(is_imported(self.cache_dir, fetch_source(self.url, self.cache_dir), "a"))
+
+    def test_unmark_targets_of_database(self):
+        result = fetch_source(self.url, self.cache_dir)
+        for target in ("db#toolbar", "db#menu#scope", "db2#toolbar"):
+            mark_imported(self.cache_dir, result, target)
+
+        unmark_imported(self.cache_dir, "db")
+        self.assertFalse(is_imported(self.cache_dir, result, "db#toolbar"))
+        self.assertFalse(is_imported(self.cache_dir, result, "db#menu#scope"))
+        self.assertTrue(is_imported(self.cache_dir, result, "db2#toolbar"))
+
+    def test_up_to_date_profile_is_not_opened(self):
+        profile = ProfileConfig("test", self.directory.name, ["a"], backup="none")
+        config = RunConfig({"a": self.url}, [profile], self.cache_dir)
+        args = argparse.Namespace(
+            profile=None, resume=False, watch=None, export=None, rollback=None, force=False, yes=True
+        )
+
+        results = {}
+        main.run(args, config, results)
+        self.assertTrue(results["test"][0], results["test"][1])
+        self.assertGreater(self.conn.execute("SELECT COUNT(*) FROM moz_bookmarks").fetchone()[0], 200)
+
+        results = {}
+        with mock.patch("main.run_import") as run_import, mock.patch("bookmarks.importer.sqlite3.connect") as connect:
+            main.run(args, config, results)
+        self.assertEqual(results["test"], (True, "already up to date", {}))
+        run_import.assert_not_called()
+        connect.assert_not_called()
+        self.assertIn("If-None-Match", self.server.requests[-1])
@@ -0,0 +1,27 @@
+import sqlite3
+import unittest
+from itertools import islice
+from unittest import mock
+
+from utils.guid import generate_guids, guid_allocator, is_valid_guid
+
+
+class TestGuidAllocator(unittest.TestCase):
+    def test_batch_format(self):
+        guids = generate_guids(100)
+        self.assertEqual(len(guids), 100)
+        self.assertTrue(all(is_valid_guid(guid) for guid in guids))
+
+    def test_skips_existing_guids(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE moz_bookmarks (guid TEXT)")
+        conn.execute("CREATE TABLE moz_places (guid TEXT)")
+        conn.execute("INSERT INTO moz_bookmarks VALUES ('AAECAwQFBgcI')")
+        conn.execute("INSERT INTO moz_places VALUES ('CQoLDA0ODxAR')")
+
+        draws = [bytes(range(18)), bytes(range(18, 36))]
+        with mock.patch("utils.guid.secrets.token_bytes", side_effect=draws):
+            guids = list(islice(guid_allocator(conn.cursor(), batch_size=2), 2))
+
+        # Both GUIDs of the first batch are taken, so both come from the second
+        self.assertEqual(guids, ["EhMUFRYXGBka", "GxwdHh8gISIj"])
@@ -1,22 +1,66 @@
 import unittest
 
-from utils.hash import hash_url
+from utils.hash import (
+    PLACE_PREFIX_HI,
+    PLACE_PREFIX_LO,
+    hash_function,
+    hash_simple,
+    hash_url,
+    hash_urls,
+    hash_urls_numpy,
+    numpy,
+)
 
 class TestHashUrlFunctions(unittest.TestCase):
     def test_whatsapp_url(self):
         url = "https://web.whatsapp.com/"
-        expected = "47359004657585"
+        expected = 47359004657585
         result = hash_url(url)
         self.assertEqual(result, expected)
 
     def test_reddit_url(self):
         url = "https://www.reddit.com/"
-        expected = "47359719085711"
+        expected = 47359719085711
         result = hash_url(url)
         self.assertEqual(result, expected)
 
     def test_wikipedia_url(self):
         url = "https://en.wikipedia.org/wiki/Main_Page"
-        expected = "47359216927712"
+        expected = 47359216927712
         result = hash_url(url)
-        self.assertEqual(result, expected)
\ No newline at end of file
+        self.assertEqual(result, expected)
+
+def reference_hash_url(url):
+    prefix = url.find(':')
+    return ((hash_simple(url, prefix) & 0x0000FFFF) << 32) + hash_simple(url, len(url))
+
+
+class TestHashUrlParity(unittest.TestCase):
+    URLS = [
+        "https://web.whatsapp.com/",
+        "https://en.wikipedia.org/wiki/Main_Page",
+        "place:parent=toolbar_____",
+        "about:blank",
+        "no-scheme-at-all",
+        ":leading-colon",
+        "",
+        "https://例え.jp/パス?q=😀",
+    ]
+
+    def test_single_pass_matches_reference(self):
+        for url in self.URLS:
+            self.assertEqual(hash_url(url), reference_hash_url(url), url)
+
+    def test_hash_urls_matches_hash_url(self):
+        urls = self.URLS * 100
+        self.assertEqual(hash_urls(urls), [reference_hash_url(url) for url in urls])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_matches_reference(self):
+        urls = self.URLS + [f"https://example.com/{'x' * i}?page={i}" for i in range(300)]
+        self.assertEqual(hash_urls_numpy(urls), [reference_hash_url(url) for url in urls])
+
+    def test_place_prefix_bounds(self):
+        self.assertEqual(str(PLACE_PREFIX_LO), hash_function("place", "prefix_lo"))
+        self.assertEqual(str(PLACE_PREFIX_HI), hash_function("place", "prefix_hi"))
+        self.assertTrue(PLACE_PREFIX_LO <= hash_url("place:parent=toolbar_____") <= PLACE_PREFIX_HI)
@@ -0,0 +1,90 @@
+import itertools
+import sqlite3
+from unittest import mock
+
+from bookmarks.bookmark import insert_tree
+from bookmarks.bookmark_types import Bookmark
+from bookmarks.importer import import_profile, rollback_profile
+from test.helpers import TREE, PlacesTestCase
+from utils.config import ProfileConfig
+from utils.maintenance import MaintenanceStats, clean_places, optimize
+from utils.places import bulk_insert_places
+
+BOOKMARKED = "https://one.example.com/"
+# Only referenced by a keyword
+KEYWORD = "https://keyword.example.com/search?q=%s"
+# Unvisited, but with a visit row left behind
+VISIT_ROW = "https://visit.example.com/"
+# Nothing references it, and it is the only place of its origin
+ORPHAN = "https://orphan.example.net/"
+
+
+class TestCleanPlaces(PlacesTestCase):
+    history = 20
+
+    def setUp(self):
+        super().setUp()
+        self.conn.execute(
+            "INSERT INTO moz_keywords (keyword, place_id) VALUES ('b', ?), ('k', ?)",
+            (self.place_id(BOOKMARKED), self.place_id(KEYWORD)),
+        )
+        self.conn.execute(
+            "INSERT INTO moz_historyvisits (place_id, visit_date) VALUES (?, 0)", (self.place_id(VISIT_ROW),)
+        )
+        self.conn.execute("UPDATE moz_places SET visit_count = 0, last_visit_date = NULL WHERE url = ?", (VISIT_ROW,))
+        self.places = self.conn.execute("SELECT COUNT(*) FROM moz_places").fetchone()[0]
+        self.conn.commit()
+
+    def place_id(self, url: str) -> int:
+        return bulk_insert_places(self.conn.cursor(), [url], bulk_origins=True)[url]
+
+    def foreign_count(self, url: str) -> int:
+        return self.conn.execute("SELECT foreign_count FROM moz_places WHERE url = ?", (url,)).fetchone()[0]
+
+    def test_counts_bookmarks_and_keywords(self):
+        insert_tree(self.conn.cursor(), [Bookmark("One", BOOKMARKED), Bookmark("Again", BOOKMARKED)], self.root_id)
+        self.place_id(ORPHAN)
+        # Counts a visited place should not have
+        self.conn.execute("UPDATE moz_places SET foreign_count = 3 WHERE id = 1")
+
+        stats = clean_places(self.conn.cursor(), MaintenanceStats())
+        self.conn.commit()
+
+        self.assertEqual(self.foreign_count(BOOKMARKED), 3)
+        self.assertEqual(self.foreign_count(KEYWORD), 1)
+        self.assertEqual(self.foreign_count(VISIT_ROW), 0)
+        self.assertEqual(self.conn.execute("SELECT foreign_count FROM moz_places WHERE id = 1").fetchone()[0], 0)
+        # The bookmarked and keyword places, and the first history place
+        self.assertEqual(stats.foreign_counts, 3)
+        # Only the orphan goes, the visit row keeps its place
+        self.assertEqual((stats.places, stats.origins), (1, 1))
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM moz_places").fetchone()[0], self.places)
+        self.assertIsNone(self.conn.execute("SELECT 1 FROM moz_origins WHERE host = 'orphan.example.net'").fetchone())
+
+    def test_runs_after_import_commits(self):
+        self.place_id(ORPHAN)
+        self.conn.commit()
+        profile = ProfileConfig("test", self.directory.name, ["a"], backup="journal", maintenance=True)
+
+        with mock.patch("bookmarks.importer.clean_places", side_effect=sqlite3.OperationalError("disk I/O error")):
+            result = import_profile(profile, TREE)
+        # The import is committed even though the cleanup failed
+        self.assertTrue(result.ok, result.message)
+        self.assertEqual(self.foreign_count(ORPHAN), 0)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM moz_bookmarks WHERE id > 6").fetchone()[0], 8)
+
+        result = import_profile(profile, TREE)
+        self.assertTrue(result.ok, result.message)
+        self.assertIsNone(self.conn.execute("SELECT 1 FROM moz_places WHERE url = ?", (ORPHAN,)).fetchone())
+        self.assertEqual(self.foreign_count(KEYWORD), 1)
+
+        # The journal records the cleanup as well
+        self.assertTrue(rollback_profile(profile).ok)
+        self.assertEqual(self.foreign_count(ORPHAN), 0)
+
+    def test_analyzed_only_when_run(self):
+        self.assertTrue(optimize(self.conn, MaintenanceStats(), analyze=True, budget=60).analyzed)
+        self.assertFalse(optimize(self.conn, MaintenanceStats(), analyze=True, budget=0).analyzed)
+        # The budget is used up before the first table
+        with mock.patch("utils.maintenance.time.monotonic", side_effect=itertools.count(0, 10)):
+            self.assertFalse(optimize(self.conn, MaintenanceStats(), analyze=True, budget=1).analyzed)
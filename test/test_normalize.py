@@ -0,0 +1,50 @@
+import sqlite3
+import unittest
+
+from bookmarks.bookmark import canonicalize_tree
+from bookmarks.bookmark_types import Bookmark, BookmarkFolder, CompactTree
+from utils.normalize import UrlNormalization
+
+ALL_RULES = UrlNormalization(("host", "trailing_slash", "params", "fragment"))
+
+
+class TestUrlNormalization(unittest.TestCase):
+    def test_rules(self):
+        self.assertEqual(
+            ALL_RULES.normalize("HTTPS://Example.COM:443/a/b/?utm_source=x&q=1#top"), "https://example.com/a/b?q=1"
+        )
+        self.assertEqual(ALL_RULES.normalize("http://Example.com:8080"), "http://example.com:8080/")
+        self.assertEqual(ALL_RULES.normalize("place:sort=8"), "place:sort=8")
+        self.assertEqual(UrlNormalization(("host",)).normalize("https://EX.com/A/"), "https://ex.com/A/")
+
+    def test_params_keep_other_parameters_verbatim(self):
+        params = UrlNormalization(("params",))
+        self.assertEqual(params.normalize("https://example.com/?flag&utm_source=y"), "https://example.com/?flag")
+        self.assertEqual(params.normalize("https://example.com/?q=a/b&utm_medium=z"), "https://example.com/?q=a/b")
+        self.assertEqual(params.normalize("https://example.com/?p=%7E&utm_id=1"), "https://example.com/?p=%7E")
+        self.assertEqual(params.normalize("https://example.com/?utm_source=x"), "https://example.com/")
+        self.assertEqual(params.normalize("https://example.com/?a=1&&b=2"), "https://example.com/?a=1&&b=2")
+
+    def test_collapses_onto_existing_place(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE moz_places (url TEXT, rev_host TEXT, frecency INTEGER)")
+        conn.execute("INSERT INTO moz_places VALUES ('https://example.com/page', 'moc.elpmaxe.', 100)")
+
+        tree = [
+            Bookmark("one", "https://Example.com/page/"),
+            BookmarkFolder("Folder", [Bookmark("two", "https://example.com/page?utm_medium=x")]),
+            Bookmark("three", "https://other.example.org/x/"),
+            Bookmark("four", "https://other.example.org/x"),
+        ]
+        result, stats = canonicalize_tree(conn.cursor(), CompactTree.from_tree(tree), ALL_RULES)
+
+        self.assertEqual(
+            list(result.urls()),
+            [
+                "https://example.com/page",
+                "https://example.com/page",
+                "https://other.example.org/x",
+                "https://other.example.org/x",
+            ],
+        )
+        self.assertEqual((stats.urls, stats.collapsed, stats.matched, stats.rows_saved), (4, 2, 1, 3))
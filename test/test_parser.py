@@ -0,0 +1,158 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from bookmarks.bookmark_types import Bookmark, BookmarkFolder, CompactTree
+from bookmarks.parser import (
+    parse_file,
+    parse_file_parallel,
+    parse_html_bookmark,
+    parse_html_bookmark_stream,
+    parse_mapped_file,
+    top_level_ranges,
+)
+from utils.scope import Scope, removable_ids
+
+SAMPLE = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks</H1>
+<DL><p>
+    <DT><H3>Video</H3>
+    <DL><p>
+        <DT><A HREF="https://example.com/watch?v=1&amp;t=2">Watch &amp; Listen</A>
+        <DT><H3>Anime</H3>
+        <DL><p>
+            <DT><A HREF="https://anime.example.org/">Anime ⭐</A>
+        </DL><p>
+        <DT><A HREF="https://example.com/">Example</A>
+    </DL><p>
+    <DT><A HREF="https://top.example.net/">Top level</A>
+</DL><p>
+"""
+
+
+class TestStreamingParser(unittest.TestCase):
+    def test_matches_line_parser(self):
+        expected = parse_html_bookmark(SAMPLE)
+        result = parse_html_bookmark_stream([SAMPLE.encode("utf-8")])
+        self.assertEqual(result, expected)
+
+    def test_single_byte_chunks(self):
+        data = SAMPLE.encode("utf-8")
+        result = parse_html_bookmark_stream(data[i : i + 1] for i in range(len(data)))
+        self.assertEqual(result, parse_html_bookmark(SAMPLE))
+
+    def test_tags_split_across_lines(self):
+        html = '<DL><p>\n<DT><H3>\nFolder</H3>\n<DL><p><DT><A\nHREF="https://example.com/">Ex\nample</A>\n</DL>\n</DL>'
+        result = parse_html_bookmark_stream([html.encode("utf-8")])
+        self.assertEqual(
+            result, [BookmarkFolder(name="Folder", items=[Bookmark(name="Ex\nample", url="https://example.com/")])]
+        )
+
+    def test_tokens_split_across_chunks(self):
+        # Quoted "<" and ">", "<" in titles, a comment hiding an item and an unclosed anchor
+        html = (
+            '<DL><p><DT><H3 ADD_DATE="1">Fold &amp;</H3><DL><p>'
+            "<DT><A HREF=\"https://a.example/?x=<b>\" TITLE='q>r'>a < b <3 ⭐</A>\n"
+            '<!-- <DT><A HREF="https://hidden.example/">Hidden</A> -->\n'
+            '<DT><A HREF="https://c.example/">Unclosed\n<DT><a href="https://d.example/">D</a>\n</DL><p>'
+            '<DT><A HREF="https://e.example/">E</A></DL><DT><A HREF="https://after.example/">After</A>'
+        ).encode("utf-8")
+        expected = [
+            BookmarkFolder(
+                name="Fold &",
+                items=[
+                    Bookmark(name="a < b <3 ⭐", url="https://a.example/?x=<b>"),
+                    Bookmark(name="Unnamed Bookmark", url="https://c.example/"),
+                    Bookmark(name="D", url="https://d.example/"),
+                ],
+            ),
+            Bookmark(name="E", url="https://e.example/"),
+        ]
+        for size in (1, 2, 3, 5, 8, 13, len(html)):
+            with self.subTest(size=size):
+                chunks = (html[i : i + size] for i in range(0, len(html), size))
+                self.assertEqual(parse_html_bookmark_stream(chunks), expected)
+
+    def test_compact_tree(self):
+        expected = parse_html_bookmark(SAMPLE)
+        data = SAMPLE.encode("utf-8")
+        result = parse_html_bookmark_stream((data[i : i + 7] for i in range(0, len(data), 7)), compact=True)
+        self.assertEqual(result, CompactTree.from_tree(expected))
+        self.assertEqual(result.to_tree(), expected)
+        self.assertEqual(list(result.parents), [-1, 0, 0, 2, 0, -1])
+        self.assertEqual(result.url(3), "https://anime.example.org/")
+
+
+class TestParallelParser(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".html")
+        with os.fdopen(fd, "wb") as f:
+            f.write(SAMPLE.encode("utf-8"))
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_splits_before_top_level_folders(self):
+        data = SAMPLE.encode("utf-8")
+        ranges = top_level_ranges(data)
+        self.assertEqual(len(ranges), 2)
+        self.assertTrue(data[ranges[1][0] :].startswith(b"<DT><H3>Video</H3>"))
+
+    def test_matches_sequential_parser(self):
+        for compact in (False, True):
+            expected = parse_html_bookmark_stream([SAMPLE.encode("utf-8")], compact)
+            self.assertEqual(parse_file_parallel(self.path, workers=2, compact=compact), expected)
+
+    def test_single_worker_skips_pre_scan(self):
+        expected = parse_html_bookmark_stream([SAMPLE.encode("utf-8")])
+        with mock.patch("bookmarks.parser.top_level_ranges") as ranges:
+            self.assertEqual(parse_file_parallel(self.path, workers=1), expected)
+            self.assertEqual(parse_file(self.path), expected)
+        ranges.assert_not_called()
+
+    def test_mapped_file_matches_stream(self):
+        for compact in (False, True):
+            expected = parse_html_bookmark_stream([SAMPLE.encode("utf-8")], compact)
+            self.assertEqual(parse_mapped_file(self.path, compact=compact), expected)
+
+
+class TestScopedParser(unittest.TestCase):
+    def test_include_keeps_containers(self):
+        scope = Scope(include=("*/Anime",))
+        expected = [
+            BookmarkFolder(
+                name="Video",
+                items=[BookmarkFolder(name="Anime", items=[Bookmark(name="Anime ⭐", url="https://anime.example.org/")])],
+            )
+        ]
+        self.assertEqual(parse_html_bookmark_stream([SAMPLE.encode("utf-8")], scope=scope), expected)
+        compact = parse_html_bookmark_stream([SAMPLE.encode("utf-8")], compact=True, scope=scope)
+        self.assertEqual(compact.to_tree(), expected)
+
+    def test_exclude_hosts_and_depth(self):
+        scope = Scope(exclude=("Video/Anime",), deny_hosts=("top.example.net",), max_depth=2)
+        self.assertEqual(
+            parse_html_bookmark_stream([SAMPLE.encode("utf-8")], scope=scope),
+            [
+                BookmarkFolder(
+                    name="Video",
+                    items=[
+                        Bookmark(name="Watch & Listen", url="https://example.com/watch?v=1&amp;t=2"),
+                        Bookmark(name="Example", url="https://example.com/"),
+                    ],
+                )
+            ],
+        )
+
+    def test_removable_ids_keep_folders_of_other_items(self):
+        scope = Scope(include=("Video/Anime",))
+        items = [
+            (1, 0, ("Video",), True, None),
+            (2, 1, ("Video", "Watch"), False, "https://example.com/"),
+            (3, 1, ("Video", "Anime"), True, None),
+            (4, 3, ("Video", "Anime", "Anime"), False, "https://anime.example.org/"),
+        ]
+        self.assertEqual(removable_ids(scope, items), [3, 4])
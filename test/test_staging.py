@@ -0,0 +1,81 @@
+from bench.fixtures import ROOTS
+from bookmarks.bookmark import insert_tree, remove_tree_if_exists
+from bookmarks.bookmark_types import Bookmark, BookmarkFolder
+from bookmarks.staging import staged_import
+from test.helpers import TREE, PlacesTestCase
+from utils.triggers import CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER, CREATE_PLACES_AFTERINSERT_TRIGGER
+
+NOW = 1_700_000_000_000_000
+
+# Replaces the Video folder of TREE, keeps Reading and adds a place: query
+NEXT_TREE = [
+    BookmarkFolder(
+        name="Video",
+        items=[
+            Bookmark(name="Three", url="https://one.example.com/"),
+            Bookmark(name="Six", url="https://six.example.com:8080/"),
+            Bookmark(name="Recent", url="place:sort=8&maxResults=10"),
+        ],
+    ),
+    Bookmark(name="Five", url="https://five.example.com/"),
+]
+
+
+def table_state(conn):
+    """
+    Every row of the tables the import writes, without the random GUIDs and the
+    roots created with the database.
+    """
+    return {
+        "bookmarks": conn.execute(
+            "SELECT id, type, fk, parent, position, title, dateAdded, lastModified, syncStatus, syncChangeCounter "
+            "FROM moz_bookmarks WHERE id > ? ORDER BY id",
+            (len(ROOTS),),
+        ).fetchall(),
+        "places": conn.execute(
+            "SELECT id, url, url_hash, rev_host, hidden, frecency, foreign_count, origin_id, recalc_frecency, "
+            "recalc_alt_frecency FROM moz_places ORDER BY id"
+        ).fetchall(),
+        "origins": conn.execute("SELECT * FROM moz_origins ORDER BY id").fetchall(),
+    }
+
+
+class TestStagedImport(PlacesTestCase):
+    history = 100
+
+    def import_with_triggers(self, conn, tree):
+        cursor = conn.cursor()
+        remove_tree_if_exists(cursor, tree, self.root_id)
+        insert_tree(cursor, tree, self.root_id, NOW)
+        conn.commit()
+
+    def test_merge_matches_trigger_path(self):
+        triggered = self.open_db("triggered.sqlite", self.history)
+        triggered.execute(CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER)
+        triggered.execute(CREATE_PLACES_AFTERINSERT_TRIGGER)
+        history_url = triggered.execute("SELECT url FROM moz_places ORDER BY id LIMIT 1").fetchone()[0]
+        unrelated = [Bookmark(name="Kept", url=history_url)]
+
+        # An unrelated bookmark before the import, then the import and its replacement
+        for tree in (unrelated, TREE, NEXT_TREE):
+            self.import_with_triggers(triggered, tree)
+
+        self.conn.execute(CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER)
+        self.conn.execute(CREATE_PLACES_AFTERINSERT_TRIGGER)
+        self.import_with_triggers(self.conn, unrelated)
+        # The staged merge applies the trigger effects itself
+        self.conn.execute("DROP TRIGGER temp.moz_bookmarks_foreign_count_afterinsert_trigger")
+        self.conn.execute("DROP TRIGGER temp.moz_places_afterinsert_trigger")
+        for tree in (TREE, NEXT_TREE):
+            staged_import(self.conn, tree, self.root_id, True, NOW)
+
+        self.assertEqual(table_state(self.conn), table_state(triggered))
+
+    def test_leaves_transaction_of_caller_open(self):
+        self.conn.execute("UPDATE moz_bookmarks SET title = 'Toolbar' WHERE id = ?", (self.root_id,))
+        staged_import(self.conn, TREE, self.root_id, True, NOW)
+        self.assertTrue(self.conn.in_transaction)
+
+        self.conn.rollback()
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM moz_bookmarks").fetchone()[0], 6)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM moz_places").fetchone()[0], 100)
@@ -0,0 +1,133 @@
+from bookmarks.bookmark import SYNC_STATUS_NEW, SYNC_STATUS_NORMAL, insert_tree
+from bookmarks.bookmark_types import Bookmark, BookmarkFolder
+from bookmarks.sync import sync_tree
+from test.helpers import TREE, PlacesTestCase, bookmark_rows
+from utils.triggers import CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER, CREATE_PLACES_AFTERINSERT_TRIGGER
+
+# TREE with Three retitled, Two moved out of the removed Anime folder, the URL
+# of Four changed and Six added. Five is not a folder of the import and is kept.
+NEXT_TREE = [
+    BookmarkFolder(
+        name="Video",
+        items=[
+            Bookmark(name="One", url="https://one.example.com/"),
+            Bookmark(name="Third", url="https://one.example.com/"),
+        ],
+    ),
+    BookmarkFolder(
+        name="Reading",
+        items=[
+            Bookmark(name="Four", url="https://four.example.org/"),
+            Bookmark(name="Two", url="https://two.example.com/"),
+            Bookmark(name="Six", url="https://six.example.com/"),
+        ],
+    ),
+]
+
+
+def totals(stats):
+    return stats.inserted, stats.deleted, stats.moved, stats.shifted, stats.retitled, stats.unchanged
+
+
+class TestSync(PlacesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conn.execute(CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER)
+        self.conn.execute(CREATE_PLACES_AFTERINSERT_TRIGGER)
+
+    def bookmarks(self):
+        return {
+            title: (guid, counter)
+            for title, guid, counter in self.conn.execute(
+                "SELECT title, guid, syncChangeCounter FROM moz_bookmarks WHERE parent != 1 AND id != ?",
+                (self.root_id,),
+            )
+        }
+
+    def foreign_count(self, url: str) -> int:
+        return self.conn.execute("SELECT foreign_count FROM moz_places WHERE url = ?", (url,)).fetchone()[0]
+
+    def test_first_sync_inserts_tree(self):
+        stats = sync_tree(self.conn.cursor(), TREE, self.root_id)
+        self.assertEqual(totals(stats), (8, 0, 0, 0, 0, 0))
+
+        expected = self.open_db("expected.sqlite")
+        expected.execute(CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER)
+        insert_tree(expected.cursor(), TREE, self.root_id)
+        self.assertEqual(bookmark_rows(self.conn), bookmark_rows(expected))
+        self.assertEqual(self.foreign_count("https://one.example.com/"), 2)
+
+    def test_sync_changes(self):
+        insert_tree(self.conn.cursor(), TREE, self.root_id)
+        # Everything but Four was uploaded by Sync
+        self.conn.execute("UPDATE moz_bookmarks SET syncStatus = ? WHERE id > 6", (SYNC_STATUS_NORMAL,))
+        self.conn.execute("UPDATE moz_bookmarks SET syncStatus = ? WHERE title = 'Four'", (SYNC_STATUS_NEW,))
+        before = self.bookmarks()
+
+        stats = sync_tree(self.conn.cursor(), NEXT_TREE, self.root_id)
+        # Two moved to another folder, Third shifted up a position when Anime was removed and retitled
+        self.assertEqual(totals(stats), (2, 2, 1, 1, 1, 3))
+        self.assertEqual(
+            bookmark_rows(self.conn),
+            [
+                ("toolbar", 0, "Video", None),
+                ("Video", 0, "One", "https://one.example.com/"),
+                ("Reading", 1, "Two", "https://two.example.com/"),
+                ("Video", 1, "Third", "https://one.example.com/"),
+                ("toolbar", 1, "Reading", None),
+                ("toolbar", 2, "Five", "https://five.example.com/"),
+                ("Reading", 0, "Four", "https://four.example.org/"),
+                ("Reading", 2, "Six", "https://six.example.com/"),
+            ],
+        )
+
+        after = self.bookmarks()
+        # Matched items keep their GUIDs, and only changed ones are sent to Sync again
+        for title in ("One", "Five"):
+            self.assertEqual(after[title], before[title])
+        # The folders whose children changed are sent once
+        for title in ("Video", "Reading"):
+            self.assertEqual(after[title], (before[title][0], before[title][1] + 1))
+        self.assertEqual(after["Third"], (before["Three"][0], before["Three"][1] + 1))
+        self.assertEqual(after["Two"], (before["Two"][0], before["Two"][1] + 1))
+        self.assertNotEqual(after["Four"][0], before["Four"][0])
+
+        tombstones = {guid for guid, in self.conn.execute("SELECT guid FROM moz_bookmarks_deleted")}
+        # Four was never uploaded, so it leaves no tombstone
+        self.assertEqual(tombstones, {before["Anime"][0]})
+
+        self.assertEqual(self.foreign_count("https://one.example.com/"), 2)
+        self.assertEqual(self.foreign_count("https://four.example.com/"), 0)
+        self.assertEqual(self.foreign_count("https://four.example.org/"), 1)
+        self.assertEqual(self.foreign_count("https://five.example.com/"), 1)
+
+    def test_unchanged_tree_writes_nothing(self):
+        insert_tree(self.conn.cursor(), TREE, self.root_id)
+        before = self.bookmarks()
+        stats = sync_tree(self.conn.cursor(), TREE, self.root_id)
+        self.assertEqual(totals(stats), (0, 0, 0, 0, 0, 8))
+        self.assertEqual(self.bookmarks(), before)
+
+    def test_prepend_shifts_siblings_only(self):
+        links = [Bookmark(name=f"Link {index}", url=f"https://site{index}.example.com/") for index in range(1000)]
+        insert_tree(self.conn.cursor(), [BookmarkFolder(name="Links", items=links)], self.root_id)
+        before = self.bookmarks()
+
+        first = Bookmark(name="First", url="https://first.example.com/")
+        stats = sync_tree(self.conn.cursor(), [BookmarkFolder(name="Links", items=[first] + links)], self.root_id)
+
+        self.assertEqual(totals(stats), (1, 0, 0, 1000, 0, 1))
+        after = self.bookmarks()
+        # Only the folder is sent to Sync again, its links just change position
+        self.assertEqual(after["Links"], (before["Links"][0], before["Links"][1] + 1))
+        for index in range(1000):
+            self.assertEqual(after[f"Link {index}"], before[f"Link {index}"])
+        self.assertEqual(
+            self.conn.execute(
+                "SELECT title, position FROM moz_bookmarks WHERE title IN ('First', 'Link 0', 'Link 999')"
+                " ORDER BY position"
+            ).fetchall(),
+            [("First", 0), ("Link 0", 1), ("Link 999", 1000)],
+        )
+        bumped = self.conn.execute("SELECT COUNT(*) FROM moz_bookmarks WHERE syncChangeCounter > 1").fetchone()[0]
+        self.assertEqual(bumped, 1)
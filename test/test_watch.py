@@ -0,0 +1,98 @@
+import os
+import unittest
+from unittest import mock
+
+from bench.fixtures import write_html
+from bookmarks.bookmark_types import Bookmark, BookmarkFolder, CompactTree
+from bookmarks.importer import import_profile
+from bookmarks.watch import LOCK_BACKOFF, tree_changes, watch
+from test.helpers import TREE, PlacesTestCase
+from utils.config import ProfileConfig, RunConfig
+
+
+class StopWatch(Exception):
+    pass
+
+
+class TestTreeChanges(unittest.TestCase):
+    def test_first_import_adds_everything(self):
+        self.assertEqual(tree_changes(None, CompactTree.from_tree(TREE)), (8, 0))
+
+    def test_compares_items_by_path(self):
+        tree = CompactTree.from_tree(
+            [
+                # Anime moved to the top level, Four retitled and a second copy of Five
+                BookmarkFolder(name="Video", items=[Bookmark(name="One", url="https://one.example.com/")]),
+                BookmarkFolder(name="Anime", items=[Bookmark(name="Two", url="https://two.example.com/")]),
+                BookmarkFolder(name="Reading", items=[Bookmark(name="4", url="https://four.example.com/")]),
+                Bookmark(name="Five", url="https://five.example.com/"),
+                Bookmark(name="Five", url="https://five.example.com/"),
+            ]
+        )
+        # Anime, Two, 4 and Five against Anime, Two, Three and Four
+        self.assertEqual(tree_changes(CompactTree.from_tree(TREE), tree), (4, 4))
+        self.assertEqual(tree_changes(tree, tree), (0, 0))
+
+
+class TestWatch(PlacesTestCase):
+    def setUp(self):
+        super().setUp()
+        source = os.path.join(self.directory.name, "bookmarks.html")
+        write_html(source, 20)
+        self.profile = ProfileConfig("test", self.directory.name, ["a"], backup="none")
+        self.config = RunConfig({"a": source}, [self.profile], self.directory.name)
+        self.delays = []
+
+    def lock(self, locked: bool):
+        if locked:
+            open(self.profile.lock_path, "w").close()
+        elif os.path.exists(self.profile.lock_path):
+            os.remove(self.profile.lock_path)
+
+    def run_watch(self, locked, interval=3600.0, force=False):
+        """
+        Poll once per entry of `locked`, with the profile locked by Firefox when
+        the entry is true. Returns the number of imports.
+        """
+
+        def sleep(delay):
+            self.delays.append(delay)
+            if len(self.delays) == len(locked):
+                raise StopWatch()
+            self.lock(locked[len(self.delays)])
+
+        self.delays = []
+        self.lock(locked[0])
+        with mock.patch("bookmarks.watch.time.sleep", side_effect=sleep), mock.patch(
+            "bookmarks.watch.import_profile", wraps=import_profile
+        ) as imported:
+            with self.assertRaises(StopWatch):
+                watch(self.config, [self.profile], interval, force)
+        return imported.call_count
+
+    def bookmark_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM moz_bookmarks").fetchone()[0]
+
+    def test_imports_once(self):
+        self.assertEqual(self.run_watch([False, False]), 1)
+        self.assertGreater(self.bookmark_count(), 6)
+        self.assertEqual(self.delays, [3600.0, 3600.0])
+
+    def test_lock_backoff(self):
+        self.assertEqual(self.run_watch([True, True, True, True, False, False], interval=30.0), 1)
+        # Doubled up to the interval while Firefox runs, back to the interval once imported
+        self.assertEqual(self.delays, [LOCK_BACKOFF, 2 * LOCK_BACKOFF, 4 * LOCK_BACKOFF, 30.0, 30.0, 30.0])
+
+    def test_force_waits_for_lock(self):
+        self.assertEqual(self.run_watch([False]), 1)
+        before = self.bookmark_count()
+        self.conn.execute("DELETE FROM moz_bookmarks WHERE id > 6")
+        self.conn.commit()
+
+        # The forced import is kept until Firefox exits, then runs once
+        self.assertEqual(self.run_watch([True, False, False], force=True), 1)
+        self.assertEqual(self.bookmark_count(), before)
+
+    def test_cooperative_ignores_lock(self):
+        self.profile.cooperative = True
+        self.assertEqual(self.run_watch([True]), 1)
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import glob
+import json
+import os
+import sqlite3
+import time
+from shutil import copy2
+from sqlite3 import Connection
+from typing import Callable, Dict, List, Optional
+
+BACKUP_STRATEGIES = ["copy", "online", "journal", "none"]
+
+# Tables an import writes to, including the tombstones left by deletions
+JOURNALED_TABLES = ["moz_bookmarks", "moz_places", "moz_origins", "moz_bookmarks_deleted"]
+
+JOURNAL_SUFFIX = ".undo.json"
+
+# Percent of the pages copied between two progress lines of an online backup
+BACKUP_PROGRESS_STEP = 10
+
+
+def rotate(path: str, count: int):
+    """
+    Shift `path` to `path.1`, `path.1` to `path.2` and so on, keeping at most
+    `count` files including the one about to be written at `path`.
+    """
+    if count < 1:
+        count = 1
+
+    for index in range(count - 1, 0, -1):
+        source = path if index == 1 else f"{path}.{index - 1}"
+        if os.path.exists(source):
+            os.replace(source, f"{path}.{index}")
+
+    stale = f"{path}.{count}"
+    if os.path.exists(stale):
+        os.remove(stale)
+
+
+def copy_backup(db_path: str, count: int = 1) -> str:
+    backup_path = db_path + ".auto.bak"
+    rotate(backup_path, count)
+    copy2(db_path, backup_path)
+    return backup_path
+
+
+def online_backup(
+    db_path: str, count: int = 1, pages: int = 1024, sleep: float = 0.0, log: Callable[[str], None] = print
+) -> str:
+    """
+    Page level copy through the SQLite backup API. Unlike a file copy it
+    includes committed pages still in the -wal file, and `pages`/`sleep` pace it
+    so other connections can keep writing. Progress is passed to `log` in whole
+    lines, as profiles imported side by side share the terminal.
+    """
+    backup_path = db_path + ".auto.bak"
+    rotate(backup_path, count)
+    reported = [0]
+
+    def progress(status, remaining, total):
+        percent = 100 * (total - remaining) // total if total else 100
+        if percent >= reported[0] + BACKUP_PROGRESS_STEP and percent < 100:
+            reported[0] = percent - percent % BACKUP_PROGRESS_STEP
+            log(f"Backing up database... {percent}%")
+
+    source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    target = sqlite3.connect(backup_path)
+    try:
+        source.backup(target, pages=pages, progress=progress, sleep=sleep)
+    finally:
+        target.close()
+        source.close()
+
+    return backup_path
+
+
+class UndoJournal(object):
+    """
+    Records the rowids an import inserts and the original image of every row it
+    updates or deletes, using temp triggers on the journaled tables. `save`
+    writes them to a JSON file that `rollback` replays.
+    """
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.columns: Dict[str, List[str]] = {}
+
+    def install(self):
+        # Tables of a previous import on a reused connection are dropped rather than
+        # emptied, and no script is run, so no transaction is committed or left open
+        self.conn.execute("DROP TABLE IF EXISTS temp.undo_inserted")
+        self.conn.execute("CREATE TEMP TABLE undo_inserted (tbl TEXT, rid INTEGER, PRIMARY KEY (tbl, rid))")
+        for table in JOURNALED_TABLES:
+            columns = [row[1] for row in self.conn.execute(f"PRAGMA main.table_info({table})")]
+            if not columns:
+                continue
+            self.columns[table] = columns
+
+            column_list = ", ".join(columns)
+            old_values = ", ".join(f"OLD.{column}" for column in columns)
+            self.conn.execute(f"DROP TABLE IF EXISTS temp.undo_{table}")
+            self.conn.execute(f"CREATE TEMP TABLE undo_{table} (rid INTEGER PRIMARY KEY, {column_list})")
+            self.conn.execute(
+                f"""
+                CREATE TEMP TRIGGER IF NOT EXISTS undo_{table}_afterinsert_trigger
+                AFTER INSERT ON main.{table} FOR EACH ROW
+                BEGIN
+                    INSERT OR IGNORE INTO undo_inserted (tbl, rid) VALUES ('{table}', NEW.rowid);
+                END
+                """
+            )
+            for event in ["UPDATE", "DELETE"]:
+                self.conn.execute(
+                    f"""
+                    CREATE TEMP TRIGGER IF NOT EXISTS undo_{table}_after{event.lower()}_trigger
+                    AFTER {event} ON main.{table} FOR EACH ROW
+                    WHEN NOT EXISTS (SELECT 1 FROM undo_inserted WHERE tbl = '{table}' AND rid = OLD.rowid)
+                    BEGIN
+                        INSERT OR IGNORE INTO undo_{table} (rid, {column_list}) VALUES (OLD.rowid, {old_values});
+                    END
+                    """
+                )
+
+    def save(self, db_path: str, count: int = 1) -> Optional[str]:
+        """
+        Write the journal next to the database and keep the newest `count`
+        journals. Returns None when the import changed nothing.
+        """
+        tables = {}
+        for table, columns in self.columns.items():
+            inserted = [
+                row[0] for row in self.conn.execute("SELECT rid FROM temp.undo_inserted WHERE tbl = ?", (table,))
+            ]
+            old_rows = [list(row) for row in self.conn.execute(f"SELECT * FROM temp.undo_{table}")]
+            if inserted or old_rows:
+                tables[table] = {"columns": columns, "inserted": inserted, "old_rows": old_rows}
+
+        if not tables:
+            return None
+
+        journals = sorted(glob.glob(glob.escape(db_path) + ".*" + JOURNAL_SUFFIX))
+        for stale in journals[: max(len(journals) - count + 1, 0)]:
+            os.remove(stale)
+
+        now = time.time()
+        path = f"{db_path}.{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}{JOURNAL_SUFFIX}"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"database": os.path.abspath(db_path), "created": int(time.time()), "tables": tables}, f)
+
+        return path
+
+
+def latest_journal(db_path: str) -> Optional[str]:
+    journals = sorted(glob.glob(glob.escape(db_path) + ".*" + JOURNAL_SUFFIX))
+    return journals[-1] if journals else None
+
+
+def rollback(conn: Connection, journal_path: str) -> int:
+    """
+    Undo an import recorded by `UndoJournal`: delete the rows it inserted and
+    restore the rows it updated or deleted, in one transaction. Returns the
+    number of rows touched.
+    """
+    with open(journal_path, "r", encoding="utf-8") as f:
+        journal = json.load(f)
+
+    touched = 0
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for table, entry in journal["tables"].items():
+            conn.executemany(f"DELETE FROM {table} WHERE rowid = ?", ((rid,) for rid in entry["inserted"]))
+            column_list = ", ".join(["rowid"] + entry["columns"])
+            values = ", ".join(["?"] * (len(entry["columns"]) + 1))
+            conn.executemany(f"INSERT OR REPLACE INTO {table} ({column_list}) VALUES ({values})", entry["old_rows"])
+            touched += len(entry["inserted"]) + len(entry["old_rows"])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+    return touched
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import configparser
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from utils.backup import BACKUP_STRATEGIES
+from utils.connection import SYNCHRONOUS_LEVELS, ConnectionTuning
+from utils.fetch import local_path
+from utils.metrics import REPORT_FORMATS
+from utils.normalize import UrlNormalization, read_normalization
+from utils.scope import Scope, read_scope
+
+IMPORT_MODES = ["replace", "sync"]
+
+SOURCE_PREFIX = "source:"
+PROFILE_PREFIX = "profile:"
+
+# Name used for the single source and profile of a [path] section
+DEFAULT_NAME = "default"
+
+
+@dataclass
+class ProfileConfig:
+    name: str
+    path: str
+    sources: List[str]
+    root_folder: str = "toolbar"
+    remove_if_duplicate: bool = True
+    import_mode: str = "replace"
+    bulk_origins: bool = False
+    staged: bool = False
+    backup: str = "copy"
+    backup_count: int = 1
+    backup_pages: int = 1024
+    backup_sleep: float = 0.0
+    profile_sql: bool = False
+    maintenance: bool = False
+    analyze: bool = False
+    maintenance_budget: float = 0.0
+    scope: Optional[Scope] = None
+    fast_connection: bool = False
+    cache_size: int = ConnectionTuning.cache_size
+    mmap_size: int = ConnectionTuning.mmap_size
+    import_synchronous: str = ConnectionTuning.synchronous
+    normalize: Optional[UrlNormalization] = None
+    chunk_rows: int = 0
+    cooperative: bool = False
+    lock_hold: float = 0.1
+    lock_wait: float = 60.0
+    # Set by --resume
+    resume: bool = False
+    # Set when the run writes a report
+    report: bool = False
+
+    @property
+    def db_path(self) -> str:
+        return os.path.join(self.path, "places.sqlite")
+
+    @property
+    def measured(self) -> bool:
+        # The SQL trace, counted functions and row triggers slow an import down by a fifth to a third
+        return self.report or self.profile_sql
+
+    @property
+    def lock_path(self) -> str:
+        # Present while Firefox has the profile open
+        return os.path.join(self.path, "parent.lock")
+
+    def connection_tuning(self) -> Optional[ConnectionTuning]:
+        if not self.fast_connection:
+            return None
+        return ConnectionTuning(self.cache_size, self.mmap_size, self.import_synchronous)
+
+
+@dataclass
+class RunConfig:
+    sources: Dict[str, str]
+    profiles: List[ProfileConfig]
+    cache_dir: str
+    report: str = ""
+    report_format: str = "json"
+    parallel_parse_threshold: int = 32 * 1024 * 1024
+    poll_interval: float = 3600.0
+    scope: Optional[Scope] = None
+
+
+def get_option(config: configparser.ConfigParser, section: str, key: str, fallback: str) -> str:
+    """
+    Read `key` from a profile section, falling back to [options] and then to
+    `fallback`.
+    """
+    if config.has_option(section, key):
+        return config.get(section, key)
+    return config.get("options", key, fallback=fallback)
+
+
+def get_boolean(config: configparser.ConfigParser, section: str, key: str, fallback: bool) -> bool:
+    value = get_option(config, section, key, str(fallback)).strip().lower()
+    if value not in configparser.ConfigParser.BOOLEAN_STATES:
+        raise ValueError(f"Not a boolean for {key} in [{section}]: {value}")
+    return configparser.ConfigParser.BOOLEAN_STATES[value]
+
+
+def read_profile(config: configparser.ConfigParser, section: str, name: str, path: str, sources: List[str]):
+    profile = ProfileConfig(
+        name=name,
+        path=path,
+        sources=sources,
+        root_folder=get_option(config, section, "root_folder", "toolbar"),
+        remove_if_duplicate=get_boolean(config, section, "remove_if_duplicate", True),
+        import_mode=get_option(config, section, "import_mode", "replace").lower(),
+        bulk_origins=get_boolean(config, section, "bulk_origins", False),
+        staged=get_boolean(config, section, "staged", False),
+        backup=get_option(config, section, "backup", "copy").lower(),
+        backup_count=int(get_option(config, section, "backup_count", "1")),
+        backup_pages=int(get_option(config, section, "backup_pages", "1024")),
+        backup_sleep=float(get_option(config, section, "backup_sleep", "0")),
+        profile_sql=get_boolean(config, section, "profile_sql", False),
+        maintenance=get_boolean(config, section, "maintenance", False),
+        analyze=get_boolean(config, section, "analyze", False),
+        maintenance_budget=float(get_option(config, section, "maintenance_budget", "0")),
+        fast_connection=get_boolean(config, section, "fast_connection", False),
+        cache_size=int(get_option(config, section, "cache_size", str(ProfileConfig.cache_size))),
+        mmap_size=int(get_option(config, section, "mmap_size", str(ProfileConfig.mmap_size))),
+        import_synchronous=get_option(config, section, "import_synchronous", ProfileConfig.import_synchronous).lower(),
+        chunk_rows=int(get_option(config, section, "chunk_rows", "0")),
+        cooperative=get_boolean(config, section, "cooperative", False),
+        lock_hold=float(get_option(config, section, "lock_hold", str(ProfileConfig.lock_hold))),
+        lock_wait=float(get_option(config, section, "lock_wait", str(ProfileConfig.lock_wait))),
+        normalize=read_normalization(
+            get_option(config, section, "normalize_urls", ""),
+            get_option(config, section, "strip_params", ",".join(UrlNormalization.strip_params)),
+        ),
+    )
+
+    if profile.import_mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import_mode: {profile.import_mode}. Expected one of: {', '.join(IMPORT_MODES)}")
+    if profile.backup not in BACKUP_STRATEGIES:
+        raise ValueError(f"Unknown backup: {profile.backup}. Expected one of: {', '.join(BACKUP_STRATEGIES)}")
+    if profile.import_synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError(
+            f"Unknown import_synchronous: {profile.import_synchronous}. Expected one of: {', '.join(SYNCHRONOUS_LEVELS)}"
+        )
+
+    return profile
+
+
+def load_config(path: str) -> RunConfig:
+    """
+    Read the sources, profiles, cache directory and run report settings from the
+    configuration file.
+
+    Sources are `[source:<name>]` sections with a `url`, and profiles are
+    `[profile:<name>]` sections with a `path` and a comma separated list of
+    source names in `sources`. A `[path]` section with `firefox_profile` and
+    `bookmarks_url` is read as one more source and profile named "default".
+    Options not set in a profile section are taken from `[options]`.
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    sources: Dict[str, str] = {}
+    profiles: List[ProfileConfig] = []
+
+    if config.has_option("path", "bookmarks_url") and config.get("path", "bookmarks_url").strip():
+        sources[DEFAULT_NAME] = config.get("path", "bookmarks_url").strip()
+
+    for section in config.sections():
+        if section.startswith(SOURCE_PREFIX):
+            sources[section[len(SOURCE_PREFIX) :]] = config.get(section, "url").strip()
+
+    if config.has_option("path", "firefox_profile") and DEFAULT_NAME in sources:
+        profiles.append(
+            read_profile(config, "path", DEFAULT_NAME, config.get("path", "firefox_profile"), [DEFAULT_NAME])
+        )
+
+    for section in config.sections():
+        if not section.startswith(PROFILE_PREFIX):
+            continue
+
+        name = section[len(PROFILE_PREFIX) :]
+        names = [source.strip() for source in config.get(section, "sources", fallback="").split(",") if source.strip()]
+        if not names:
+            names = list(sources)
+        for source in names:
+            if source not in sources:
+                raise ValueError(f"Profile {name} refers to unknown source: {source}")
+
+        profiles.append(read_profile(config, section, name, config.get(section, "path"), names))
+
+    # One scope for all sources, as each document is parsed once for all profiles
+    scope = read_scope(
+        config.get("scope", "include", fallback=""),
+        config.get("scope", "exclude", fallback=""),
+        config.get("scope", "allow_hosts", fallback=""),
+        config.get("scope", "deny_hosts", fallback=""),
+        config.getint("scope", "max_depth", fallback=0),
+    )
+    for profile in profiles:
+        profile.scope = scope
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for name, url in sources.items():
+        # Plain paths are relative to the configuration file, file:// URLs are not touched
+        if local_path(url) == url:
+            sources[name] = os.path.join(base_dir, os.path.expanduser(url))
+    cache_dir = os.path.join(base_dir, config.get("path", "cache_dir", fallback=".cache"))
+
+    report = config.get("options", "report", fallback="").strip()
+    for profile in profiles:
+        profile.report = bool(report)
+    report_format = config.get("options", "report_format", fallback="json").strip().lower()
+    if report_format not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report_format: {report_format}. Expected one of: {', '.join(REPORT_FORMATS)}")
+
+    return RunConfig(
+        sources,
+        profiles,
+        cache_dir,
+        os.path.join(base_dir, report) if report else "",
+        report_format,
+        config.getint("options", "parallel_parse_threshold", fallback=RunConfig.parallel_parse_threshold),
+        config.getfloat("options", "poll_interval", fallback=RunConfig.poll_interval),
+        scope,
+    )
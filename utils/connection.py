@@ -0,0 +1,86 @@
+"""
+Connection settings that make an import faster without changing what it writes.
+
+All of them are per connection and are put back before the connection closes,
+so the checkpoint on close runs with the durability Firefox expects.
+"""
+
+import sqlite3
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+SYNCHRONOUS_LEVELS = ["off", "normal"]
+
+TEMP_STORE_MEMORY = 2
+
+# Large enough that no statement of an import is evicted and prepared again
+STATEMENT_CACHE = 256
+
+
+@dataclass
+class ConnectionTuning:
+    # Page cache in KiB
+    cache_size: int = 65536
+    mmap_size: int = 256 * 1024 * 1024
+    # Level used during the import transaction when Firefox is not running
+    synchronous: str = "normal"
+
+    def pragmas(self) -> Dict[str, int]:
+        # A negative cache_size is in KiB instead of pages
+        return {"cache_size": -self.cache_size, "temp_store": TEMP_STORE_MEMORY, "mmap_size": self.mmap_size}
+
+
+def read_pragma(conn: sqlite3.Connection, name: str) -> int:
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+class TunedConnection(sqlite3.Connection):
+    """
+    Connection that applies a ConnectionTuning and restores the previous
+    settings in `close`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tuning: Optional[ConnectionTuning] = None
+        self.saved: Dict[str, int] = {}
+        # synchronous level to restore after the import transaction
+        self.relaxed: Optional[int] = None
+
+    def tune(self, tuning: ConnectionTuning):
+        """
+        Apply the cache, temp store and mmap settings. Changing temp_store drops
+        temp tables and triggers, so this runs before any are created.
+        """
+        for name, value in tuning.pragmas().items():
+            self.saved[name] = read_pragma(self, name)
+            self.execute(f"PRAGMA {name} = {value}")
+        self.tuning = tuning
+
+    def relax_synchronous(self):
+        """
+        Lower synchronous for the next transaction. SQLite refuses to change it
+        inside one, so it is called before the import writes anything.
+        """
+        if self.tuning is None or self.relaxed is not None:
+            return
+        self.relaxed = read_pragma(self, "synchronous")
+        self.execute(f"PRAGMA synchronous = {self.tuning.synchronous.upper()}")
+
+    def restore_synchronous(self):
+        if self.relaxed is None:
+            return
+        if self.in_transaction:
+            self.rollback()
+        self.execute(f"PRAGMA synchronous = {self.relaxed}")
+        self.relaxed = None
+
+    def close(self):
+        try:
+            self.restore_synchronous()
+            for name, value in self.saved.items():
+                self.execute(f"PRAGMA {name} = {value}")
+        except sqlite3.ProgrammingError:
+            # Already closed
+            pass
+        super().close()
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+import zlib
+from typing import Callable, Dict, Iterator, Optional
+from urllib import request
+from urllib.parse import urlparse
+
+import urllib.error
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FetchResult(object):
+    def __init__(self, url: str, body_path: str, digest: str, not_modified: bool):
+        self.url = url
+        self.body_path = body_path
+        self.digest = digest
+        self.not_modified = not_modified
+
+    def read(self) -> bytes:
+        with open(self.body_path, "rb") as f:
+            return f.read()
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with open(self.body_path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def load_entry(cache_dir: str, url: str) -> Dict:
+    path = os.path.join(cache_dir, cache_key(url) + ".json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if entry.get("url") != url:
+        return {}
+    return entry
+
+
+def save_entry(cache_dir: str, url: str, entry: Dict):
+    path = os.path.join(cache_dir, cache_key(url) + ".json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entry, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def local_path(url: str) -> Optional[str]:
+    """
+    The file a `file://` URL or a plain path points to, None for other URLs.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return request.url2pathname(parsed.path)
+    # A single letter scheme is a Windows drive
+    if len(parsed.scheme) <= 1:
+        return url
+    return None
+
+
+def read_local(url: str, path: str, cache_dir: str) -> FetchResult:
+    """
+    Use a local file in place. Its digest is computed again only when its size
+    or modification time changed, which makes an unchanged file as cheap as a
+    304. Raises OSError if the file cannot be read.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = load_entry(cache_dir, url)
+    stat = os.stat(path)
+    if entry.get("digest") and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+        return FetchResult(url, path, entry["digest"], not_modified=True)
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    entry.update({"url": url, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest.hexdigest()})
+    save_entry(cache_dir, url, entry)
+    return FetchResult(url, path, entry["digest"], not_modified=False)
+
+
+def fetch_source(url: str, cache_dir: str, on_chunk: Optional[Callable[[bytes], None]] = None) -> FetchResult:
+    """
+    Download `url` into the cache, sending the validators of the cached copy so an
+    unchanged document costs a single 304 round trip. Raises the same
+    `urllib.error` exceptions as `urlopen`.
+
+    `on_chunk` receives the decoded body as it downloads. It is not called when
+    the server answers 304 or for local files; read `body_path` instead.
+    """
+    path = local_path(url)
+    if path is not None:
+        return read_local(url, path, cache_dir)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = load_entry(cache_dir, url)
+    body_path = os.path.join(cache_dir, cache_key(url) + ".body")
+    cached = bool(entry.get("digest")) and os.path.exists(body_path)
+
+    req = request.Request(url, headers={"Accept-Encoding": "gzip"})
+    if cached:
+        if entry.get("etag"):
+            req.add_header("If-None-Match", entry["etag"])
+        if entry.get("last_modified"):
+            req.add_header("If-Modified-Since", entry["last_modified"])
+
+    try:
+        response = request.urlopen(req)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            return FetchResult(url, body_path, entry["digest"], not_modified=True)
+        raise
+
+    with response:
+        decompressor = None
+        if (response.headers.get("Content-Encoding") or "").lower() == "gzip":
+            decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+
+        digest = hashlib.sha256()
+        tmp_path = body_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                digest.update(chunk)
+                f.write(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+            if decompressor:
+                chunk = decompressor.flush()
+                digest.update(chunk)
+                f.write(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+        os.replace(tmp_path, body_path)
+
+        entry.update(
+            {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "digest": digest.hexdigest(),
+            }
+        )
+    save_entry(cache_dir, url, entry)
+
+    return FetchResult(url, body_path, entry["digest"], not_modified=False)
+
+
+def is_imported(cache_dir: str, result: FetchResult, target: str) -> bool:
+    entry = load_entry(cache_dir, result.url)
+    return entry.get("imported", {}).get(target) == result.digest
+
+
+def mark_imported(cache_dir: str, result: FetchResult, target: str):
+    """
+    Remember that `target` now holds the document with the digest of `result`.
+    """
+    entry = load_entry(cache_dir, result.url)
+    entry.setdefault("imported", {})[target] = result.digest
+    save_entry(cache_dir, result.url, entry)
+
+
+def unmark_imported(cache_dir: str, target: str):
+    """
+    Forget that any source was imported into `target` or a target below it,
+    such as the roots of a profile database after a rollback.
+    """
+    for path in glob.glob(os.path.join(glob.escape(cache_dir), "*.json")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        imported = entry.get("imported", {})
+        stale = [key for key in imported if key == target or key.startswith(target + "#")]
+        if stale and entry.get("url"):
+            for key in stale:
+                del imported[key]
+            save_entry(cache_dir, entry["url"], entry)
@@ -8,10 +8,16 @@ you can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 import base64
+import json
 import secrets
+from sqlite3 import Cursor
+from typing import Iterator, List, Optional
 
 
 GUID_LENGTH = 12
+GUID_BYTES = (GUID_LENGTH * 3) // 4
+# GUIDs drawn and checked against the database at a time
+GUID_BATCH = 1024
 
 
 def generate_guid():
@@ -26,6 +32,41 @@ def generate_guid():
     return guid
 
 
+def generate_guids(count: int) -> List[str]:
+    """
+    `count` GUIDs from a single draw of random bytes. Every 9 bytes encode to
+    exactly 12 base64 characters, so the encoded block is sliced without padding.
+    """
+    encoded = base64.urlsafe_b64encode(secrets.token_bytes(GUID_BYTES * count)).decode('ascii')
+    return [encoded[i:i + GUID_LENGTH] for i in range(0, len(encoded), GUID_LENGTH)]
+
+
+def guid_allocator(db: Optional[Cursor] = None, batch_size: int = GUID_BATCH) -> Iterator[str]:
+    """
+    Endless supply of GUIDs generated `batch_size` at a time. With `db`, each batch
+    is checked against moz_bookmarks and moz_places in one query and GUIDs already
+    taken are dropped. The check runs on a cursor of its own, so the GUIDs can be
+    drawn while `db` is in the middle of an executemany.
+    """
+    cursor = db.connection.cursor() if db is not None else None
+    while True:
+        batch = list(dict.fromkeys(generate_guids(batch_size)))
+        if cursor is not None:
+            taken = {
+                guid
+                for guid, in cursor.execute(
+                    """
+                    SELECT guid FROM moz_bookmarks WHERE guid IN (SELECT value FROM json_each(:guids))
+                    UNION ALL
+                    SELECT guid FROM moz_places WHERE guid IN (SELECT value FROM json_each(:guids))
+                    """,
+                    {"guids": json.dumps(batch)},
+                )
+            }
+            batch = [guid for guid in batch if guid not in taken]
+        yield from batch
+
+
 def is_valid_guid(guid: str) -> bool:
     if len(guid) != GUID_LENGTH:
         return False
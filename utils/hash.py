@@ -10,8 +10,23 @@ License, v. 2.0. If a copy of the MPL was not distributed with this file,
 you can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
+from functools import lru_cache
+from typing import List, Sequence
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 GOLDEN_RATIO = 0x9E3779B9
 
+# Bounded so long imports do not keep every URL alive
+URL_CACHE_SIZE = 1 << 16
+
+# Below this many URLs the vectorized path costs more than it saves
+NUMPY_MIN_BATCH = 256
+NUMPY_BATCH_SIZE = 4096
+
 
 def rotate_left(value):
     return ((value << 5) | (value >> 27)) & 0xFFFFFFFF
@@ -28,17 +43,70 @@ def hash_simple(s, l):
     return hash_value & 0xFFFFFFFF
 
 
-def hash_url(url):
-    l = len(url)
-    prefix = -1
-    for i in range(l):
-        if url[i] == ':':
-            prefix = i
-            break
+def hash_chars(hash_value, s):
+    for c in map(ord, s):
+        hash_value = (GOLDEN_RATIO * ((((hash_value << 5) | (hash_value >> 27)) & 0xFFFFFFFF) ^ c)) & 0xFFFFFFFF
+    return hash_value
+
 
-    return (((hash_simple(url, prefix) & 0x0000FFFF) << 32) & 0xFFFFFFFFFFFFFFFF) + (
-        hash_simple(url, l) & 0xFFFFFFFFFFFFFFFF
-    )
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def hash_url(url):
+    """
+    Same result as hashing the scheme and the whole URL separately with
+    `hash_simple`, but in one pass: the prefix hash is the running hash at the
+    first ':'.
+    """
+    prefix = url.find(':')
+    if prefix < 0:
+        return hash_chars(0, url)
+
+    prefix_hash = hash_chars(0, url[:prefix])
+    return ((prefix_hash & 0x0000FFFF) << 32) + hash_chars(prefix_hash, url[prefix:])
+
+
+def hash_urls_numpy(urls: Sequence[str]) -> List[int]:
+    """
+    Hash URLs column by column over a padded codepoint matrix. URLs are sorted by
+    length and processed in batches to bound the padding.
+    """
+    results = [0] * len(urls)
+    order = sorted(range(len(urls)), key=lambda i: len(urls[i]))
+
+    for start in range(0, len(order), NUMPY_BATCH_SIZE):
+        batch = order[start : start + NUMPY_BATCH_SIZE]
+        batch_urls = [urls[i] for i in batch]
+        lengths = numpy.array([len(url) for url in batch_urls], dtype=numpy.int64)
+        prefixes = numpy.array([url.find(':') for url in batch_urls], dtype=numpy.int64)
+        width = int(lengths.max())
+        if width == 0:
+            continue
+
+        padded = "".join(url.ljust(width, "\0") for url in batch_urls).encode("utf-32-le")
+        codes = numpy.frombuffer(padded, dtype=numpy.uint32).reshape(len(batch), width).astype(numpy.uint64)
+
+        hashes = numpy.zeros(len(batch), dtype=numpy.uint64)
+        prefix_hashes = numpy.zeros(len(batch), dtype=numpy.uint64)
+        for column in range(width):
+            prefix_hashes = numpy.where(prefixes == column, hashes, prefix_hashes)
+            rotated = ((hashes << numpy.uint64(5)) | (hashes >> numpy.uint64(27))) & numpy.uint64(0xFFFFFFFF)
+            updated = (numpy.uint64(GOLDEN_RATIO) * (rotated ^ codes[:, column])) & numpy.uint64(0xFFFFFFFF)
+            hashes = numpy.where(lengths > column, updated, hashes)
+
+        combined = ((prefix_hashes & numpy.uint64(0x0000FFFF)) << numpy.uint64(32)) + hashes
+        for index, value in zip(batch, combined.tolist()):
+            results[index] = value
+
+    return results
+
+
+def hash_urls(urls: Sequence[str]) -> List[int]:
+    """
+    Hash many URLs at once, using NumPy when it is installed and the batch is
+    large enough to benefit.
+    """
+    if numpy is not None and len(urls) >= NUMPY_MIN_BATCH:
+        return hash_urls_numpy(urls)
+    return [hash_url(url) for url in urls]
 
 
 def hash_function(*args) -> str:
@@ -56,3 +124,7 @@ def hash_function(*args) -> str:
         res += 0xFFFFFFFF
 
     return str(res)
+
+
+PLACE_PREFIX_LO = int(hash_function("place", "prefix_lo"))
+PLACE_PREFIX_HI = int(hash_function("place", "prefix_hi"))
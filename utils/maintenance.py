@@ -0,0 +1,125 @@
+"""
+Maintenance queries can be found here:
+
+https://searchfox.org/mozilla-central/source/toolkit/components/places/PlacesDBUtils.sys.mjs
+
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this file,
+you can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import time
+from dataclasses import dataclass
+from sqlite3 import Connection, Cursor
+
+# Tables whose rows keep an unvisited, unbookmarked place alive
+PLACE_REFERENCES = [
+    ("moz_historyvisits", "place_id"),
+    ("moz_annos", "place_id"),
+    ("moz_inputhistory", "place_id"),
+    ("moz_places_metadata", "place_id"),
+]
+
+# Pages released per incremental_vacuum step, so the time budget is checked often
+VACUUM_STEP_PAGES = 256
+
+ANALYZED_TABLES = ["moz_places", "moz_bookmarks", "moz_origins"]
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+@dataclass
+class MaintenanceStats:
+    foreign_counts: int = 0
+    places: int = 0
+    origins: int = 0
+    freed_bytes: int = 0
+    vacuumed_bytes: int = 0
+    analyzed: bool = False
+
+    def __str__(self) -> str:
+        return (
+            f"{self.foreign_counts} foreign counts fixed, {self.places} orphaned places and "
+            f"{self.origins} unused origins removed, {self.freed_bytes} bytes freed, "
+            f"{self.vacuumed_bytes} bytes returned to the file system"
+        )
+
+
+def table_exists(db: Cursor, table: str) -> bool:
+    return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def free_bytes(db: Cursor) -> int:
+    page_size = db.execute("PRAGMA page_size").fetchone()[0]
+    return db.execute("PRAGMA freelist_count").fetchone()[0] * page_size
+
+
+def clean_places(db: Cursor, stats: MaintenanceStats) -> MaintenanceStats:
+    """
+    Recompute moz_places.foreign_count from moz_bookmarks and moz_keywords, then
+    delete the places nothing references any more and the origins left without
+    places. Runs after the import committed; the caller commits.
+    """
+    freed = free_bytes(db)
+
+    keywords = (
+        " + (SELECT COUNT(*) FROM moz_keywords WHERE place_id = moz_places.id)"
+        if table_exists(db, "moz_keywords")
+        else ""
+    )
+    foreign_count = f"(SELECT COUNT(*) FROM moz_bookmarks WHERE fk = moz_places.id){keywords}"
+    stats.foreign_counts = db.execute(
+        f"UPDATE moz_places SET foreign_count = {foreign_count} WHERE foreign_count <> {foreign_count}"
+    ).rowcount
+
+    references = "".join(
+        f" AND NOT EXISTS (SELECT 1 FROM {table} WHERE {column} = moz_places.id)"
+        for table, column in PLACE_REFERENCES
+        if table_exists(db, table)
+    )
+    stats.places = db.execute(
+        f"""
+        DELETE FROM moz_places
+        WHERE foreign_count = 0 AND visit_count = 0 AND last_visit_date IS NULL{references}
+        """
+    ).rowcount
+    stats.origins = db.execute(
+        """
+        DELETE FROM moz_origins
+        WHERE NOT EXISTS (SELECT 1 FROM moz_places WHERE origin_id = moz_origins.id)
+        """
+    ).rowcount
+
+    stats.freed_bytes = max(free_bytes(db) - freed, 0)
+    return stats
+
+
+def optimize(conn: Connection, stats: MaintenanceStats, analyze: bool, budget: float) -> MaintenanceStats:
+    """
+    Run ANALYZE and release free pages with incremental_vacuum until `budget`
+    seconds have passed. Runs after the import committed; a budget of 0 skips both.
+    """
+    deadline = time.monotonic() + budget
+    db = conn.cursor()
+
+    if analyze and budget > 0:
+        for table in ANALYZED_TABLES:
+            if time.monotonic() >= deadline:
+                break
+            db.execute(f"ANALYZE {table}")
+            stats.analyzed = True
+        conn.commit()
+
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        return stats
+
+    page_size = db.execute("PRAGMA page_size").fetchone()[0]
+    while time.monotonic() < deadline:
+        free_pages = db.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free_pages:
+            break
+        db.execute(f"PRAGMA incremental_vacuum({min(free_pages, VACUUM_STEP_PAGES)})").fetchall()
+        stats.vacuumed_bytes += (free_pages - db.execute("PRAGMA freelist_count").fetchone()[0]) * page_size
+
+    return stats
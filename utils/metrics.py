@@ -0,0 +1,212 @@
+"""
+Run metrics: wall and CPU time per stage, SQL statement and UDF call counts and
+the rows each import added to or removed from the places tables.
+
+Library code marks its stages with `stage(name)`, which only records something
+while a `Metrics` object is active in the process. Stages may nest; the time of
+a nested stage is also included in the enclosing one.
+"""
+
+import json
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from sqlite3 import Connection
+from typing import Callable, Dict, Iterator, List, Optional
+
+from utils.backup import JOURNALED_TABLES
+
+REPORT_FORMATS = ["json", "prometheus"]
+
+METRIC_PREFIX = "bookmark_import"
+
+# Progress handler granularity in SQLite virtual machine instructions
+PROGRESS_STEPS = 1000
+
+# Statements longer than this are truncated in the per-statement profile
+STATEMENT_KEY_LENGTH = 120
+
+
+class Metrics(object):
+    def __init__(self):
+        # name -> [wall seconds, cpu seconds, calls]
+        self.stages: Dict[str, List[float]] = {}
+        self.counters: Counter = Counter()
+        self.statements: Counter = Counter()
+        self.rows: Dict[str, Dict[str, int]] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            timing = self.stages.setdefault(name, [0.0, 0.0, 0])
+            timing[0] += time.perf_counter() - start
+            timing[1] += time.process_time() - cpu
+            timing[2] += 1
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    def counted(self, name: str, fn: Callable) -> Callable:
+        """
+        Wrap a function registered with `create_function` so its calls are counted.
+        """
+        key = f"udf:{name}"
+
+        def wrapper(*args):
+            self.counters[key] += 1
+            return fn(*args)
+
+        return wrapper
+
+    def attach(self, conn: Connection, profile_sql: bool = False):
+        """
+        Count the statements `conn` runs. Statements run by triggers are
+        reported with the text of the statement that fired them. With
+        `profile_sql` also count each distinct statement and the virtual machine
+        instructions executed, in steps of PROGRESS_STEPS.
+        """
+
+        def trace(statement: str):
+            self.counters["sql_statements"] += 1
+            if profile_sql:
+                self.statements[" ".join(statement.split())[:STATEMENT_KEY_LENGTH]] += 1
+
+        def progress() -> int:
+            self.counters["sqlite_vm_steps"] += PROGRESS_STEPS
+            return 0
+
+        conn.set_trace_callback(trace)
+        if profile_sql:
+            conn.set_progress_handler(progress, PROGRESS_STEPS)
+
+    def count_rows(self, conn: Connection):
+        """
+        Count the rows inserted into and deleted from every places table with
+        temp triggers, read back by `collect_rows`.
+        """
+        # Dropped rather than emptied, which would leave a transaction open for the import
+        conn.execute("DROP TABLE IF EXISTS temp.metrics_rows")
+        conn.execute("CREATE TEMP TABLE metrics_rows (tbl TEXT, change TEXT, n INTEGER, PRIMARY KEY (tbl, change))")
+        for table in JOURNALED_TABLES:
+            for event, change in [("INSERT", "inserted"), ("DELETE", "deleted")]:
+                conn.execute(
+                    f"""
+                    CREATE TEMP TRIGGER IF NOT EXISTS metrics_{table}_after{event.lower()}_trigger
+                    AFTER {event} ON main.{table} FOR EACH ROW
+                    BEGIN
+                        INSERT INTO metrics_rows (tbl, change, n) VALUES ('{table}', '{change}', 1)
+                        ON CONFLICT(tbl, change) DO UPDATE SET n = n + 1;
+                    END
+                    """
+                )
+
+    def collect_rows(self, conn: Connection):
+        for table, change, n in conn.execute("SELECT tbl, change, n FROM temp.metrics_rows ORDER BY tbl, change"):
+            self.rows.setdefault(table, {})[change] = n
+
+    def to_dict(self) -> Dict:
+        report = {
+            "stages": {
+                name: {"wall_seconds": round(wall, 6), "cpu_seconds": round(cpu, 6), "calls": calls}
+                for name, (wall, cpu, calls) in self.stages.items()
+            },
+            "counters": dict(self.counters),
+            "rows": self.rows,
+        }
+        if self.statements:
+            report["statements"] = dict(self.statements.most_common())
+        return report
+
+
+_active: Optional[Metrics] = None
+
+
+@contextmanager
+def activate(metrics: Metrics) -> Iterator[Metrics]:
+    global _active
+    previous, _active = _active, metrics
+    try:
+        yield metrics
+    finally:
+        _active = previous
+
+
+def stage(name: str):
+    return _active.stage(name) if _active else nullcontext()
+
+
+def prometheus_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_prometheus(report: Dict) -> str:
+    """
+    Render a run report in the Prometheus text format, for the node_exporter
+    textfile collector.
+    """
+    samples: Dict[str, List[str]] = {}
+
+    def add(name: str, labels: Dict[str, str], value):
+        label_text = ",".join(f'{key}="{prometheus_label(str(label))}"' for key, label in labels.items())
+        label_text = f"{{{label_text}}}" if label_text else ""
+        samples.setdefault(name, []).append(f"{METRIC_PREFIX}_{name}{label_text} {value}")
+
+    def add_metrics(labels: Dict[str, str], metrics: Dict):
+        for name, timing in metrics.get("stages", {}).items():
+            add("stage_wall_seconds", {**labels, "stage": name}, timing["wall_seconds"])
+            add("stage_cpu_seconds", {**labels, "stage": name}, timing["cpu_seconds"])
+        for name, value in metrics.get("counters", {}).items():
+            if name.startswith("udf:"):
+                add("udf_calls", {**labels, "function": name[4:]}, value)
+            else:
+                add(name, labels, value)
+        for table, changes in metrics.get("rows", {}).items():
+            for change, value in changes.items():
+                add("rows", {**labels, "table": table, "change": change}, value)
+
+    add("last_run_timestamp_seconds", {}, report["started"])
+    add("duration_seconds", {}, report["duration_seconds"])
+    add_metrics({}, report)
+    for name, profile in report.get("profiles", {}).items():
+        add("success", {"profile": name}, int(profile["ok"]))
+        add_metrics({"profile": name}, profile)
+
+    lines = []
+    for name, values in samples.items():
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        lines.extend(values)
+    return "\n".join(lines) + "\n"
+
+
+def run_report(started: float, metrics: Metrics, results: Dict[str, tuple]) -> Dict:
+    """
+    Report of a run started at `started`, with one (ok, message, metrics dict)
+    entry per profile in `results`.
+    """
+    return {
+        "started": int(started),
+        "duration_seconds": round(time.time() - started, 6),
+        **metrics.to_dict(),
+        "profiles": {
+            name: {"ok": ok, "message": message, **profile_metrics}
+            for name, (ok, message, profile_metrics) in results.items()
+        },
+    }
+
+
+def write_report(path: str, report: Dict, report_format: str = "json"):
+    """
+    Write the report through a temporary file so readers never see a partial one.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        if report_format == "prometheus":
+            f.write(to_prometheus(report))
+        else:
+            json.dump(report, f, indent=2)
+    os.replace(temp_path, path)
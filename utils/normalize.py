@@ -0,0 +1,179 @@
+"""
+Optional URL canonicalization, so links that differ only in spelling share one
+moz_places row.
+
+Rules, given by name in `normalize_urls`:
+
+- `host`: lowercase the scheme and host and drop the default port
+- `trailing_slash`: drop the trailing "/" of a path, keeping the root "/"
+- `params`: drop query parameters whose name matches a `strip_params` glob
+- `fragment`: drop the "#..." part
+
+Only http and https URLs are rewritten. Spellings that normalize to the same
+URL are collapsed to one before any SQL runs, onto an existing place with that
+normalized URL if there is one, otherwise onto the normalized URL itself.
+"""
+
+import fnmatch
+import hashlib
+import json
+from dataclasses import dataclass, field
+from sqlite3 import Cursor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+from utils.hash import hash_urls
+
+NORMALIZE_RULES = ["host", "trailing_slash", "params", "fragment"]
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+NORMALIZED_SCHEMES = set(DEFAULT_PORTS)
+
+# url_hash and normalized URL
+UrlKey = Tuple[int, str]
+
+
+@dataclass(frozen=True)
+class UrlNormalization:
+    rules: Tuple[str, ...] = ()
+    strip_params: Tuple[str, ...] = ("utm_*",)
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def key(self) -> str:
+        return hashlib.sha1(repr(self).encode("utf-8")).hexdigest()[:12]
+
+    def stripped(self, segment: str) -> bool:
+        name = unquote_plus(segment.partition("=")[0]).lower()
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.strip_params)
+
+    def normalize(self, url: str) -> str:
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return url
+        if parts.scheme.lower() not in NORMALIZED_SCHEMES:
+            return url
+
+        scheme, netloc, path, query, fragment = parts
+        if "host" in self.rules:
+            scheme = scheme.lower()
+            host = parts.hostname or ""
+            if ":" in host:
+                host = f"[{host}]"
+            credentials = netloc.rpartition("@")[0]
+            netloc = (credentials + "@" if credentials else "") + host
+            if port is not None and port != DEFAULT_PORTS[scheme]:
+                netloc += f":{port}"
+        if "trailing_slash" in self.rules:
+            path = path.rstrip("/") or "/"
+        if "params" in self.rules and query:
+            # Kept parameters are left exactly as written, only stripped ones are dropped
+            query = "&".join(segment for segment in query.split("&") if not self.stripped(segment))
+        if "fragment" in self.rules:
+            fragment = ""
+        return urlunsplit((scheme, netloc, path, query, fragment))
+
+
+@dataclass
+class NormalizeStats:
+    urls: int = 0
+    collapsed: int = 0
+    matched: int = 0
+    rows_saved: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.urls} distinct URLs, {self.collapsed} collapsed into another spelling, "
+            f"{self.matched} mapped onto existing places, {self.rows_saved} places rows saved"
+        )
+
+
+@dataclass
+class UrlIndex:
+    """
+    Canonical URL of every spelling in a document, keyed by the url_hash and
+    text of its normalized form.
+    """
+
+    normalization: UrlNormalization
+    canonical: Dict[UrlKey, str] = field(default_factory=dict)
+    # Spelling in the document -> URL written to the database
+    mapping: Dict[str, str] = field(default_factory=dict)
+
+    def keys(self, urls: List[str]) -> List[UrlKey]:
+        normalized = [self.normalization.normalize(url) for url in urls]
+        return list(zip(hash_urls(normalized), normalized))
+
+    def build(self, db: Cursor, urls: Iterable[str]) -> NormalizeStats:
+        """
+        Collapse the spellings of `urls` and map them onto existing places, read
+        with one query over the hosts of the document.
+        """
+        spellings = list(dict.fromkeys(urls))
+        keys = self.keys(spellings)
+
+        existing = load_places_on_hosts(db, spellings)
+        # The existing place with the highest frecency wins its key
+        existing.sort(key=lambda place: -place[1])
+        existing_urls = {url for url, _ in existing}
+        for key, (url, _) in zip(self.keys([url for url, _ in existing]), existing):
+            self.canonical.setdefault(key, url)
+        matched = {key for key in keys if key in self.canonical}
+
+        for key, url in zip(keys, spellings):
+            self.mapping[url] = self.canonical.setdefault(key, key[1])
+
+        stats = NormalizeStats(urls=len(spellings))
+        stats.collapsed = len(spellings) - len(set(keys))
+        stats.matched = sum(1 for key in matched if self.canonical[key] not in self.mapping)
+        # Rows a verbatim import would add, minus the rows this one adds
+        new_verbatim = sum(1 for url in spellings if url not in existing_urls)
+        stats.rows_saved = new_verbatim - (len(set(keys)) - len(matched))
+        return stats
+
+
+def rev_hosts(urls: Iterable[str]) -> Set[str]:
+    """
+    Reversed hosts the places of the http and https `urls` may be stored under,
+    with and without the case and port of the document.
+    """
+    hosts: Set[str] = set()
+    for url in urls:
+        try:
+            parts = urlsplit(url)
+            if parts.scheme.lower() not in NORMALIZED_SCHEMES or not parts.hostname:
+                continue
+            hosts.add(parts.netloc[::-1] + ".")
+            hosts.add(parts.hostname[::-1] + ".")
+        except ValueError:
+            continue
+    return hosts
+
+
+def load_places_on_hosts(db: Cursor, urls: List[str]) -> List[Tuple[str, int]]:
+    """
+    url and frecency of the existing places on the hosts of `urls`.
+    """
+    rows = db.execute(
+        "SELECT url, frecency FROM moz_places WHERE rev_host IN (SELECT value FROM json_each(:hosts))",
+        {"hosts": json.dumps(sorted(rev_hosts(urls)))},
+    ).fetchall()
+    return [(url, frecency) for url, frecency in rows if url is not None]
+
+
+def split_rules(value: str) -> Tuple[str, ...]:
+    return tuple(rule.strip().lower() for rule in value.replace(",", " ").split())
+
+
+def read_normalization(rules: str, strip_params: str) -> Optional[UrlNormalization]:
+    normalization = UrlNormalization(split_rules(rules), split_rules(strip_params))
+    unknown = set(normalization.rules) - set(NORMALIZE_RULES)
+    if unknown:
+        raise ValueError(
+            f"Unknown normalize_urls rule: {', '.join(sorted(unknown))}. Expected any of: {', '.join(NORMALIZE_RULES)}"
+        )
+    return normalization or None
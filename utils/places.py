@@ -10,8 +10,31 @@ you can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
 from sqlite3 import Cursor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from urllib.parse import urlparse
 
+from utils.guid import generate_guid, guid_allocator
+from utils.hash import hash_urls
+
+# url, url_hash, rev_host, hidden, frecency, guid, origin prefix, origin host
+PlaceRow = Tuple[str, int, str, int, int, str, str, str]
+
+# Statements run once per URL, kept as constants so the prepared statement is reused
+INSERT_PLACE = """
+INSERT OR IGNORE INTO moz_places (url, url_hash, rev_host, hidden, frecency, guid)
+VALUES (
+    :url, HASH(:url), :rev_host,
+    (CASE WHEN :url BETWEEN 'place:' AND 'place:' || X'FFFF' THEN 1 ELSE 0 END),
+    :frecency,
+    IFNULL(
+        (SELECT guid FROM moz_places WHERE url_hash = hash(:url) AND url = :url),
+        :guid
+    )
+)
+"""
+
+FETCH_PLACE_ID = "SELECT id FROM moz_places WHERE url = :url"
+
 
 def get_prefix(url: str) -> str:
     scheme = urlparse(url).scheme
@@ -25,33 +48,136 @@ def get_host_and_port(url: str) -> str:
 def maybe_insert_place(db: Cursor, url: str) -> None:
     parsed = urlparse(url)
     db.execute(
-        """
-        INSERT OR IGNORE INTO moz_places (url, url_hash, rev_host, hidden, frecency, guid)
-        VALUES (
-            :url, HASH(:url), :rev_host,
-            (CASE WHEN :url BETWEEN 'place:' AND 'place:' || X'FFFF' THEN 1 ELSE 0 END),
-            :frecency,
-            IFNULL(
-                (SELECT guid FROM moz_places WHERE url_hash = hash(:url) AND url = :url),
-                GENERATE_GUID()
-            )
-        )
-        """,
+        INSERT_PLACE,
         {
             "url": url,
             "rev_host": parsed.netloc[::-1] + ".",
             "frecency": 0 if parsed.scheme == "place" else -1,
+            "guid": generate_guid(),
         },
     )
 
 
-def fetch_place_id(db: Cursor, url: str) -> int:
-    row = db.execute(
+def place_rows(urls: Iterable[str], guids: Optional[Iterator[str]] = None) -> List[PlaceRow]:
+    """
+    Compute the moz_places columns of every distinct URL in one pass, along with
+    the prefix and host of its origin. GUIDs are taken from `guids`.
+    """
+    guids = guids or guid_allocator()
+    unique_urls = list(dict.fromkeys(urls))
+    rows: List[PlaceRow] = []
+    for url, url_hash in zip(unique_urls, hash_urls(unique_urls)):
+        parsed = urlparse(url)
+        rows.append(
+            (
+                url,
+                url_hash,
+                parsed.netloc[::-1] + ".",
+                1 if url.startswith("place:") else 0,
+                0 if parsed.scheme == "place" else -1,
+                next(guids),
+                parsed.scheme + "://" if parsed.scheme else "",
+                parsed.netloc or "",
+            )
+        )
+
+    return rows
+
+
+def bulk_insert_places(db: Cursor, urls: Iterable[str], bulk_origins: bool = False) -> Dict[str, int]:
+    """
+    Insert every missing URL into moz_places with one staged INSERT ... SELECT and
+    return a url -> place id map covering both new and existing places.
+
+    Hashes, reversed hosts and frecencies are computed once per distinct URL in
+    Python instead of through the SQL functions used by `maybe_insert_place`.
+    With `bulk_origins`, moz_origins is maintained by `insert_origins` instead of
+    the places afterinsert trigger, which must not be installed.
+    """
+    return insert_place_rows(db, place_rows(urls, guid_allocator(db)), bulk_origins)
+
+
+def insert_place_rows(db: Cursor, rows: List[PlaceRow], bulk_origins: bool = False) -> Dict[str, int]:
+    """
+    `bulk_insert_places` for rows already computed by `place_rows`.
+    """
+    if not rows:
+        return {}
+
+    db.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS places_import (
+            url TEXT PRIMARY KEY, url_hash INTEGER, rev_host TEXT,
+            hidden INTEGER, frecency INTEGER, guid TEXT,
+            prefix TEXT, host TEXT
+        )
+        """
+    )
+    db.execute("DELETE FROM temp.places_import")
+    db.executemany("INSERT OR IGNORE INTO temp.places_import VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    last_place_id = db.execute("SELECT IFNULL(MAX(id), 0) FROM moz_places").fetchone()[0]
+    db.execute(
+        """
+        INSERT OR IGNORE INTO moz_places (url, url_hash, rev_host, hidden, frecency, guid)
+        SELECT s.url, s.url_hash, s.rev_host, s.hidden, s.frecency, s.guid
+        FROM temp.places_import s
+        WHERE NOT EXISTS (SELECT 1 FROM moz_places p WHERE p.url_hash = s.url_hash AND p.url = s.url)
+        ORDER BY s.rowid
+        """
+    )
+    if bulk_origins:
+        insert_origins(db, last_place_id)
+    place_ids = db.execute(
+        """
+        SELECT s.url, MIN(p.id)
+        FROM temp.places_import s
+        JOIN moz_places p ON p.url_hash = s.url_hash AND p.url = s.url
+        GROUP BY s.url
+        """
+    ).fetchall()
+    db.execute("DELETE FROM temp.places_import")
+
+    return dict(place_ids)
+
+
+def insert_origins(db: Cursor, last_place_id: int, staged: str = "temp.places_import"):
+    """
+    Set-based equivalent of CREATE_PLACES_AFTERINSERT_TRIGGER for the places staged
+    in the `staged` table with an id above `last_place_id`. Origins are created
+    in place id order so each takes the frecency of its first new place.
+    """
+    db.execute(
+        """
+        INSERT INTO moz_origins (prefix, host, frecency, recalc_frecency, recalc_alt_frecency)
+        SELECT s.prefix, s.host, p.frecency, 1, 1
+        FROM moz_places p
+        JOIN {} s ON s.url = p.url
+        WHERE p.id > :last_place_id
+        ORDER BY p.id
+        ON CONFLICT(prefix, host) DO NOTHING
+        """.format(
+            staged
+        ),
+        {"last_place_id": last_place_id},
+    )
+    db.execute(
         """
-        SELECT id FROM moz_places WHERE url = :url
-        """,
-        {"url": url},
-    ).fetchone()
+        UPDATE moz_places SET origin_id = (
+            SELECT o.id
+            FROM {} s
+            JOIN moz_origins o ON o.prefix = s.prefix AND o.host = s.host
+            WHERE s.url = moz_places.url
+        )
+        WHERE id > :last_place_id
+        """.format(
+            staged
+        ),
+        {"last_place_id": last_place_id},
+    )
+
+
+def fetch_place_id(db: Cursor, url: str) -> int:
+    row = db.execute(FETCH_PLACE_ID, {"url": url}).fetchone()
 
     if row is None:
         return -1
@@ -0,0 +1,140 @@
+"""
+Rules selecting the part of a bookmark document that is imported.
+
+Folders are addressed by their path from the top level, with names joined by
+"/", e.g. "Video/Anime". A folder matching an `include` glob is imported with
+everything below it, and the folders on the way to it are imported as empty
+containers around it. Without `include` everything is selected. Folders
+matching an `exclude` glob are skipped with everything below them, bookmarks
+are kept only when their host passes `allow_hosts` and `deny_hosts`, and
+nothing deeper than `max_depth` levels is imported.
+"""
+
+import fnmatch
+import hashlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from urllib.parse import urlparse
+
+# What happens to a folder and its contents
+SKIP = 0
+# Not selected itself, only kept if something below it is
+CONTAINER = 1
+SELECTED = 2
+
+PATH_SEPARATOR = "/"
+
+# id, parent id, path of names from the top level including the item, folder, url
+ScopedItem = Tuple[int, int, Tuple[str, ...], bool, Optional[str]]
+
+
+def host_matches(host: str, hosts: Sequence[str]) -> bool:
+    # A listed domain also covers its subdomains
+    return any(host == pattern or host.endswith("." + pattern) for pattern in hosts)
+
+
+@dataclass(frozen=True)
+class Scope:
+    include: Tuple[str, ...] = ()
+    exclude: Tuple[str, ...] = ()
+    allow_hosts: Tuple[str, ...] = ()
+    deny_hosts: Tuple[str, ...] = ()
+    max_depth: int = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.include or self.exclude or self.allow_hosts or self.deny_hosts or self.max_depth)
+
+    def key(self) -> str:
+        """
+        Short digest of the rules, so a changed scope counts as a changed import.
+        """
+        return hashlib.sha1(repr(self).encode("utf-8")).hexdigest()[:12]
+
+    def root_state(self) -> int:
+        return CONTAINER if self.include else SELECTED
+
+    def folder_state(self, path: Tuple[str, ...], parent_state: int) -> int:
+        """
+        State of the folder at `path` inside a folder in `parent_state`.
+        """
+        if parent_state == SKIP or (self.max_depth and len(path) > self.max_depth):
+            return SKIP
+
+        joined = PATH_SEPARATOR.join(path)
+        if any(fnmatch.fnmatchcase(joined, pattern) for pattern in self.exclude):
+            return SKIP
+        if parent_state == SELECTED or any(fnmatch.fnmatchcase(joined, pattern) for pattern in self.include):
+            return SELECTED
+        return CONTAINER
+
+    def state_of(self, path: Tuple[str, ...]) -> int:
+        """
+        State of the folder at `path`, given from the top level.
+        """
+        state = self.root_state()
+        for depth in range(1, len(path) + 1):
+            state = self.folder_state(path[:depth], state)
+        return state
+
+    def keeps_bookmark(self, depth: int, url: str, parent_state: int) -> bool:
+        if parent_state != SELECTED or (self.max_depth and depth > self.max_depth):
+            return False
+        if not self.allow_hosts and not self.deny_hosts:
+            return True
+
+        host = (urlparse(url).hostname or "").lower()
+        if self.allow_hosts and not host_matches(host, self.allow_hosts):
+            return False
+        return not host_matches(host, self.deny_hosts)
+
+    def owns(self, path: Tuple[str, ...], folder: bool, url: Optional[str]) -> bool:
+        """
+        Whether an existing item at `path` is one an import with this scope
+        creates, so it may be replaced: a selected item or a container folder.
+        """
+        state = self.state_of(path if folder else path[:-1])
+        if state == SKIP:
+            return False
+        return folder or self.keeps_bookmark(len(path), url or "", state)
+
+
+def removable_ids(scope: Scope, items: Iterable[ScopedItem]) -> List[int]:
+    """
+    Ids among `items` that an import with `scope` may delete: the items it owns,
+    except folders that still hold an item it does not own.
+    """
+    items = list(items)
+    parents: Dict[int, int] = {id: parent for id, parent, _, _, _ in items}
+    kept: Set[int] = set()
+
+    for id, _, path, folder, url in items:
+        if scope.owns(path, folder, url):
+            continue
+        # Keep the item and every folder above it
+        while id in parents and id not in kept:
+            kept.add(id)
+            id = parents[id]
+
+    return [id for id, _, _, _, _ in items if id not in kept]
+
+
+def split_list(value: str) -> Tuple[str, ...]:
+    return tuple(part.strip() for part in value.replace(",", "\n").splitlines() if part.strip())
+
+
+def split_lines(value: str) -> Tuple[str, ...]:
+    # Folder names may contain commas, so globs are given one per line
+    return tuple(line.strip().strip(PATH_SEPARATOR) for line in value.splitlines() if line.strip())
+
+
+def read_scope(include: str, exclude: str, allow_hosts: str, deny_hosts: str, max_depth: int) -> Optional[Scope]:
+    scope = Scope(
+        include=split_lines(include),
+        exclude=split_lines(exclude),
+        allow_hosts=tuple(host.lower() for host in split_list(allow_hosts)),
+        deny_hosts=tuple(host.lower() for host in split_list(deny_hosts)),
+        max_depth=max_depth,
+    )
+    if scope.max_depth < 0:
+        raise ValueError(f"max_depth must not be negative: {scope.max_depth}")
+    return scope or None
@@ -0,0 +1,15 @@
+from typing import Iterator, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# SQLITE_MAX_VARIABLE_NUMBER defaults to 999 before SQLite 3.32
+MAX_VARIABLES = 999
+
+
+def chunked(items: Sequence[T], size: int = MAX_VARIABLES) -> Iterator[List[T]]:
+    for start in range(0, len(items), size):
+        yield list(items[start : start + size])
+
+
+def placeholders(count: int) -> str:
+    return ', '.join(['?'] * count)
@@ -8,8 +8,9 @@ License, v. 2.0. If a copy of the MPL was not distributed with this file,
 you can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
+from utils.hash import PLACE_PREFIX_HI, PLACE_PREFIX_LO
 
-IS_PLACE_QUERY = "url_hash BETWEEN HASH('place', 'prefix_lo') AND HASH('place', 'prefix_hi')"
+IS_PLACE_QUERY = f"url_hash BETWEEN {PLACE_PREFIX_LO} AND {PLACE_PREFIX_HI}"
 
 
 CREATE_BOOKMARKS_FOREIGNCOUNT_AFTERINSERT_TRIGGER = f"""